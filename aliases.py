@@ -0,0 +1,89 @@
+import os
+import re
+import time
+from utils import sqlite_connect, scontrini_cols
+
+# --- ALIAS: NOME GREZZO + NEGOZIO -> ID_PRODOTTO ---
+# Ogni riga salvata insegna che "LATTE GRAN PS" da ESSELUNGA è un certo prodotto.
+# Alla revisione successiva la riga viene risolta con una lettura per chiave, prima
+# (e al posto) del nome proposto dal modello; al salvataggio l'ID è già noto.
+# Lo storico degli Scontrini riempie l'archivio una volta (all'avvio), che poi si aggiorna a
+# ogni salvataggio. Gli alias verso prodotti eliminati (es. duplicati uniti) li toglie l'app
+# stessa, al più una volta ogni ALIAS_PRUNE_S, col Catalogo dello snapshot già caricato.
+
+ALIAS_PATH = os.environ.get("ALIAS_PATH", os.path.join(".cache", "aliases.db"))
+ALIAS_PRUNE_S = int(os.environ.get("ALIAS_PRUNE_S", str(24 * 3600)))
+
+
+def alias_key(raw, shop):
+    norm = lambda x: re.sub(r"\s+", " ", str(x)).strip().upper()
+    return norm(raw), norm(shop)
+
+
+class AliasStore:
+    def __init__(self, path=ALIAS_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self.connect() as conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS alias (
+                raw TEXT, shop TEXT, id TEXT, hits INTEGER, ts REAL, PRIMARY KEY (raw, shop))""")
+            conn.execute("CREATE TABLE IF NOT EXISTS alias_meta (k TEXT PRIMARY KEY, v REAL)")
+
+    def connect(self):
+        return sqlite_connect(self.path)
+
+    def get_many(self, keys):
+        """{(raw, shop): ID_PRODOTTO} per le chiavi note"""
+        out = {}
+        with self.connect() as conn:
+            for k in set(keys):
+                r = conn.execute("SELECT id FROM alias WHERE raw=? AND shop=?", k).fetchone()
+                if r: out[k] = r[0]
+        return out
+
+    def put_many(self, items):
+        """items: {(raw, shop): ID_PRODOTTO}; l'ultimo salvataggio vince"""
+        now = time.time()
+        with self.connect() as conn:
+            conn.executemany("""INSERT INTO alias VALUES (?, ?, ?, 1, ?)
+                ON CONFLICT (raw, shop) DO UPDATE SET id=excluded.id, hits=hits + 1, ts=excluded.ts""",
+                             [(*k, pid, now) for k, pid in items.items() if k[0] and pid])
+
+    def seed(self, df_scontrini):
+        """Riempie gli alias mancanti dallo storico Scontrini (non sovrascrive quelli esistenti)"""
+        c = scontrini_cols(df_scontrini.columns)
+        if df_scontrini.empty or df_scontrini.shape[1] <= max(c["nome_grezzo"], c["negozio"], c["id"]): return
+        col = lambda f: df_scontrini.iloc[:, c[f]]
+        rows = {}
+        for raw, shop, pid in zip(col("nome_grezzo"), col("negozio"), col("id")):
+            k, pid = alias_key(raw, shop), str(pid).strip()
+            if k[0] and pid: rows[k] = pid
+        now = time.time()
+        with self.connect() as conn:
+            conn.executemany("INSERT OR IGNORE INTO alias VALUES (?, ?, ?, 1, ?)", [(*k, pid, now) for k, pid in rows.items()])
+
+    def remap(self, mapping):
+        """mapping: {ID vecchio: ID nuovo} (es. duplicati uniti da catalog_dedup)"""
+        with self.connect() as conn:
+            conn.executemany("UPDATE alias SET id=? WHERE id=?", [(new, old) for old, new in mapping.items()])
+
+    def prune_due(self, every_s=ALIAS_PRUNE_S):
+        """True se l'ultima pulizia (di qualunque processo) è più vecchia di every_s"""
+        with self.connect() as conn:
+            r = conn.execute("SELECT v FROM alias_meta WHERE k = 'pruned_at'").fetchone()
+        return not r or time.time() - r[0] >= every_s
+
+    def prune(self, valid_ids, keep=()):
+        """Toglie gli alias verso prodotti non più in catalogo, tranne gli ID in keep
+        (prodotti nuovi ancora nella coda di scrittura, non ancora sul foglio)"""
+        if not valid_ids: return 0     # catalogo vuoto o non letto: meglio non toccare nulla
+        keep = set(keep)
+        with self.connect() as conn:
+            stale = [r[0] for r in conn.execute("SELECT DISTINCT id FROM alias") if r[0] not in valid_ids and r[0] not in keep]
+            conn.executemany("DELETE FROM alias WHERE id=?", [(i,) for i in stale])
+            conn.execute("INSERT OR REPLACE INTO alias_meta VALUES ('pruned_at', ?)", (time.time(),))
+        return len(stale)
+
+    def count(self):
+        with self.connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM alias").fetchone()[0]
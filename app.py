@@ -1,31 +1,30 @@
 import streamlit as st
-import google.generativeai as genai
-import gspread
-from google.oauth2.service_account import Credentials
-import json
-from PIL import Image, ImageOps 
 import pandas as pd
-import re
-import requests
-import uuid
-import math 
 import time
-import itertools
+import numpy as np
 from streamlit_js_eval import get_geolocation
 from geopy.geocoders import Nominatim
+from utils import clean_piva, clean_price, norm_addr, norm_date, is_iso_date
+from snapshot import Snapshot
+from write_queue import WriteQueue, Flusher
+import price_facts
+from price_history import PriceHistory, HISTORY_DAYS
+from search_index import TokenIndex
+from candidates import CandidateIndex
+from aliases import AliasStore
+from distances import DistanceCache, road_distances, distance_matrix
+from geo_index import haversine_km
+import optimizer
+from price_matrix import build_price_matrix
+from cart_cache import CartCache, cart_key, norm_item
+from extraction import build_prompt, group_jobs, extract_receipts
+from extraction_cache import ExtractionCache, photos_key
+from ingest import build_rows, catalog_maps, header_fields, apply_aliases, saved_lines, use_suggestions
+from image_prep import prepare_upload, raw_upload, summarize
+from resources import get_tables, get_model, get_shop_registry, reconnect
 
 # --- 1. FUNZIONI DI SERVIZIO ---
 
-def get_road_distance(lat1, lon1, lat2, lon2):
-    try:
-        url = f"https://router.project-osrm.org/route/v1/driving/{lon1},{lat1};{lon2},{lat2}?overview=false"
-        r = requests.get(url, timeout=3)
-        data = r.json()
-        if data['code'] == 'Ok':
-            return round(data['routes'][0]['distance'] / 1000, 1)
-    except: pass
-    return None
-
 def get_coords_from_address(address):
     try:
         geolocator = Nominatim(user_agent="comparatore_spesa_v32_final")
@@ -34,46 +33,139 @@ def get_coords_from_address(address):
     except: pass
     return None, None
 
-def clean_piva(piva):
-    solo_numeri = re.sub(r'\D', '', str(piva))
-    return solo_numeri.zfill(11) if solo_numeri else ""
-
-def clean_price(price_str):
-    if isinstance(price_str, (int, float)): return float(price_str)
-    cleaned = re.sub(r'[^\d,.-]', '', str(price_str)).replace(',', '.')
-    try: return float(cleaned)
-    except: return 0.0
-
-def generate_short_id():
-    return str(uuid.uuid4())[:8]
-
-def sanitize_value(val):
-    """Pulisce i valori per evitare errori JSON in Google Sheets"""
-    if val is None: return ""
-    if isinstance(val, float):
-        if math.isnan(val) or math.isinf(val): return 0.0
-    return val
+def distances_from_me(indirizzi):
+    """{indirizzo: km} dalla posizione utente, con una sola richiesta OSRM per le distanze non in cache.
+    999 = negozio senza coordinate, 888 = coordinate non valide, None = percorso non trovato"""
+    registry = get_shop_registry()
+    out, pts = {}, {}
+    for a in indirizzi:
+        neg = registry.find_by_addr(a)
+        if neg and neg.get('Latitudine'):
+            pt = registry.point(a)
+            if pt: pts[a] = pt
+            else: out[a] = 888
+        else: out[a] = 999
+    kms = road_distances((st.session_state.my_lat, st.session_state.my_lon), list(pts.values()), cache=get_distance_cache())
+    out.update(zip(pts.keys(), kms))
+    return out
+
+def travel_matrix(indirizzi):
+    """Matrice km casa (0) + negozi (1..n) per il giro; dove OSRM non risponde usa la linea d'aria"""
+    registry = get_shop_registry()
+    home = (st.session_state.my_lat, st.session_state.my_lon)
+    pts = [registry.point(a) for a in indirizzi]
+    D = distance_matrix(home, pts, cache=get_distance_cache())
+    allp = [home, *pts]
+    return np.array([[D[i][j] if D[i][j] is not None else float(haversine_km(*allp[i], *allp[j]))
+                      for j in range(len(allp))] for i in range(len(allp))])
+
+@st.cache_resource
+def get_distance_cache():
+    return DistanceCache()
+
+@st.cache_resource
+def get_extraction_cache():
+    return ExtractionCache()
+
+# Risultati del carrello condivisi fra sessioni (LRU, chiave legata alla versione dello snapshot)
+@st.cache_resource
+def get_cart_cache():
+    return CartCache()
 
 # --- 2. CONNESSIONE ---
+# Client e worksheet condivisi dal processo (resources): al rerun nessuna chiamata di rete
 try:
-    API_KEY = st.secrets["GEMINI_API_KEY"]
-    genai.configure(api_key=API_KEY)
-    google_info = dict(st.secrets)
-    scopes = ["https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"]
-    creds = Credentials.from_service_account_info(google_info, scopes=scopes)
-    gc = gspread.authorize(creds)
-    
-    sh = gc.open("Database_Prezzi")
-    ws_scontrini = sh.worksheet("Scontrini") 
-    ws_catalogo = sh.worksheet("Catalogo")
-    ws_negozi = sh.worksheet("Anagrafe_Negozi")
+    tables = get_tables()
+    ws_scontrini = tables["scontrini"]
+    ws_catalogo = tables["catalogo"]
+    ws_negozi = tables["negozi"]
     
-    lista_negozi_raw = ws_negozi.get_all_records()
-    model = genai.GenerativeModel('models/gemini-2.5-flash')
+    model = get_model()
 except Exception as e:
+    reconnect()
     st.error(f"Errore connessione: {e}")
     st.stop()
 
+# Copia locale di Scontrini/Catalogo: le ricerche non scaricano più i fogli interi
+snapshot = Snapshot()
+
+# Coda di scrittura condivisa dal processo: un solo thread scrive sui fogli
+@st.cache_resource
+def get_flusher():
+    tables = lambda: {"Scontrini": get_tables()["scontrini"], "Catalogo": get_tables()["catalogo"]}
+    return Flusher(WriteQueue(), tables, on_flush=snapshot.invalidate)
+
+def sync_db(force=False):
+    """Sincronizza lo snapshot se scaduto e ne restituisce la versione"""
+    snapshot.sync(ws_scontrini, "Scontrini", force=force)
+    snapshot.sync(ws_catalogo, "Catalogo", force=force)
+    return snapshot.version()
+
+@st.cache_data(max_entries=2, show_spinner=False)
+def _price_facts(version):
+    return price_facts.materialize(snapshot)
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def _search_index(version):
+    return TokenIndex(snapshot.frame("Catalogo"))
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def _candidate_index(version):
+    return CandidateIndex(snapshot.frame("Scontrini"), snapshot.frame("Catalogo"))
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def prepared_upload(raw_bytes, ottimizza):
+    """Foto preparata (o originale) + miniatura + statistiche, una volta per file: i rerun la riusano"""
+    return (prepare_upload if ottimizza else raw_upload)(raw_bytes)
+
+def load_candidate_index():
+    """Indice a trigrammi dei nomi di catalogo (+ nomi grezzi già visti) per prompt e matching"""
+    return _candidate_index(sync_db())
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def _catalog_maps(version):
+    return catalog_maps(snapshot.frame("Catalogo"))
+
+def load_catalog_maps():
+    """({ID_PRODOTTO: riga catalogo}, {NOME_NORMALIZZATO: ID_PRODOTTO}) per le ricerche per chiave"""
+    return _catalog_maps(sync_db())
+
+@st.cache_resource(show_spinner=False)
+def _alias_store():
+    # Completato dallo storico una volta per processo; poi lo aggiornano i salvataggi (put_many)
+    # e la manutenzione di clean_db (prune)
+    store = AliasStore()
+    store.seed(snapshot.frame("Scontrini"))
+    return store
+
+def load_alias_store():
+    """Alias nome grezzo + negozio -> ID_PRODOTTO"""
+    version = sync_db()
+    store = _alias_store()
+    # Pulizia giornaliera: via gli alias verso prodotti eliminati, non quelli dei prodotti ancora in coda
+    try:
+        if store.prune_due():
+            in_coda = {str(r[0]).strip() for r in get_flusher().queue.pending("Catalogo") if r}
+            store.prune(set(_catalog_maps(version)[0]), keep=in_coda)
+    except: pass
+    return store
+
+def load_search_index():
+    """Indice token -> ID_PRODOTTO del Catalogo (ricostruito a ogni nuova versione dei dati)"""
+    return _search_index(sync_db())
+
+def load_price_facts():
+    """Join Scontrini x Catalogo già tipizzato (ricalcolato solo sulle righe nuove)"""
+    return _price_facts(sync_db())
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def _price_history(version):
+    return PriceHistory(_price_facts(version))
+
+def load_price_history():
+    """Serie per prodotto/negozio: prezzi attuali (current) + mediana e trend sullo storico"""
+    return _price_history(sync_db())
+
 # --- 3. GESTIONE POSIZIONE E STATO ---
 if 'my_lat' not in st.session_state: st.session_state.my_lat = None
 if 'my_lon' not in st.session_state: st.session_state.my_lon = None
@@ -82,11 +174,29 @@ if 'uploader_key' not in st.session_state: st.session_state.uploader_key = 0
 
 st.title("🛍️ Spesa Normalizzata & Geolocalizzata - VERSIONE PROD.")
 
+with st.sidebar:
+    st.caption(f"Dati locali aggiornati ogni {snapshot.max_age_s // 60} min")
+    if st.button("🔄 Sincronizza ora"):
+        sync_db(force=True)
+    
+    # Stato della coda di scrittura verso i fogli
+    coda = get_flusher().queue
+    n_coda, eta_coda = coda.depth()
+    st.caption(f"📤 Righe in attesa di scrittura: {n_coda}" + (f" (la più vecchia da {eta_coda:.0f} s)" if n_coda else ""))
+    if coda.stats["last_flush_s"] is not None:
+        st.caption(f"Ultima scrittura: {coda.stats['last_flush_s']:.1f} s, {coda.stats['flushed']} righe scritte in questa sessione del server")
+    if coda.stats["last_error"]:
+        st.warning(f"Scrittura in errore, nuovo tentativo fra {coda.stats['retry_in_s']:.0f} s: {coda.stats['last_error']}")
+    if n_coda and st.button("📤 Scrivi ora"):
+        get_flusher().wake()
+
 tab_carica, tab_cerca, tab_carrello = st.tabs(["📷 CARICA", "🔍 CERCA PRODOTTO", "🛒 CARRELLO OTTIMIZZATO"])
 
 # --- TAB 1: CARICAMENTO ---
 with tab_carica:
     if 'dati_analizzati' not in st.session_state: st.session_state.dati_analizzati = None
+    # Scontrini già analizzati in attesa di revisione (upload multiplo)
+    if 'coda_scontrini' not in st.session_state: st.session_state.coda_scontrini = []
     
     files = st.file_uploader(
         "Carica scontrini", 
@@ -96,72 +206,76 @@ with tab_carica:
     )
     
     if files:
-        imgs = [ImageOps.exif_transpose(Image.open(f)) for f in files]
-        st.image(imgs, width=150)
+        # Foto ridotte/ritagliate per Gemini, miniature separate per la UI
+        ottimizza = st.checkbox("Ottimizza foto prima dell'invio", value=True)
+        prep = [prepared_upload(f.getvalue(), ottimizza) for f in files]
+        imgs = [p[0] for p in prep]
+        st.image([p[1] for p in prep], width=150)
+        
+        stesso_scontrino = st.checkbox("Le foto sono parti dello stesso scontrino", value=len(files) == 1)
+        try: candidati = load_candidate_index()
+        except: candidati = None
+        negozio_noto = st.selectbox("Negozio (facoltativo)", [""] + (candidati.shops() if candidati else []),
+                                    help="Nel prompt vanno i nomi di catalogo più simili a quelli già letti in questo negozio")
         
         if st.button("🚀 ANALIZZA E NORMALIZZA"):
-            with st.spinner("Analisi scontrino in corso..."):
-                try:
-                    # Carichiamo nomi noti per aiutare il matching
-                    try:
-                        catalogo_raw = ws_catalogo.get_all_records()
-                        nomi_noti = list(set([r['NOME_NORMALIZZATO'] for r in catalogo_raw if r['NOME_NORMALIZZATO']]))
-                    except: nomi_noti = []
-                    
-                    # --- PROMPT IBRIDO (CONTABILE + DATA MANAGER + SCONTRINO ID) ---
-                    prompt = f"""
-                    Agisci con due ruoli simultanei: 
-                    1. CONTABILE (per i calcoli di cassa precisi)
-                    2. DATA MANAGER (per la normalizzazione del database)
-
-                    Analizza le immagini dello scontrino seguendo rigorosamente queste FASI:
-
-                    --- FASE 1: TESTATA E IDENTIFICATIVI ---
-                    Cerca:
-                    - P.IVA (solo cifre)
-                    - Indirizzo completo
-                    - Data (YYYY-MM-DD)
-                    - NUMERO SCONTRINO: Cerca etichette come 'Scontrino n.', 'Doc.', 'RT', 'SF', '#'. Estrai il codice identificativo univoco.
-
-                    --- FASE 2: PULIZIA CONTABILE (Regole 'V18') ---
-                    A. SCONTI E PREZZI NEGATIVI: 
-                       Se vedi righe come 'SCONTO', 'FIDATY', o importi col segno meno (-0.50) subito sotto un prodotto:
-                       - NON creare una riga per lo sconto.
-                       - SOTTRAI il valore al prezzo del prodotto sopra. 
-                       - Imposta 'is_offerta' su "SI".
-
-                    B. MOLTIPLICATORI:
-                       Se vedi '3 x 1.50' (3 pezzi a 1.50 l'uno):
-                       - 'quantita_acquistata' = 3
-                       - 'prezzo_unitario' = 1.50
-
-                    --- FASE 3: ESTRAZIONE E NORMALIZZAZIONE DATABASE ---
-                    Per ogni riga risultante dalla Fase 2, estrai:
-                    
-                    1. 'nome_grezzo': Testo originale.
-                    2. 'nome_normalizzato': Nome standard descrittivo (es. 'LATTE GRANAROLO P.S. 1L').
-                       - Se simile a questi, usa ESATTAMENTE questo nome: {nomi_noti[:50]}
-                    3. 'brand': Marca (es. GRANAROLO). Se non c'è, 'GENERICO'.
-                    4. 'categoria': Macro categoria (es. LATTE, PASTA).
-                    5. 'formato': SOLO IL NUMERO (es. 1.0, 0.5).
-                    6. 'unita': SOLO 'KG', 'L', 'PZ'. Converti tutto (500ml -> 0.5 L).
-
-                    OUTPUT JSON:
-                    {{
-                      "testata": {{ "p_iva": "", "indirizzo": "", "data_iso": "", "num_scontrino": "" }},
-                      "prodotti": [
-                        {{
-                          "nome_grezzo": "...", "nome_normalizzato": "...", "brand": "...", "categoria": "...",
-                          "formato": 1.0, "unita": "L", "prezzo_unitario": 0.0, "quantita_acquistata": 1, "is_offerta": "NO"
-                        }}
-                      ]
-                    }}
-                    """
-                    response = model.generate_content([prompt, *imgs])
-                    text_resp = response.text.strip().replace('```json', '').replace('```', '')
-                    st.session_state.dati_analizzati = json.loads(text_resp)
-                    st.rerun()
-                except Exception as e: st.error(f"Errore IA: {e}")
+            # Nomi noti per aiutare il matching: pochi e rilevanti (simili alla storia del negozio), dallo snapshot locale
+            prompt = build_prompt(candidati.prompt_names(shop=negozio_noto or None) if candidati else [])
+            
+            # Uno scontrino per job, in parallelo: i risultati compaiono appena pronti
+            jobs = group_jobs([f.name for f in files], imgs, same_receipt=stesso_scontrino)
+            job_stats = [summarize(s) for _, s in group_jobs([f.name for f in files], [p[2] for p in prep], same_receipt=stesso_scontrino)]
+            # Latenza di Gemini per le stesse foto originali: preparate e non, da confrontare
+            job_photos = [photos_key(r) for _, r in group_jobs([f.name for f in files], [f.getvalue() for f in files], same_receipt=stesso_scontrino)]
+            modo, altro = ("prep", "raw") if ottimizza else ("raw", "prep")
+            risultati = [None] * len(jobs)
+            errori = 0
+            progress = st.progress(0.0, text=f"Analisi di {len(jobs)} scontrini in corso...")
+            for n, (i, dati, err, sec, da_cache, simile) in enumerate(extract_receipts(model, prompt, jobs, cache=get_extraction_cache()), 1):
+                label = jobs[i][0]
+                if err:
+                    errori += 1
+                    st.error(f"❌ {label}: Errore IA: {err}")
+                else:
+                    # Suggerimento dal catalogo (stesso formato) accanto al nome proposto: lo sceglie l'utente
+                    if candidati:
+                        negozio = get_shop_registry().find_by_piva(clean_piva(dati.get('testata', {}).get('p_iva', '')))
+                        candidati.snap(dati.get('prodotti', []), shop=negozio['Insegna_Standard'] if negozio else None)
+                    if simile: dati['possibile_duplicato'] = True
+                    risultati[i] = dati
+                    prodotti_job = dati.get('prodotti', [])
+                    js = job_stats[i]
+                    fonte = "già analizzato, da cache" if da_cache else f"{sec:.1f} s"
+                    with st.expander(f"✅ {label} — {len(prodotti_job)} prodotti ({fonte})"):
+                        gemini = "Gemini non chiamato" if da_cache else f"Gemini {sec:.1f} s"
+                        try: lat = get_extraction_cache().log_latency(job_photos[i], modo, None if da_cache else sec)
+                        except: lat = {}
+                        if altro in lat and modo in lat:
+                            gemini += (f" (foto {'originale' if altro == 'raw' else 'preparata'}: {lat[altro]:.1f} s, "
+                                       f"{'preparata' if modo == 'prep' else 'originale'} {lat[modo] - lat[altro]:+.1f} s)")
+                        st.caption(f"Invio {js['bytes_prep'] / 1024:.0f} KB invece di {js['bytes_orig'] / 1024:.0f} KB "
+                                   f"(-{1 - js['bytes_prep'] / max(js['bytes_orig'], 1):.0%}), preparazione {js['prep_s'] * 1000:.0f} ms, {gemini}")
+                        if simile: st.warning("⚠️ Possibile duplicato: foto molto simili a uno scontrino già analizzato")
+                        st.dataframe(pd.DataFrame(prodotti_job), use_container_width=True, hide_index=True)
+                progress.progress(n / len(jobs), text=f"Analizzati {n}/{len(jobs)} scontrini")
+            
+            tot = summarize(job_stats)
+            st.caption(f"📦 Totale inviato {tot['bytes_prep'] / 1024:.0f} KB su {tot['bytes_orig'] / 1024:.0f} KB originali "
+                       f"(risparmiati {(tot['bytes_orig'] - tot['bytes_prep']) / 1024:.0f} KB)")
+            
+            coda = [d for d in risultati if d]
+            if coda:
+                st.session_state.dati_analizzati = coda[0]
+                st.session_state.coda_scontrini = coda[1:]
+                if not errori: st.rerun()
+
+    def next_receipt():
+        """Passa al prossimo scontrino in coda; a coda vuota resetta l'uploader"""
+        if st.session_state.coda_scontrini:
+            st.session_state.dati_analizzati = st.session_state.coda_scontrini.pop(0)
+        else:
+            st.session_state.dati_analizzati = None
+            st.session_state.uploader_key += 1
 
     # --- UI DI REVISIONE ---
     if st.session_state.dati_analizzati:
@@ -173,126 +287,108 @@ with tab_carica:
         tot_calc = sum([clean_price(p.get('prezzo_unitario', 0)) * float(p.get('quantita_acquistata', 1)) for p in prodotti])
 
         # Match Negozio
-        piva_l = clean_piva(testata.get('p_iva', ''))
-        match = next((n for n in lista_negozi_raw if clean_piva(n.get('P_IVA', '')) == piva_l), None)
+        proposta = header_fields(testata, get_shop_registry())
         
         st.markdown("### 🧾 Dettagli Scontrino")
+        if st.session_state.coda_scontrini:
+            st.caption(f"Altri {len(st.session_state.coda_scontrini)} scontrini in coda di revisione")
+            st.button("⏭️ Salta questo scontrino", on_click=next_receipt)
         c1, c2, c3, c4 = st.columns(4)
-        with c1: insegna_f = st.text_input("Supermercato", value=(match['Insegna_Standard'] if match else f"NUOVO ({piva_l})")).upper()
-        with c2: data_f = st.text_input("Data", value=testata.get('data_iso', '2026-01-01'))
-        with c3: num_scontrino_f = st.text_input("N. Scontrino", value=testata.get('num_scontrino', '')).upper()
+        with c1: insegna_f = st.text_input("Supermercato", value=proposta["insegna"]).upper()
+        with c2: data_f = norm_date(st.text_input("Data", value=proposta["data"], placeholder="AAAA-MM-GG"))
+        with c3: num_scontrino_f = st.text_input("N. Scontrino", value=proposta["num"]).upper()
         with c4: st.metric("Totale Letto", f"€ {tot_calc:.2f}")
         
-        indirizzo_f = st.text_input("Indirizzo", value=(match['Indirizzo_Standard (Pulito)'] if match else testata.get('indirizzo', ''))).upper()
+        indirizzo_f = st.text_input("Indirizzo", value=proposta["indirizzo"]).upper()
 
         st.markdown("### 🛒 Prodotti (Normalizzazione)")
         
         # Editor Tabella
         df_editor = pd.DataFrame(prodotti)
+        # Righe già viste in questo negozio: prodotto risolto dagli alias, prima del nome proposto dall'IA
+        try: noti = apply_aliases(df_editor, insegna_f, load_alias_store(), load_catalog_maps()[0])
+        except: noti = 0
+        if 'ID' not in df_editor.columns: df_editor['ID'] = ""
+        if noti: st.caption(f"🔗 {noti} righe riconosciute da scontrini precedenti")
         col_map = {
             "nome_grezzo": "Scontrino", "nome_normalizzato": "Nome Catalogo (Editabile)", 
             "prezzo_unitario": "Prezzo €", "quantita_acquistata": "Qtà",
             "formato": "Peso/Vol (Tot)", "unita": "Unità (KG/L/PZ)",
-            "brand": "Marca", "categoria": "Cat", "is_offerta": "Offerta"
+            "brand": "Marca", "categoria": "Cat", "is_offerta": "Offerta",
+            "nome_suggerito": "Suggerito dal catalogo", "usa_suggerito": "Usa suggerito"
         }
         # Aggiunta colonne mancanti per sicurezza
         for k in col_map.keys():
             if k not in df_editor.columns: df_editor[k] = ""
+        df_editor['usa_suggerito'] = False
+        if (df_editor['nome_suggerito'].astype(str) != "").any():
+            st.caption("💡 Alcune righe hanno un prodotto di catalogo simile: spunta \"Usa suggerito\" se è proprio quello")
             
         df_editor = df_editor.rename(columns=col_map)
-        edited_df = st.data_editor(df_editor, use_container_width=True, num_rows="dynamic", hide_index=True)
-
-        if st.button("💾 SALVA NEL DATABASE RELAZIONALE"):
+        edited_df = st.data_editor(df_editor, use_container_width=True, num_rows="dynamic", hide_index=True,
+                                   column_config={"ID": None, "Suggerito dal catalogo": st.column_config.TextColumn(disabled=True),
+                                                  "Usa suggerito": st.column_config.CheckboxColumn()})
+
+        # Foto simili a uno scontrino già analizzato: si salva solo dopo conferma esplicita
+        confermato = True
+        if not is_iso_date(data_f):
+            st.warning("📅 Data non letta dallo scontrino: inseriscila (AAAA-MM-GG) prima di salvare.")
+            confermato = False
+        if d.get('possibile_duplicato'):
+            st.warning("⚠️ Possibile duplicato: le foto somigliano a uno scontrino già analizzato. Controlla data, numero e righe.")
+            confermato = st.checkbox("È uno scontrino diverso, salva comunque") and confermato
+
+        if st.button("💾 SALVA NEL DATABASE RELAZIONALE", disabled=not confermato):
             with st.spinner("Salvataggio e pulizia in corso..."):
                 
                 # 1. Controlli Catalogo
                 try:
-                    if not ws_catalogo.get_all_values():
+                    if not ws_catalogo.row_values(1):
                         ws_catalogo.append_row(["ID_PRODOTTO", "NOME_NORMALIZZATO", "BRAND", "CATEGORIA", "FORMATO", "UNITA"])
                 except: pass
                 
                 try:
-                    cat_records = ws_catalogo.get_all_records()
-                    df_cat = pd.DataFrame(cat_records)
-                except: df_cat = pd.DataFrame()
+                    # Sync forzato (incrementale) per non duplicare ID appena creati da altri
+                    snapshot.sync(ws_catalogo, "Catalogo", force=True)
+                    cat_by_id, id_by_name = _catalog_maps(snapshot.version())
+                except: cat_by_id, id_by_name = {}, {}
+                # Prodotti creati da salvataggi ancora in coda
+                id_by_name = dict(id_by_name)
+                for r in get_flusher().queue.pending("Catalogo"): id_by_name.setdefault(r[1], r[0])
                 
-                rows_scontrini = []
-                rows_catalogo_new = []
+                # Scontrino già presente (stessi negozio, indirizzo, data e numero)? Indice nello snapshot
+                try: snapshot.sync(ws_scontrini, "Scontrini", force=True)
+                except: pass
+                gia_salvate = saved_lines(snapshot, get_flusher().queue.pending("Scontrini"), data_f, insegna_f, indirizzo_f, num_scontrino_f)
                 
-                for idx, row in edited_df.iterrows():
-                    # Preparazione Dati Puliti
-                    norm_name = str(row["Nome Catalogo (Editabile)"]).upper().strip()
-                    brand = str(row["Marca"]).upper().strip()
-                    cat = str(row["Cat"]).upper().strip()
-                    unit = str(row["Unità (KG/L/PZ)"]).upper().strip()
-                    
-                    try: fmt = float(str(row["Peso/Vol (Tot)"]).replace(',', '.'))
-                    except: fmt = 1.0
-                    fmt = sanitize_value(fmt)
-                    
-                    # LOGICA ID (Relazionale)
-                    prod_id = None
-                    # A. Cerca nel DB
-                    if not df_cat.empty and 'NOME_NORMALIZZATO' in df_cat.columns:
-                        match_prod = df_cat[df_cat['NOME_NORMALIZZATO'] == norm_name]
-                        if not match_prod.empty: prod_id = str(match_prod.iloc[0]['ID_PRODOTTO'])
-                    
-                    # B. Cerca nei Nuovi
-                    if not prod_id:
-                        for new_p in rows_catalogo_new:
-                            if new_p[1] == norm_name:
-                                prod_id = str(new_p[0]); break
-                    
-                    # C. Crea Nuovo
-                    if not prod_id:
-                        prod_id = generate_short_id()
-                        rows_catalogo_new.append([str(prod_id), norm_name, brand, cat, fmt, unit])
-                    
-                    # Prezzi e Totali
-                    try: p_unit = float(str(row["Prezzo €"]).replace(',', '.'))
-                    except: p_unit = 0.0
-                    try: qta = float(str(row["Qtà"]).replace(',', '.'))
-                    except: qta = 1.0
-                    
-                    p_unit = sanitize_value(p_unit)
-                    qta = sanitize_value(qta)
-                    tot_riga = sanitize_value(p_unit * qta)
-
-                    # COSTRUZIONE RIGA (12 Colonne ora, inclusa Num Scontrino in L)
-                    riga_completa = [
-                        str(data_f),                        # A
-                        str(insegna_f),                     # B
-                        str(indirizzo_f),                   # C
-                        str(row["Scontrino"]).upper(),      # D
-                        tot_riga,                           # E
-                        0,                                  # F
-                        p_unit,                             # G
-                        str(row["Offerta"]).upper(),        # H
-                        qta,                                # I
-                        "SI",                               # J
-                        str(prod_id),                       # K (ID Prodotto)
-                        str(num_scontrino_f)                # L (NUOVO: Numero Scontrino)
-                    ]
-                    rows_scontrini.append(riga_completa)
-
-                # Scrittura su Google Sheets
+                # Righe Catalogo/Scontrini costruite in blocco (stesse regole per l'import da riga di comando)
+                res = build_rows(use_suggestions(edited_df.rename(columns={v: k for k, v in col_map.items()})),
+                                 {"data": data_f, "insegna": insegna_f, "indirizzo": indirizzo_f, "num": num_scontrino_f},
+                                 id_by_name, cat_by_id, already=gia_salvate)
+                rows_catalogo_new, rows_scontrini, nuovi_alias, saltate = res.rows_catalogo, res.rows_scontrini, res.aliases, res.skipped
+                
+                if saltate and not rows_scontrini:
+                    st.warning(f"⚠️ Scontrino n. {num_scontrino_f} del {data_f} già salvato: nessuna riga nuova.")
+                    next_receipt()
+                    st.stop()
+                
+                # Scrittura: coda locale su disco, il flusher la porta sui fogli in background
                 try:
-                    if rows_catalogo_new:
-                        ws_catalogo.append_rows(rows_catalogo_new, value_input_option='USER_ENTERED')
-                    
-                    if rows_scontrini:
-                        ws_scontrini.append_rows(rows_scontrini, value_input_option='USER_ENTERED')
+                    flusher = get_flusher()
+                    flusher.queue.enqueue([("Catalogo", rows_catalogo_new), ("Scontrini", rows_scontrini)])
+                    flusher.wake()
+                    try: load_alias_store().put_many(nuovi_alias)
+                    except: pass
                         
-                    st.success(f"✅ Salvataggio completato! Aggiunte {len(rows_scontrini)} righe.")
+                    st.toast(f"✅ Salvataggio completato! Aggiunte {len(rows_scontrini)} righe."
+                             + (f" {saltate} righe erano già salvate e sono state saltate." if saltate else ""))
                     
-                    # Reset e Ricarica
-                    st.session_state.dati_analizzati = None
-                    st.session_state.uploader_key += 1
-                    time.sleep(1)
+                    # Prossimo scontrino in coda (o reset) e Ricarica
+                    next_receipt()
                     st.rerun()
                     
                 except Exception as e:
-                    st.error(f"Errore scrittura Google: {e}")
+                    st.error(f"Errore salvataggio: {e}")
 
 # --- TAB 2: RICERCA (Logica Relazionale) ---
 with tab_cerca:
@@ -323,63 +419,54 @@ with tab_cerca:
     if query:
         with st.spinner("Ricerca nel database normalizzato..."):
             try:
-                data_scontrini = ws_scontrini.get_all_records()
-                data_catalogo = ws_catalogo.get_all_records()
+                storico = load_price_history()
                 
-                if data_scontrini and data_catalogo:
-                    df_s = pd.DataFrame(data_scontrini)
-                    df_c = pd.DataFrame(data_catalogo)
-                    
-                    # Join Relazionale
-                    df_s['ID_PRODOTTO'] = df_s['ID_PRODOTTO'].astype(str)
-                    df_c['ID_PRODOTTO'] = df_c['ID_PRODOTTO'].astype(str)
-                    df_full = pd.merge(df_s, df_c, on='ID_PRODOTTO', how='inner')
+                if len(storico):
                     
-                    # Filtro
-                    mask = (
-                        df_full['NOME_NORMALIZZATO'].str.contains(query, na=False) |
-                        df_full['BRAND'].str.contains(query, na=False) |
-                        df_full['CATEGORIA'].str.contains(query, na=False)
-                    )
-                    res = df_full[mask].copy()
+                    # Filtro (indice invertito su nome, marca e categoria), poi query indicizzata sui
+                    # price facts: solo l'ultimo prezzo per negozio dei prodotti trovati
+                    ids = load_search_index().search(query)
+                    res = price_facts.latest(snapshot, ids)
                     
                     if not res.empty:
-                        # Calcoli Prezzi
-                        res['Prezzo_Unitario'] = res['Prezzo_Unitario'].apply(clean_price)
-                        res['FORMATO'] = pd.to_numeric(res['FORMATO'], errors='coerce').fillna(1)
-                        res['PREZZO_AL_L_KG'] = res['Prezzo_Unitario'] / res['FORMATO']
-                        
-                        # Calcolo Distanze
-                        def add_dist(row):
-                            if not st.session_state.my_lat: return 999
-                            addr_clean = re.sub(r'\W+', '', str(row['Indirizzo'])).upper()
-                            neg = next((n for n in lista_negozi_raw if re.sub(r'\W+', '', str(n.get('Indirizzo_Standard (Pulito)', ''))).upper() == addr_clean), None)
-                            if neg and neg.get('Latitudine'):
-                                try: return get_road_distance(st.session_state.my_lat, st.session_state.my_lon, float(str(neg['Latitudine']).replace(',','.')), float(str(neg['Longitudine']).replace(',','.')))
-                                except: return 888
-                            return 999
-
-                        res['KM'] = res.apply(add_dist, axis=1)
-                        res = res.sort_values(by=['PREZZO_AL_L_KG', 'KM'])
+                        # Calcolo Distanze (una richiesta per tutti i negozi, poi cache)
+                        res['Indirizzo'] = res['Indirizzo'].astype(str)
+                        if st.session_state.my_lat:
+                            res['KM'] = res['Indirizzo'].map(distances_from_me(res['Indirizzo'].unique()))
+                        else: res['KM'] = 999
+                        # Prima i prezzi per unità affidabili nell'unità più comune dei risultati (confrontabili fra loro)
+                        res['UNITA_STD'] = res['UNITA_STD'].astype(str)
+                        ok = res[res['STD_OK']]
+                        main_u = ok['UNITA_STD'].mode().iat[0] if not ok.empty else ""
+                        res['_fuori'] = ~res['STD_OK'] | (res['UNITA_STD'] != main_u)
+                        res = res.sort_values(by=['_fuori', 'PREZZO_STD', 'PREZZO_AL_L_KG', 'KM'])
+                        st_h = storico.stats(res['ID_PRODOTTO'].astype(str), res['SHOP_ID'].astype(str))
+                        res['Mediana'], res['Trend'], res['Oss'] = st_h['MEDIANA'].to_numpy(), st_h['TREND'].to_numpy(), st_h['N_OSS'].to_numpy()
                         
                         # Top Result
                         best = res.iloc[0]
-                        u = best['UNITA']
-                        st.success(f"🏆 Best: **{best['NOME_NORMALIZZATO']}** a **{best['PREZZO_AL_L_KG']:.2f} €/{u}**")
+                        if best['STD_OK']:
+                            st.success(f"🏆 Best: **{best['NOME_NORMALIZZATO']}** a **{best['PREZZO_STD']:.2f} €/{best['UNITA_STD']}**")
+                        else:
+                            st.success(f"🏆 Best: **{best['NOME_NORMALIZZATO']}** a **{best['Prezzo_Unitario']:.2f} €** a confezione")
                         st.caption(f"Presso {best['Negozio']} - {best['Data']}")
                         
                         # Table
-                        show_cols = ['Data', 'NOME_NORMALIZZATO', 'Prezzo_Unitario', 'PREZZO_AL_L_KG', 'Negozio', 'Indirizzo', 'KM', 'In_Offerta']
-                        renames = {'NOME_NORMALIZZATO': 'Prodotto', 'Prezzo_Unitario': 'Prezzo Conf.', 'PREZZO_AL_L_KG': f'Prezzo/{u}'}
+                        res['Unità'] = res['UNITA_STD'].where(res['STD_OK'], "?")
+                        show_cols = ['Data', 'NOME_NORMALIZZATO', 'Prezzo_Unitario', 'PREZZO_STD', 'Unità', 'Negozio', 'Indirizzo', 'KM', 'In_Offerta', 'Mediana', 'Trend', 'Oss']
+                        renames = {'NOME_NORMALIZZATO': 'Prodotto', 'Prezzo_Unitario': 'Prezzo Conf.', 'PREZZO_STD': 'Prezzo/unità',
+                                   'Mediana': f'Mediana {HISTORY_DAYS}gg', 'Trend': 'Trend €/mese', 'Oss': 'Rilevazioni'}
                         
                         st.dataframe(
                             res[show_cols].rename(columns=renames), 
                             use_container_width=True, 
                             hide_index=True,
                             column_config={
-                                f"Prezzo/{u}": st.column_config.NumberColumn(format="%.2f €"),
+                                "Prezzo/unità": st.column_config.NumberColumn(format="%.2f €"),
                                 "Prezzo Conf.": st.column_config.NumberColumn(format="%.2f €"),
-                                "KM": st.column_config.NumberColumn(format="%.1f km")
+                                "KM": st.column_config.NumberColumn(format="%.1f km"),
+                                f"Mediana {HISTORY_DAYS}gg": st.column_config.NumberColumn(format="%.2f €"),
+                                "Trend €/mese": st.column_config.NumberColumn(format="%+.2f")
                             }
                         )
                     else: st.warning("Nessun prodotto trovato.")
@@ -430,167 +517,141 @@ with tab_carrello:
         # --- NUOVO SELETTORE PER FRAZIONAMENTO ---
         stops_option = st.select_slider(
             "Max Negozi (Tappe)", 
-            options=[1, 2, 3, "Illimitato"],
+            options=list(range(1, optimizer.MAX_STOPS + 1)) + ["Illimitato"],
             value=1
         )
         st.caption("Aumenta le tappe per risparmiare di più.")
+        per_unita = st.checkbox("Confronta al kg/L", help="Per ogni articolo sceglie la marca/formato col miglior prezzo al kg, al litro o al pezzo")
+        costo_km = st.number_input("Costo viaggio (€/km)", min_value=0.0, max_value=2.0, value=0.0, step=0.05,
+                                   help="Se > 0 i piani sono ordinati per risparmio netto (spesa + giro casa → negozi → casa)")
+        if costo_km > 0 and stops_option == "Illimitato":
+            st.caption(f"Con il costo viaggio \"Illimitato\" sceglie il piano con il miglior netto fino a {optimizer.MAX_STOPS} tappe.")
         
         st.write("") 
         b1, b2 = st.columns(2)
         with b1: btn_calc = st.button("🚀 Calcola", use_container_width=True, key="calc_tab3")
         with b2: st.button("🗑️ Svuota", on_click=clear_list, use_container_width=True, key="clear_tab3")
     
+    def optimize_cart(items, max_dist_km, stops_option, costo_km, per_unita):
+        """Distanze, matrice prezzi, classifica negozi singoli e piano multi-tappa per la lista.
+        Restituisce un dict (condiviso in cache: da non modificare) o {'errore': messaggio}."""
+        # Price facts già uniti e puliti, solo l'ultimo prezzo di ogni prodotto per negozio
+        storico = load_price_history()
+        if not len(storico): return {'errore': "DB vuoto"}
+        # Dai price facts (query indicizzata) solo i prodotti che corrispondono agli articoli
+        index = load_search_index()
+        df_full = price_facts.latest(snapshot, set().union(*(index.search(i) for i in items)))
+        
+        # Filtro Distanze
+        unique_shops = storico.current()[['SHOP_ID', 'Indirizzo']].drop_duplicates('SHOP_ID')
+        shop_geo = {} # { "Negozio - Indirizzo": dist }
+        valid_shop_keys = []
+
+        dist_by_addr = {}
+        if st.session_state.my_lat:
+            # Pre-filtro in linea d'aria: solo i negozi entro il raggio vanno a OSRM
+            vicini_addr = get_shop_registry().addrs_within(st.session_state.my_lat, st.session_state.my_lon, max_dist_km)
+            candidati = [a for a in unique_shops['Indirizzo'].astype(str).unique() if norm_addr(a) in vicini_addr]
+            dist_by_addr = distances_from_me(candidati)
+
+        for _, row in unique_shops.iterrows():
+            k = row['SHOP_ID']
+            dist = dist_by_addr.get(str(row['Indirizzo'])) if st.session_state.my_lat else 0
+            
+            shop_geo[k] = dist
+            if dist is not None and dist <= max_dist_km: valid_shop_keys.append(k)
+        
+        if not valid_shop_keys: return {'errore': "Nessun negozio nel raggio."}
+
+        # --- CREAZIONE MATRICE PREZZI ---
+        # Righe = articoli, colonne = negozi validi; prezzo minimo per cella (inf = assente)
+        # Con "al kg/L" per ogni cella il prodotto col miglior €/unità (solo conversioni affidabili)
+        if per_unita:
+            pm = build_price_matrix(df_full[df_full['STD_OK']], items, valid_shop_keys, index, rank_col='PREZZO_STD')
+        else:
+            pm = build_price_matrix(df_full, items, valid_shop_keys, index)
+
+        # --- ALGORITMO DI OTTIMIZZAZIONE COMBINATORIA ---
+        # 1. Calcolo Vincitore Singolo (Tappa = 1)
+        totals, founds = pm.shop_totals()
+        single_results = [{
+            'Negozio': shop, 'Totale': float(totals[j]), 'Trovati': int(founds[j]),
+            'Missing': len(items) - int(founds[j]), 'Distanza': shop_geo[shop]
+        } for j, shop in enumerate(valid_shop_keys)]
+
+        # Modalità viaggio: matrice distanze casa/negozi e costo andata+ritorno per negozio
+        travel = None
+        if costo_km > 0 and st.session_state.my_lat:
+            addr_of = dict(zip(unique_shops['SHOP_ID'].astype(str), unique_shops['Indirizzo'].astype(str)))
+            D = travel_matrix([addr_of[k] for k in valid_shop_keys])
+            travel = (D, costo_km)
+            for j, r in enumerate(single_results):
+                r['Viaggio'] = costo_km * optimizer.tour_length(D, [j + 1])
+                r['Netto'] = r['Totale'] + r['Viaggio']
+
+        # Ordiniamo la classifica singola
+        df_res = pd.DataFrame(single_results).sort_values(by=['Missing', 'Netto' if travel else 'Totale']).reset_index(drop=True)
+
+        # 2. Calcolo Multistop (Se richiesto)
+        best_combo_details = {} # {Item: (Price, ShopKey, Name)}
+        pool_ridotto = None  # (negozi usati, negozi candidati) se la ricerca è ristretta
+
+        if stops_option != 1:
+            P = pm.prices
+            if stops_option == "Illimitato" and not travel:
+                # Mix puro: prende il minimo ovunque
+                best_combo, _ = optimizer.best_mix(P)
+            else:
+                # Combinazioni di 'stops_option' negozi fra quelli con almeno 1 prodotto
+                candidate_shops = [j for j, r in enumerate(single_results) if r['Trovati'] > 0]
+                n_cand = len(candidate_shops)
+                if travel:
+                    # Col giro la ricerca esatta esplode: solo i negozi più promettenti
+                    candidate_shops = optimizer.travel_candidates(P, candidate_shops, *travel)
+                elif stops_option >= optimizer.POOL_FROM_STOPS:
+                    # Da 4 tappe in su, con molti negozi nel raggio, anche senza giro
+                    candidate_shops = optimizer.pool_candidates(P, candidate_shops)
+                if n_cand > len(candidate_shops): pool_ridotto = (len(candidate_shops), n_cand)
+                if stops_option == "Illimitato":
+                    # Col costo viaggio ogni tappa in più deve ripagarsi: miglior netto fino a MAX_STOPS tappe
+                    best_combo, _ = optimizer.best_any(P, candidate_shops, travel=travel)
+                else:
+                    best_combo, _ = optimizer.best_combo(P, stops_option, candidate_shops, travel=travel)
+
+            for i, (item, j) in enumerate(zip(items, optimizer.assign(P, best_combo))):
+                if j is not None:
+                    best_combo_details[item] = (float(P[i, j]), valid_shop_keys[j], pm.names[i, j])
+
+        return {'pm': pm, 'df_res': df_res, 'best_combo_details': best_combo_details, 'shop_geo': shop_geo,
+                'travel': travel, 'valid_shop_keys': valid_shop_keys, 'pool_ridotto': pool_ridotto,
+                # OSRM senza percorso per qualche negozio: risultato valido ora, ma da non mettere in cache
+                'parziale': any(d is None for d in dist_by_addr.values())}
+
     if btn_calc:
         if not lista_input.strip():
             st.warning("Inserisci almeno un prodotto.")
         else:
-            items = [x.strip().upper() for x in lista_input.split('\n') if x.strip()]
+            items = [norm_item(x) for x in lista_input.split('\n') if x.strip()]
+            t0 = time.time()
+            key = cart_key(items, st.session_state.my_lat, st.session_state.my_lon, max_dist_km, stops_option, sync_db(),
+                           costo_km=costo_km, per_unita=per_unita)
+            r = get_cart_cache().get(key)
             
             with st.spinner(f"Ottimizzazione combinatoria per {len(items)} articoli..."):
                 try:
-                    # Caricamento e Pulizia DB (Standard)
-                    data_s = ws_scontrini.get_all_records()
-                    data_c = ws_catalogo.get_all_records()
-                    if not data_s or not data_c: st.error("DB vuoto"); st.stop()
-
-                    df_s = pd.DataFrame(data_s); df_c = pd.DataFrame(data_c)
-                    df_s.columns = [c.strip() for c in df_s.columns]
-                    df_c.columns = [c.strip() for c in df_c.columns]
-                    df_s['ID_PRODOTTO'] = df_s['ID_PRODOTTO'].astype(str).str.strip()
-                    df_c['ID_PRODOTTO'] = df_c['ID_PRODOTTO'].astype(str).str.strip()
-                    
-                    df_full = pd.merge(df_s, df_c, on='ID_PRODOTTO', how='inner')
-                    df_full['Prezzo_Unitario'] = df_full['Prezzo_Unitario'].apply(clean_price)
-                    
-                    # Filtro Distanze
-                    unique_shops = df_full[['Negozio', 'Indirizzo']].drop_duplicates()
-                    shop_geo = {} # { "Negozio - Indirizzo": dist }
-                    valid_shop_keys = []
-
-                    for _, row in unique_shops.iterrows():
-                        k = f"{row['Negozio']} - {row['Indirizzo']}"
-                        if st.session_state.my_lat:
-                            addr_clean = re.sub(r'\W+', '', str(row['Indirizzo'])).upper()
-                            neg = next((n for n in lista_negozi_raw if re.sub(r'\W+', '', str(n.get('Indirizzo_Standard (Pulito)', ''))).upper() == addr_clean), None)
-                            dist = 999
-                            if neg and neg.get('Latitudine'):
-                                try: dist = get_road_distance(st.session_state.my_lat, st.session_state.my_lon, float(str(neg['Latitudine']).replace(',','.')), float(str(neg['Longitudine']).replace(',','.')))
-                                except: dist = 888
-                        else: dist = 0
-                        
-                        shop_geo[k] = dist
-                        if dist <= max_dist_km: valid_shop_keys.append(k)
-                    
-                    if not valid_shop_keys: st.warning("Nessun negozio nel raggio."); st.stop()
-
-                    # --- CREAZIONE MATRICE PREZZI ---
-                    # Struttura: { 'LATTE': { 'Shop A': (0.90, 'Latte Granarolo'), 'Shop B': ... } }
-                    price_matrix = {item: {} for item in items}
-                    
-                    for item in items:
-                        # Ricerca
-                        mask = (df_full['NOME_NORMALIZZATO'].str.contains(item, na=False) | df_full['CATEGORIA'].str.contains(item, na=False))
-                        df_item = df_full[mask]
-                        if df_item.empty: continue
-                        
-                        # Trova miglior prezzo per ogni negozio valido
-                        for shop_key in valid_shop_keys:
-                            neg, ind = shop_key.split(' - ', 1)
-                            sub = df_item[(df_item['Negozio'] == neg) & (df_item['Indirizzo'] == ind)]
-                            if not sub.empty:
-                                best_row = sub.loc[sub['Prezzo_Unitario'].idxmin()]
-                                price_matrix[item][shop_key] = (best_row['Prezzo_Unitario'], best_row['NOME_NORMALIZZATO'])
-
-                    # --- ALGORITMO DI OTTIMIZZAZIONE COMBINATORIA ---
-                    # 1. Calcolo Vincitore Singolo (Tappa = 1)
-                    best_single_shop = None
-                    best_single_total = float('inf')
-                    single_results = []
-
-                    for shop in valid_shop_keys:
-                        tot = 0
-                        found = 0
-                        missing_count = 0
-                        for item in items:
-                            if shop in price_matrix[item]:
-                                tot += price_matrix[item][shop][0]
-                                found += 1
-                            else:
-                                missing_count += 1
-                        
-                        single_results.append({
-                            'Negozio': shop, 'Totale': tot, 'Trovati': found, 
-                            'Missing': missing_count, 'Distanza': shop_geo[shop]
-                        })
-                        
-                        # Logica "Vincitore": Più prodotti trovati, poi prezzo minore
-                        # Penalizziamo pesantemente chi ha prodotti mancanti per il sorting
-                        score = (missing_count * 10000) + tot 
-                        if score < best_single_total and found > 0:
-                            best_single_total = score
-                            best_single_shop = shop
-
-                    # Ordiniamo la classifica singola
-                    df_res = pd.DataFrame(single_results).sort_values(by=['Missing', 'Totale']).reset_index(drop=True)
+                    if r is None:
+                        r = optimize_cart(list(key[0]), max_dist_km, stops_option, costo_km, per_unita)
+                        if not r.get('errore') and not r.get('parziale'): get_cart_cache().put(key, r)
+                        st.caption(f"⏱️ Calcolato in {time.time() - t0:.2f} s")
+                    else: st.caption(f"⚡ Risultato già calcolato ({(time.time() - t0) * 1000:.0f} ms)")
+                    if r.get('errore'): st.warning(r['errore']); st.stop()
+
+                    # Righe della matrice nell'ordine della lista (in cache sono ordinate)
+                    pm = r['pm'].take(items)
+                    df_res, best_combo_details, shop_geo, travel, valid_shop_keys = (
+                        r['df_res'], r['best_combo_details'], r['shop_geo'], r['travel'], r['valid_shop_keys'])
                     winner_single = df_res.iloc[0] if not df_res.empty else None
 
-                    # 2. Calcolo Multistop (Se richiesto)
-                    best_combo = None
-                    best_combo_total = float('inf')
-                    best_combo_details = {} # {Item: (Price, ShopKey, Name)}
-
-                    if stops_option == 1:
-                        # Se l'utente vuole 1 stop, il "combo" è il vincitore singolo
-                        target_combo = [winner_single['Negozio']] if winner_single is not None else []
-                    elif stops_option == "Illimitato":
-                        # Mix puro: prende il minimo ovunque
-                        target_combo = valid_shop_keys # Consideriamo tutti i negozi come potenziali
-                    else:
-                        # Combinazioni: 2 o 3 negozi
-                        # Genera combinazioni di dimensione 'stops_option'
-                        # Filtriamo negozi che hanno almeno 1 prodotto per non esplodere
-                        candidate_shops = [r['Negozio'] for r in single_results if r['Trovati'] > 0]
-                        target_combo = None # Sarà calcolato nel loop
-                    
-                    # LOGICA CORE MULTI-STOP
-                    if stops_option != 1:
-                        # Se è illimitato, non iteriamo combinazioni, facciamo one-pass su tutti
-                        combinations = [valid_shop_keys] if stops_option == "Illimitato" else itertools.combinations(candidate_shops, stops_option)
-                        
-                        for combo in combinations:
-                            current_combo_tot = 0
-                            current_combo_map = {}
-                            missing_in_combo = 0
-                            
-                            for item in items:
-                                # Trova il prezzo minimo per questo item TRA I NEGOZI DELLA COMBO
-                                min_p = float('inf')
-                                best_s = None
-                                best_n = ""
-                                
-                                found_in_this_combo = False
-                                for shop in combo:
-                                    if shop in price_matrix[item]:
-                                        p, n = price_matrix[item][shop]
-                                        if p < min_p:
-                                            min_p = p
-                                            best_s = shop
-                                            best_n = n
-                                        found_in_this_combo = True
-                                
-                                if found_in_this_combo:
-                                    current_combo_tot += min_p
-                                    current_combo_map[item] = (min_p, best_s, best_n)
-                                else:
-                                    missing_in_combo += 1
-                            
-                            # Valutazione
-                            score = (missing_in_combo * 10000) + current_combo_tot
-                            if score < best_combo_total:
-                                best_combo_total = score
-                                best_combo_details = current_combo_map
-                                best_combo = combo
-
                     # --- VISUALIZZAZIONE RISULTATI ---
                     
                     # A. BOX PRINCIPALE (Il piano d'azione)
@@ -600,13 +661,14 @@ with tab_carrello:
                         c1.metric("Totale", f"€ {winner_single['Totale']:.2f}")
                         c2.metric("Prodotti", f"{winner_single['Trovati']}/{len(items)}")
                         c3.metric("Distanza", f"{winner_single['Distanza']} km")
+                        if travel: st.caption(f"🚗 Costo viaggio A/R: € {winner_single['Viaggio']:.2f} → netto € {winner_single['Netto']:.2f}")
                         
                         # Dettaglio semplice
                         with st.expander("📝 Vedi lista spesa", expanded=True):
                             shop = winner_single['Negozio']
-                            for item in items:
-                                if shop in price_matrix[item]:
-                                    p, n = price_matrix[item][shop]
+                            for i, item in enumerate(items):
+                                if pm.entry(i, shop):
+                                    p, n = pm.entry(i, shop)
                                     st.markdown(f"✅ **{item}**: € {p:.2f} <span style='color:grey'>({n})</span>", unsafe_allow_html=True)
                                 else:
                                     st.markdown(f"❌ **{item}**: _Non disponibile_", unsafe_allow_html=True)
@@ -622,11 +684,23 @@ with tab_carrello:
                              if diff > 0.1: risparmio = f"(Risparmi € {diff:.2f} rispetto alla spesa unica)"
                         
                         st.info(f"⚡ PIANO OTTIMIZZATO ({stops_option if stops_option != 'Illimitato' else 'MAX'} TAPPE)")
+                        if r.get('pool_ridotto'):
+                            usati, tutti = r['pool_ridotto']
+                            st.caption(f"Piano cercato fra i {usati} negozi più promettenti (su {tutti} nel raggio con almeno un articolo).")
                         
                         c1, c2 = st.columns(2)
                         c1.metric("Totale Ottimizzato", f"€ {real_total:.2f}")
                         c2.caption(risparmio)
 
+                        # Giro casa -> negozi -> casa (esatto fino a MAX_STOPS negozi)
+                        used = sorted({valid_shop_keys.index(v[1]) for v in best_combo_details.values()})
+                        if travel and len(used) <= optimizer.MAX_STOPS:
+                            giro_km = optimizer.tour_length(travel[0], [j + 1 for j in used])
+                            netto = real_total + costo_km * giro_km
+                            c1.metric("Giro", f"{giro_km:.1f} km", f"€ {costo_km * giro_km:.2f}", delta_color="off")
+                            if winner_single is not None:
+                                c2.metric("Risparmio netto vs spesa unica", f"€ {winner_single['Netto'] - netto:.2f}")
+
                         st.markdown("##### 🛒 Lista della spesa divisa:")
                         
                         # Raggruppiamo per negozio per stampare ordinato
@@ -671,10 +745,11 @@ with tab_carrello:
                         trovati = row['Trovati']
                         distanza = row['Distanza']
                         label = f"#{index+1} | € {totale:.2f} | {trovati}/{len(items)} art. | {distanza} km | {shop_name}"
+                        if travel: label += f" | netto € {row['Netto']:.2f}"
                         with st.expander(label):
-                            for item in items:
-                                if shop_name in price_matrix[item]:
-                                    p, n = price_matrix[item][shop_name]
+                            for i, item in enumerate(items):
+                                if pm.entry(i, shop_name):
+                                    p, n = pm.entry(i, shop_name)
                                     st.markdown(f"✅ **{item}**: € {p:.2f} <span style='color:grey'>({n})</span>", unsafe_allow_html=True)
                                 else:
                                     st.markdown(f"❌ **{item}**: _Non disponibile_", unsafe_allow_html=True)
@@ -0,0 +1,191 @@
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from storage import open_backend
+from snapshot import Snapshot
+from shop_registry import ShopRegistry
+from candidates import CandidateIndex
+from aliases import AliasStore
+from extraction import build_prompt, extract_receipts, FakeModel, EXTRACTION_WORKERS
+from extraction_cache import ExtractionCache
+from image_prep import prepare_upload
+from ingest import build_rows, catalog_maps, header_fields, apply_aliases, saved_lines
+from write_queue import WriteQueue, is_quota_error
+from utils import sqlite_connect
+
+# --- IMPORT MASSIVO DI SCONTRINI DA CARTELLA ---
+# Stessa pipeline dell'app senza revisione manuale: preparazione foto, estrazione Gemini
+# in parallelo (con cache), aggancio al catalogo, alias, righe costruite con ingest e
+# scritte tramite la coda durevole a blocchi (un append_rows per tabella per blocco).
+# Ogni file/cartella completato finisce nel punto di controllo: rilanciando si riprende
+# da dove ci si era fermati. I file nella cartella sono scontrini singoli, le
+# sottocartelle scontrini in più foto.
+#
+# Uso: python bulk_import.py CARTELLA [--workers 4] [--chunk 32] [--dry-run] [--fake] [--retry-failed] [--negozio INSEGNA]
+
+IMAGE_EXT = (".jpg", ".jpeg", ".png")
+CHECKPOINT_PATH = os.environ.get("BULK_CHECKPOINT_PATH", os.path.join(".cache", "bulk_import.db"))
+FLUSH_RETRIES = 5
+
+
+def discover(root):
+    """[(percorso assoluto, [foto])] in ordine: un file = uno scontrino, una sottocartella = uno scontrino.
+    Il percorso assoluto è la chiave del punto di controllo: cartelle diverse con file omonimi
+    ("IMG_0001.jpg") non si scavalcano."""
+    out = []
+    for name in sorted(os.listdir(root)):
+        path = os.path.abspath(os.path.join(root, name))
+        if os.path.isdir(path):
+            parts = [os.path.join(path, f) for f in sorted(os.listdir(path)) if f.lower().endswith(IMAGE_EXT)]
+            if parts: out.append((path, parts))
+        elif name.lower().endswith(IMAGE_EXT):
+            out.append((path, [path]))
+    return out
+
+
+def read_bytes(path):
+    with open(path, "rb") as f: return f.read()
+
+
+class Checkpoint:
+    def __init__(self, path=CHECKPOINT_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self.connect() as conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS done (
+                label TEXT PRIMARY KEY, status TEXT, rows INTEGER, secs REAL, error TEXT, ts REAL)""")
+
+    def connect(self):
+        return sqlite_connect(self.path)
+
+    def statuses(self):
+        with self.connect() as conn:
+            return dict(conn.execute("SELECT label, status FROM done"))
+
+    def mark(self, label, status, rows=0, secs=0.0, error=None):
+        with self.connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO done VALUES (?, ?, ?, ?, ?, ?)", (label, status, rows, secs, error, time.time()))
+
+
+def flush(queue, tables, snapshot, ws_scontrini):
+    """Scrive la coda con qualche tentativo (backoff sui 429) e riallinea lo snapshot"""
+    for attempt in range(FLUSH_RETRIES):
+        try:
+            n = queue.flush(tables)
+            break
+        except Exception as e:
+            if attempt == FLUSH_RETRIES - 1: raise
+            wait = 2 ** attempt * (10 if is_quota_error(e) else 2)
+            print(f"  ⏳ scrittura fallita ({e}), nuovo tentativo fra {wait} s")
+            time.sleep(wait)
+    if n: snapshot.sync(ws_scontrini, "Scontrini", force=True)
+    return n
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Importa una cartella di scontrini (foto) nel database")
+    ap.add_argument("root", help="cartella con le foto (sottocartelle = scontrini in più foto)")
+    ap.add_argument("--workers", type=int, default=EXTRACTION_WORKERS, help="chiamate Gemini in parallelo")
+    ap.add_argument("--chunk", type=int, default=32, help="scontrini per blocco (preparazione + scrittura)")
+    ap.add_argument("--dry-run", action="store_true", help="estrae e riporta i tempi senza scrivere")
+    ap.add_argument("--fake", action="store_true", help="modello finto, senza rete (prove)")
+    ap.add_argument("--retry-failed", action="store_true", help="riprova anche gli scontrini in errore")
+    ap.add_argument("--negozio", help="insegna dei negozi della cartella, se unica (nomi del negozio nel prompt)")
+    args = ap.parse_args(argv)
+
+    backend = open_backend()
+    ws = {name: backend.table(name) for name in ("Scontrini", "Catalogo", "Anagrafe_Negozi")}
+    tables = {"Scontrini": ws["Scontrini"], "Catalogo": ws["Catalogo"]}
+    snapshot = Snapshot()
+    queue = WriteQueue()
+    if not args.dry_run and flush(queue, tables, snapshot, ws["Scontrini"]):
+        print("Scritte le righe rimaste in coda dall'esecuzione precedente.")
+    snapshot.sync(ws["Scontrini"], "Scontrini", force=True)
+    snapshot.sync(ws["Catalogo"], "Catalogo", force=True)
+
+    cat_by_id, id_by_name = catalog_maps(snapshot.frame("Catalogo"))
+    registry = ShopRegistry(ws["Anagrafe_Negozi"].get_all_records())
+    candidates = CandidateIndex(snapshot.frame("Scontrini"), snapshot.frame("Catalogo"))
+    aliases = AliasStore()
+    aliases.seed(snapshot.frame("Scontrini"))
+    if args.fake: model = FakeModel(delay_s=0.5)
+    else:
+        import google.generativeai as genai
+        genai.configure(api_key=os.environ["GEMINI_API_KEY"])
+        model = genai.GenerativeModel(os.environ.get("GEMINI_MODEL", "models/gemini-2.5-flash"))
+    prompt = build_prompt(candidates.prompt_names(shop=args.negozio))
+    cache = ExtractionCache()
+
+    checkpoint = Checkpoint()
+    stato = checkpoint.statuses()
+    skip = {"ok", "dup", "review"} | (set() if args.retry_failed else {"error"})
+    todo = [j for j in discover(args.root) if stato.get(j[0]) not in skip]
+    print(f"{len(todo)} scontrini da importare ({len(stato)} già nel punto di controllo).")
+
+    t_start = time.time()
+    latencies, counts = [], {"ok": 0, "dup": 0, "error": 0, "review": 0, "cache": 0, "rows": 0}
+    for c in range(0, len(todo), args.chunk):
+        chunk = todo[c:c + args.chunk]
+        jobs = [(label, [prepare_upload(read_bytes(p))[0] for p in paths]) for label, paths in chunk]
+        for i, dati, err, sec, da_cache, simile in extract_receipts(model, prompt, jobs, max_workers=args.workers, cache=cache):
+            key = jobs[i][0]
+            label = os.path.relpath(key, args.root)
+            if da_cache: counts["cache"] += 1
+            else: latencies.append(sec)
+            if err:
+                counts["error"] += 1
+                print(f"  ❌ {label}: {err}")
+                if not args.dry_run: checkpoint.mark(key, "error", secs=sec, error=str(err)[:500])
+                continue
+
+            if simile: print(f"  ⚠️  {label}: foto simili a uno scontrino già analizzato (possibile duplicato)")
+            h = header_fields(dati.get("testata", {}), registry)
+            if not h["data"]:
+                # Senza data la chiave dello scontrino non regge: si carica a mano dall'app
+                counts["review"] += 1
+                print(f"  📅 {label}: data non letta, da caricare con revisione nell'app")
+                if not args.dry_run: checkpoint.mark(key, "review", secs=sec, error="data mancante")
+                continue
+            prodotti = dati.get("prodotti", [])
+            if not prodotti:
+                # Foto illeggibile o non uno scontrino: "ok" con zero righe la farebbe saltare per sempre
+                counts["review"] += 1
+                print(f"  🔍 {label}: nessun prodotto letto, da caricare con revisione nell'app")
+                if not args.dry_run: checkpoint.mark(key, "review", secs=sec, error="nessun prodotto")
+                continue
+            # Senza revisione i suggerimenti del catalogo non si applicano: resta il nome del modello
+            # (eventuali quasi-duplicati si uniscono poi con catalog_dedup)
+            df = pd.DataFrame(prodotti)
+            apply_aliases(df, h["insegna"], aliases, cat_by_id)
+            already = saved_lines(snapshot, queue.pending("Scontrini"), h["data"], h["insegna"], h["indirizzo"], h["num"])
+            res = build_rows(df, h, id_by_name, cat_by_id, already=already)
+            status = "dup" if res.skipped and not res.rows_scontrini else "ok"
+            counts[status] += 1
+            counts["rows"] += len(res.rows_scontrini)
+            print(f"  {'✅' if status == 'ok' else '↩️ '} {label}: {len(res.rows_scontrini)} righe" + (f", {res.skipped} già salvate" if res.skipped else "") + f" ({sec:.1f} s)")
+            if args.dry_run: continue
+            id_by_name.update({r[1]: r[0] for r in res.rows_catalogo})
+            queue.enqueue([("Catalogo", res.rows_catalogo), ("Scontrini", res.rows_scontrini)])
+            aliases.put_many(res.aliases)
+            checkpoint.mark(key, status, rows=len(res.rows_scontrini), secs=sec)
+
+        if not args.dry_run: flush(queue, tables, snapshot, ws["Scontrini"])
+        done = min(c + args.chunk, len(todo))
+        elapsed = time.time() - t_start
+        print(f"[{done}/{len(todo)}] {done / elapsed * 60:.1f} scontrini/min")
+
+    elapsed = time.time() - t_start
+    print(f"\nImportati {counts['ok']} scontrini ({counts['rows']} righe), {counts['dup']} già presenti, "
+          f"{counts['error']} in errore, {counts['review']} da rivedere, {counts['cache']} dalla cache, in {elapsed:.0f} s "
+          f"({len(todo) / max(elapsed, 1e-9) * 60:.1f} scontrini/min).")
+    if latencies:
+        p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+        print(f"Latenza Gemini: p50 {p50:.1f} s, p90 {p90:.1f} s, p99 {p99:.1f} s, max {max(latencies):.1f} s")
+    return 1 if counts["error"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,141 @@
+import math
+import re
+from collections import Counter, deque
+from utils import scontrini_cols
+
+# --- CANDIDATI DAL CATALOGO PER IL PROMPT E PER IL MATCHING ---
+# Ogni prodotto è un documento fatto del NOME_NORMALIZZATO e dei nomi grezzi con cui è
+# già comparso negli scontrini. Indice invertito di trigrammi di caratteri pesati TF-IDF
+# (coseno): un nome grezzo abbreviato ("LATTE GRAN PS") trova il prodotto anche fra
+# decine di migliaia di voci toccando solo le posting list dei suoi trigrammi.
+# Nel prompt va una lista corta: i prodotti più simili (stesso indice, coseno col
+# centroide) agli ultimi nomi grezzi letti nel negozio, se il chiamante lo conosce
+# (bulk_import --negozio, scelta facoltativa nell'app), altrimenti in tutti i negozi; a
+# parità i più acquistati. Dopo l'estrazione ogni riga riceve come suggerimento il nome di
+# catalogo più simile con la stessa quantità (numeri e formati uguali): le varianti dello
+# stesso prodotto (0.5L / 1L, P.S. / P.I., ZERO) hanno trigrammi molto simili, quindi il
+# nome del modello non viene mai sostituito in automatico, decide l'utente in revisione.
+
+PROMPT_CANDIDATES = 50
+SNAP_MIN_SIM = 0.85     # sotto questa similarità si tiene il nome proposto dal modello
+SHOP_BOOST = 0.05       # piccolo vantaggio ai prodotti già comprati nello stesso negozio
+RECENT_RAW = 200        # ultimi nomi grezzi (per negozio e in totale) che descrivono la storia recente
+QUERY_GRAMS = 300       # trigrammi più pesanti del centroide usati per classificare il catalogo
+
+
+def size_tokens(text):
+    """Quantità/formati scritti nel nome ("1,5 L" -> "1.5L", "6X" -> "6X"), come multiinsieme ordinato"""
+    t = re.sub(r"(?<=\d),(?=\d)", ".", str(text).upper())
+    return sorted(n + u for n, u in re.findall(r"(\d+(?:\.\d+)?)\s*([A-Z]{0,3})\b", t))
+
+
+def trigrams(text):
+    t = " " + re.sub(r"\W+", " ", str(text).upper()).strip() + " "
+    return Counter(t[i:i + 3] for i in range(len(t) - 2))
+
+
+class CandidateIndex:
+    def __init__(self, df_scontrini, df_catalogo):
+        self.names, self.ids = [], []
+        pos = {}
+        if not df_catalogo.empty and {"ID_PRODOTTO", "NOME_NORMALIZZATO"} <= set(df_catalogo.columns):
+            for pid, name in zip(df_catalogo["ID_PRODOTTO"].astype(str).str.strip(), df_catalogo["NOME_NORMALIZZATO"].astype(str).str.strip()):
+                if not pid or not name or pid in pos: continue
+                pos[pid] = len(self.ids)
+                self.ids.append(pid)
+                self.names.append(name)
+
+        texts = [[n] for n in self.names]
+        self.popularity = Counter()
+        self.shop_popularity = {}
+        self.recent, self.shop_recent = deque(maxlen=RECENT_RAW), {}
+        self._prompt_cache = {}
+        c = scontrini_cols(df_scontrini.columns)
+        if not df_scontrini.empty and df_scontrini.shape[1] > max(c["nome_grezzo"], c["negozio"], c["id"]):
+            col = lambda f: df_scontrini.iloc[:, c[f]]
+            for raw, shop, pid in zip(col("nome_grezzo"), col("negozio"), col("id")):
+                shop, raw = str(shop).strip().upper(), str(raw).strip().upper()
+                if raw:
+                    self.recent.append(raw)
+                    self.shop_recent.setdefault(shop, deque(maxlen=RECENT_RAW)).append(raw)
+                d = pos.get(str(pid).strip())
+                if d is None: continue
+                self.popularity[d] += 1
+                self.shop_popularity.setdefault(shop, Counter())[d] += 1
+                if raw and raw not in texts[d]: texts[d].append(raw)
+
+        # Pesi TF-IDF normalizzati per documento, salvati direttamente nelle posting list
+        grams = [trigrams(" ".join(t)) for t in texts]
+        df = Counter(g for gs in grams for g in gs)
+        n = max(len(grams), 1)
+        self.idf = {g: math.log(1 + n / c) for g, c in df.items()}
+        self.postings = {}
+        for d, gs in enumerate(grams):
+            w = {g: (1 + math.log(c)) * self.idf[g] for g, c in gs.items()}
+            norm = math.sqrt(sum(x * x for x in w.values())) or 1.0
+            for g, x in w.items(): self.postings.setdefault(g, []).append((d, x / norm))
+
+    def _vector(self, text):
+        """Pesi TF-IDF normalizzati dei trigrammi di un testo (solo quelli presenti nell'indice)"""
+        w = {g: (1 + math.log(c)) * self.idf[g] for g, c in trigrams(text).items() if g in self.idf}
+        norm = math.sqrt(sum(x * x for x in w.values()))
+        return {g: x / norm for g, x in w.items()} if norm else {}
+
+    def _scores(self, w):
+        scores = Counter()
+        for g, x in w.items():
+            for d, y in self.postings[g]: scores[d] += x * y
+        return scores
+
+    def similar(self, text, n=5, shop=None):
+        """[(nome catalogo, ID_PRODOTTO, similarità)] per un nome (grezzo o normalizzato)"""
+        scores = self._scores(self._vector(text))
+        if not scores: return []
+        bonus = self.shop_popularity.get(str(shop).strip().upper(), {}) if shop else {}
+        best = sorted(scores, key=lambda d: -(scores[d] + (SHOP_BOOST if d in bonus else 0)))[:n]
+        return [(self.names[d], self.ids[d], round(scores[d], 4)) for d in best]
+
+    def shops(self):
+        """Negozi (insegne) già presenti negli scontrini"""
+        return sorted(s for s in self.shop_recent if s)
+
+    def prompt_names(self, n=PROMPT_CANDIDATES, shop=None):
+        """Nomi da suggerire nel prompt: i più simili agli ultimi nomi grezzi del negozio (di tutti se
+        non è noto), a parità i più acquistati; se non bastano, i più acquistati in assoluto"""
+        key = (n, str(shop).strip().upper() if shop else None)
+        if key not in self._prompt_cache:
+            recent = self.shop_recent.get(key[1]) or self.recent
+            centroid = Counter()
+            for raw, k in Counter(recent).items():
+                for g, x in self._vector(raw).items(): centroid[g] += k * x
+            scores = self._scores(dict(centroid.most_common(QUERY_GRAMS)))
+            self._prompt_cache[key] = self._ranked(scores, n)
+        return list(self._prompt_cache[key])
+
+    def _ranked(self, scores, n):
+        out = sorted(scores, key=lambda d: (-round(scores[d], 4), -self.popularity[d]))[:n]
+        seen = set(out)
+        out += [d for d, _ in self.popularity.most_common(n) if d not in seen]
+        if len(out) < n:
+            seen = set(out)
+            out += [d for d in range(len(self.names)) if d not in seen][:n - len(out)]
+        return [self.names[d] for d in out[:n]]
+
+    def snap(self, prodotti, shop=None, min_sim=SNAP_MIN_SIM):
+        """Per ogni riga estratta mette in "nome_suggerito" il nome di catalogo più simile (al nome grezzo
+        o a quello proposto) con le stesse quantità del nome proposto; nome_normalizzato non cambia.
+        Restituisce il numero di righe con un suggerimento; i nomi già presenti in catalogo restano."""
+        known = set(self.names)
+        suggested = 0
+        for p in prodotti:
+            p["nome_suggerito"] = ""
+            proposto = str(p.get("nome_normalizzato", "")).strip().upper()
+            if proposto in known: continue
+            sizes = size_tokens(proposto) or size_tokens(p.get("nome_grezzo", ""))
+            hits = self.similar(p.get("nome_grezzo", ""), n=3, shop=shop) + self.similar(proposto, n=3, shop=shop)
+            hits = [h for h in hits if h[2] >= min_sim and size_tokens(h[0]) == sizes]
+            hit = max(hits, key=lambda h: h[2], default=None)
+            if hit:
+                p["nome_suggerito"] = hit[0]
+                suggested += 1
+        return suggested
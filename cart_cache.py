@@ -0,0 +1,58 @@
+import os
+import threading
+from collections import OrderedDict
+
+# --- CACHE DEI RISULTATI DEL CARRELLO ---
+# Risultati dell'ottimizzazione (matrice prezzi, classifica, piano multi-tappa) condivisi
+# fra sessioni e rerun, con chiave: articoli normalizzati (ordinati, con ripetizioni),
+# posizione arrotondata, raggio, tappe, opzioni e versione dello snapshot. Un salvataggio
+# cambia la versione (e quindi la chiave) quando il flusher scrive le righe e lo snapshot
+# si riallinea. Non si mettono in cache errori né risultati con distanze OSRM mancanti.
+# Espulsione LRU oltre CART_CACHE_MAX voci.
+
+CART_CACHE_MAX = int(os.environ.get("CART_CACHE_MAX", "256"))
+CART_COORD_DECIMALS = int(os.environ.get("CART_COORD_DECIMALS", "3"))   # ~100 m
+
+
+def norm_item(text):
+    """Articolo della lista in forma canonica (maiuscolo, spazi compattati)"""
+    return " ".join(str(text).upper().split())
+
+
+def cart_key(items, lat, lon, max_dist_km, stops_option, version, **options):
+    pos = None if lat is None else (round(lat, CART_COORD_DECIMALS), round(lon, CART_COORD_DECIMALS))
+    return (tuple(sorted(norm_item(i) for i in items)), pos, max_dist_km, str(stops_option), version,
+            tuple(sorted(options.items())))
+
+
+class CartCache:
+    def __init__(self, max_entries=CART_CACHE_MAX):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._data:
+                self.stats["misses"] += 1
+                return None
+            self._data.move_to_end(key)
+            self.stats["hits"] += 1
+            return self._data[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def invalidate(self):
+        with self._lock:
+            self._data.clear()
+            self.stats["invalidations"] += 1
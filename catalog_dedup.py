@@ -0,0 +1,221 @@
+import re
+import sys
+import time
+import zlib
+import argparse
+from difflib import SequenceMatcher
+import numpy as np
+import pandas as pd
+from utils import scontrini_cols
+
+# --- DEDUPLICA FUZZY DEL CATALOGO ---
+# I quasi-duplicati ("LATTE GRANAROLO PS 1L" / "LATTE GRANAROLO P.S. 1L") spezzano lo
+# storico prezzi su più ID_PRODOTTO. Blocchi per marca/categoria/formato/unità, dentro
+# ogni blocco MinHash dei trigrammi con bande LSH per trovare le coppie candidate,
+# verifica con la Jaccard esatta e stesse parole: una parola in più o in meno ("PAN DI
+# STELLE" / "PAN DI STELLE GOCCE", "ZERO") è un altro prodotto anche se i trigrammi si
+# somigliano; sono ammesse solo varianti di scrittura della stessa parola (abbreviazioni,
+# refusi). Un gruppo nasce solo se ogni coppia al suo interno passa la verifica, non per
+# catena (A~B e B~C non bastano a unire A e C). Il prodotto più usato negli
+# Scontrini diventa il canonico; con --apply la colonna ID_PRODOTTO di Scontrini viene
+# rimappata con una batch_update, le righe duplicate del Catalogo vengono eliminate con
+# un'unica batch_update di deleteDimension (come clean_db) e gli alias locali
+# rimappati. La rimappa cambia Scontrini sul posto: lo snapshot dell'app se ne accorge
+# dall'impronta della colonna ID_PRODOTTO e lo riscarica per intero (price facts compresi);
+# qui lo snapshot locale viene comunque invalidato.
+#
+# Uso: python catalog_dedup.py [--threshold 0.8] [--apply] [--out proposte.csv]
+
+N_PERM = 64
+BANDS = 16                    # 16 bande x 4 righe: coppie con Jaccard >= ~0.6 quasi sempre candidate
+DEFAULT_THRESHOLD = 0.8
+MERSENNE = (1 << 61) - 1
+
+
+WORD_MIN_RATIO = 0.8          # due parole sono "la stessa" se simili almeno così (o abbreviazione)
+
+
+def norm_name(name):
+    """Maiuscolo, punti delle sigle tolti (P.S. -> PS, non 1.5), resto della punteggiatura -> spazio"""
+    s = re.sub(r"(?<=[A-Z])\.", "", str(name).upper())
+    return re.sub(r"[^\w]+", " ", s).strip()
+
+
+def trigram_set(name):
+    t = " " + norm_name(name) + " "
+    return {t[i:i + 3] for i in range(len(t) - 2)}
+
+
+def block_key(rec):
+    """Marca, categoria, formato e unità normalizzati: solo prodotti con la stessa chiave si confrontano"""
+    try: fmt = round(float(str(rec.get("FORMATO", "")).replace(",", ".")), 3)
+    except: fmt = ""
+    return (norm_name(rec.get("BRAND", "")), norm_name(rec.get("CATEGORIA", "")), fmt, norm_name(rec.get("UNITA", "")))
+
+
+def minhash(grams, perm_a, perm_b):
+    h = np.array([zlib.crc32(g.encode()) for g in grams] or [0], dtype=np.uint64)
+    return ((perm_a[:, None] * h[None, :] + perm_b[:, None]) % MERSENNE).min(axis=1)
+
+
+def jaccard(a, b):
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+
+def same_word(a, b):
+    """Stessa parola scritta in modo diverso: uguale, abbreviata (GRAN / GRANAROLO) o con un refuso"""
+    if a == b: return True
+    if min(len(a), len(b)) >= 3 and (a.startswith(b) or b.startswith(a)): return True
+    return SequenceMatcher(None, a, b).ratio() >= WORD_MIN_RATIO
+
+
+def same_words(name_a, name_b):
+    """Stesse parole, a meno di varianti di scrittura: nessuna parola in più o in meno"""
+    a, b = norm_name(name_a).split(), norm_name(name_b).split()
+    if len(a) != len(b): return False
+    rest, fuzzy = list(b), []
+    for w in a:
+        if w in rest: rest.remove(w)
+        else: fuzzy.append(w)
+    for w in fuzzy:
+        m = next((x for x in rest if same_word(w, x)), None)
+        if m is None: return False
+        rest.remove(m)
+    return True
+
+
+def find_duplicates(df_cat, usage=None, threshold=DEFAULT_THRESHOLD, seed=42):
+    """[(ID canonico, [ID duplicati], similarità minima)] per i gruppi di quasi-duplicati.
+    usage: {ID_PRODOTTO: righe in Scontrini} per scegliere il canonico (a parità vince il primo nel foglio)."""
+    usage = usage or {}
+    recs = df_cat.to_dict("records")
+    ids = [str(r.get("ID_PRODOTTO", "")).strip() for r in recs]
+    first = {}
+    for i, pid in enumerate(ids): first.setdefault(pid, i)
+
+    rng = np.random.default_rng(seed)
+    perm_a = rng.integers(1, MERSENNE, N_PERM, dtype=np.uint64) >> np.uint64(32)
+    perm_b = rng.integers(0, MERSENNE, N_PERM, dtype=np.uint64) >> np.uint64(32)
+    rows = N_PERM // BANDS
+
+    blocks = {}
+    for i, r in enumerate(recs):
+        if ids[i] and first[ids[i]] == i: blocks.setdefault(block_key(r), []).append(i)
+
+    names = {i: recs[i].get("NOME_NORMALIZZATO", "") for m in blocks.values() if len(m) > 1 for i in m}
+    grams = {i: trigram_set(n) for i, n in names.items()}
+    # Le cifre del nome devono coincidere (es. PENNE 73 / PENNE 74 sono prodotti diversi)
+    digits = {i: tuple(re.findall(r"\d+", norm_name(n))) for i, n in names.items()}
+    verified = {}
+
+    def similarity(i, j):
+        """Jaccard della coppia se passa tutte le verifiche, altrimenti None"""
+        key = (min(i, j), max(i, j))
+        if key not in verified:
+            s = jaccard(grams[i], grams[j])
+            ok = s >= threshold and digits[i] == digits[j] and same_words(names[i], names[j])
+            verified[key] = s if ok else None
+        return verified[key]
+
+    edges = []
+    for members in blocks.values():
+        if len(members) < 2: continue
+        sig = np.stack([minhash(grams[i], perm_a, perm_b) for i in members])
+        candidates = set()
+        for b in range(BANDS):
+            buckets = {}
+            for m, band in zip(members, map(bytes, sig[:, b * rows:(b + 1) * rows])):
+                buckets.setdefault(band, []).append(m)
+            for bucket in buckets.values():
+                for x in range(len(bucket)):
+                    for y in range(x + 1, len(bucket)): candidates.add((bucket[x], bucket[y]))
+        edges += [(s, i, j) for i, j in candidates if (s := similarity(i, j)) is not None]
+
+    # Gruppi a legame completo: dalle coppie più simili, due gruppi si uniscono solo se
+    # ogni prodotto dell'uno è verificato con ogni prodotto dell'altro
+    group = {}
+    for _, i, j in sorted(edges, key=lambda e: (-e[0], min(e[1:]), max(e[1:]))):
+        a, b = group.get(i, [i]), group.get(j, [j])
+        if a is b or not all(similarity(x, y) is not None for x in a for y in b): continue
+        merged = a + b
+        for x in merged: group[x] = merged
+
+    out, seen = [], set()
+    for members in group.values():
+        if id(members) in seen: continue
+        seen.add(id(members))
+        canon = min(members, key=lambda i: (-usage.get(ids[i], 0), i))
+        min_sim = min(similarity(x, y) for x in members for y in members if x < y)
+        out.append((ids[canon], [ids[i] for i in sorted(members) if i != canon], round(min_sim, 3)))
+    return sorted(out, key=lambda g: first[g[0]])
+
+
+def remap_ids(id_values, groups):
+    """{indice riga: nuovo ID} per le righe di Scontrini che puntano a un duplicato"""
+    target = {dup: canon for canon, dups, _ in groups for dup in dups}
+    return {i: target[v.strip()] for i, v in enumerate(map(str, id_values)) if v.strip() in target}
+
+
+def apply_merge(ws_scontrini, ws_catalogo, df_cat, groups, aliases=None):
+    """Rimappa ID_PRODOTTO in Scontrini (celle cambiate) e negli alias, elimina i duplicati dal Catalogo.
+    Una batch_update per le celle e una per le righe: una scrittura a metà non resta per colpa della quota."""
+    from gspread.utils import rowcol_to_a1
+    from clean_db import delete_rows_batched
+    header = ws_scontrini.row_values(1)
+    col = scontrini_cols(header)["id"] + 1
+    values = ws_scontrini.col_values(col)[1:]
+    changes = remap_ids(values, groups)
+    updates = [{"range": rowcol_to_a1(i + 2, col), "values": [[pid]]} for i, pid in sorted(changes.items())]
+    if updates: ws_scontrini.batch_update(updates, value_input_option="USER_ENTERED")
+
+    dups = {d for _, ds, _ in groups for d in ds}
+    ids = df_cat["ID_PRODOTTO"].astype(str).str.strip().tolist()
+    rows = [i + 2 for i, pid in enumerate(ids) if pid in dups]
+    if rows: delete_rows_batched(ws_catalogo, rows, batch=len(rows))
+    if aliases is not None: aliases.remap({d: canon for canon, ds, _ in groups for d in ds})
+    return len(changes), len(dups)
+
+
+def _open_sheets():
+    """Scontrini e Catalogo dal backend configurato (STORAGE_BACKEND)"""
+    from storage import open_backend
+    backend = open_backend()
+    return backend.table("Scontrini"), backend.table("Catalogo")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Trova (e unisce) i prodotti quasi duplicati del Catalogo")
+    ap.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="Jaccard minima sui trigrammi")
+    ap.add_argument("--apply", action="store_true", help="rimappa Scontrini ed elimina i duplicati")
+    ap.add_argument("--out", help="CSV delle proposte")
+    args = ap.parse_args(argv)
+
+    ws_scontrini, ws_catalogo = _open_sheets()
+    df_cat = pd.DataFrame(ws_catalogo.get_all_records())
+    if df_cat.empty:
+        print("Catalogo vuoto.")
+        return
+    header = ws_scontrini.row_values(1)
+    col = scontrini_cols(header)["id"] + 1
+    usage = pd.Series(ws_scontrini.col_values(col)[1:], dtype=str).str.strip().value_counts().to_dict()
+
+    t0 = time.time()
+    groups = find_duplicates(df_cat, usage, threshold=args.threshold)
+    names = dict(zip(df_cat["ID_PRODOTTO"].astype(str).str.strip(), df_cat["NOME_NORMALIZZATO"]))
+    print(f"{len(df_cat)} prodotti, {len(groups)} gruppi di duplicati ({sum(len(d) for _, d, _ in groups)} ID da unire) in {time.time() - t0:.1f} s")
+    for canon, dups, sim in groups:
+        print(f"  {names.get(canon)} [{canon}] <- " + ", ".join(f"{names.get(d)} [{d}]" for d in dups) + f"  (sim >= {sim})")
+    if args.out:
+        pd.DataFrame([(c, d, names.get(c), names.get(d), s) for c, ds, s in groups for d in ds],
+                     columns=["ID_CANONICO", "ID_DUPLICATO", "NOME_CANONICO", "NOME_DUPLICATO", "SIMILARITA"]).to_csv(args.out, index=False)
+
+    if args.apply and groups:
+        from aliases import AliasStore
+        from snapshot import Snapshot
+        righe, prodotti = apply_merge(ws_scontrini, ws_catalogo, df_cat, groups, aliases=AliasStore())
+        Snapshot().invalidate()
+        print(f"✅ Rimappate {righe} righe di Scontrini, eliminati {prodotti} prodotti dal Catalogo.")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
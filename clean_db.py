@@ -1,51 +1,151 @@
-import gspread
 import pandas as pd
-from google.oauth2.service_account import Credentials
+from gspread.utils import rowcol_to_a1
 import os
 import json
+import time
+import hashlib
+import argparse
+from utils import sqlite_connect
+from storage import open_backend, TABLES
 
-def run_cleanup():
+# --- PULIZIA DUPLICATI INCREMENTALE ---
+# Le impronte (hash delle colonne chiave) delle righe già controllate restano in un
+# archivio SQLite locale insieme al punto di controllo (righe esaminate + intestazione).
+# A ogni esecuzione si scaricano solo le righe aggiunte dopo il punto di controllo;
+# i duplicati vengono eliminati con un'unica batch_update di deleteDimension, senza
+# svuotare e riscrivere il foglio. Si tiene la prima copia (le righe vecchie non si
+# spostano e le impronte salvate restano valide). Se l'intestazione cambia o il foglio
+# ha meno righe del punto di controllo l'archivio viene ricostruito da zero.
+#
+# Uso: python clean_db.py [--dry-run] [--benchmark] [--full]
+
+STATE_PATH = os.environ.get("CLEAN_DB_STATE", os.path.join(".cache", "clean_db.db"))
+KEY_COLS = ['Data', 'Supermercato', 'Indirizzo', 'Prodotto', 'Prezzo_Netto', 'Prezzo Un.']
+DELETE_BATCH = 500
+
+
+class FingerprintStore:
+    def __init__(self, path=STATE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self.connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS fingerprint (fp TEXT PRIMARY KEY)")
+            conn.execute("CREATE TABLE IF NOT EXISTS checkpoint (k TEXT PRIMARY KEY, v TEXT)")
+
+    def connect(self):
+        return sqlite_connect(self.path)
+
+    def checkpoint(self):
+        with self.connect() as conn:
+            r = conn.execute("SELECT v FROM checkpoint WHERE k = 'state'").fetchone()
+        return json.loads(r[0]) if r else None
+
+    def known(self, fps):
+        with self.connect() as conn:
+            return {fp for fp in set(fps) if conn.execute("SELECT 1 FROM fingerprint WHERE fp = ?", (fp,)).fetchone()}
+
+    def commit(self, new_fps, n_rows, header, reset=False):
+        """Impronte nuove + punto di controllo nella stessa transazione"""
+        with self.connect() as conn:
+            if reset: conn.execute("DELETE FROM fingerprint")
+            conn.executemany("INSERT OR IGNORE INTO fingerprint VALUES (?)", [(fp,) for fp in new_fps])
+            conn.execute("INSERT OR REPLACE INTO checkpoint VALUES ('state', ?)",
+                         (json.dumps({"n_rows": n_rows, "header": header, "at": time.time()}),))
+
+
+def fingerprint(row, key_idx):
+    vals = [str(row[i]).strip() if i < len(row) else "" for i in key_idx]
+    return hashlib.sha1("\x1f".join(vals).encode()).hexdigest()
+
+
+def find_duplicates(rows, key_idx, first_row, known):
+    """(numeri di riga da eliminare, impronte nuove) per le righe a partire da first_row (1-based)"""
+    dup_rows, new_fps = [], []
+    seen = set(known)
+    for off, row in enumerate(rows):
+        if not any(str(v).strip() for v in row): continue
+        fp = fingerprint(row, key_idx)
+        if fp in seen: dup_rows.append(first_row + off)
+        else:
+            seen.add(fp)
+            new_fps.append(fp)
+    return dup_rows, new_fps
+
+
+def delete_rows_batched(worksheet, rows, batch=DELETE_BATCH):
+    """Elimina le righe (1-based) con deleteDimension, intervalli contigui dal basso verso l'alto"""
+    ranges = []
+    for r in sorted(rows, reverse=True):
+        if ranges and ranges[-1][0] == r + 1: ranges[-1][0] = r
+        else: ranges.append([r, r])
+    reqs = [{"deleteDimension": {"range": {"sheetId": worksheet.id, "dimension": "ROWS",
+                                           "startIndex": top - 1, "endIndex": bottom}}} for top, bottom in ranges]
+    for i in range(0, len(reqs), batch):
+        worksheet.spreadsheet.batch_update({"requests": reqs[i:i + batch]})
+
+
+def run_cleanup(dry_run=False, benchmark=False, full=False, store=None):
     try:
         print("Inizio procedura di pulizia...")
-        # Recupero credenziali
-        info = json.loads(os.environ['GOOGLE_SHEETS_JSON'])
-        creds = Credentials.from_service_account_info(info, scopes=["https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"])
-        gc = gspread.authorize(creds)
-        
-        # Apertura foglio
-        sh = gc.open("Database_Prezzi")
-        worksheet = sh.get_worksheet(0)
-        
-        # Caricamento dati
-        data = worksheet.get_all_records()
-        if not data:
+        # Foglio principale (Scontrini) dal backend configurato (STORAGE_BACKEND)
+        worksheet = open_backend().table(TABLES[0])
+
+        t0 = time.time()
+        header = [c.strip() for c in worksheet.row_values(1)]
+        if not header:
             print("Database vuoto.")
             return
-            
-        df = pd.DataFrame(data)
-        original_rows = len(df)
-        
+        # La colonna A (Data) è sempre valorizzata: basta per contare le righe
+        n_rows = max(len(worksheet.col_values(1)) - 1, 0)
+
         # Pulizia: consideriamo duplicata una riga con stessa Data, Negozio, Prodotto e Prezzo
-        # Usiamo nomi generici per trovare le colonne anche se hanno spazi
-        df.columns = [c.strip() for c in df.columns]
-        subset_cols = [c for c in df.columns if c in ['Data', 'Supermercato', 'Indirizzo', 'Prodotto', 'Prezzo_Netto', 'Prezzo Un.']]
-        
-        df_pulito = df.drop_duplicates(subset=subset_cols, keep='last')
-        
-        if len(df_pulito) < original_rows:
-            # Svuota tutto
-            worksheet.clear()
-            # Prepara i dati per il caricamento (Intestazioni + Righe)
-            nuovi_dati = [df_pulito.columns.values.tolist()] + df_pulito.values.tolist()
-            # Scrittura (usando il metodo più compatibile)
-            worksheet.update('A1', nuovi_dati)
-            print(f"✅ Successo! Rimosse {original_rows - len(df_pulito)} righe duplicate.")
+        key_idx = [i for i, c in enumerate(header) if c in KEY_COLS]
+
+        store = store or FingerprintStore()
+        state = store.checkpoint()
+        reset = full or state is None or state["header"] != header or n_rows < state["n_rows"]
+        start = 0 if reset else state["n_rows"]
+
+        rows = []
+        if n_rows > start:
+            rows = worksheet.get(f"{rowcol_to_a1(start + 2, 1)}:{rowcol_to_a1(n_rows + 1, len(header))}")
+        t_fetch = time.time() - t0
+
+        dup_rows, new_fps = find_duplicates(rows, key_idx, start + 2, set() if reset else store.known(fingerprint(r, key_idx) for r in rows))
+        t_scan = time.time() - t0 - t_fetch
+
+        modo = "completo" if reset else "incrementale"
+        print(f"Controllo {modo}: {len(rows)} righe esaminate su {n_rows} (lettura {t_fetch:.2f} s, confronto {t_scan:.3f} s).")
+
+        if benchmark:
+            # Confronto con la vecchia strategia: foglio intero + drop_duplicates
+            t1 = time.time()
+            df = pd.DataFrame(worksheet.get_all_records())
+            df.columns = [c.strip() for c in df.columns]
+            subset_cols = [c for c in df.columns if c in KEY_COLS]
+            n_dup_full = len(df) - len(df.drop_duplicates(subset=subset_cols, keep='first'))
+            print(f"Benchmark lettura completa: {len(df)} righe, {n_dup_full} duplicati totali in {time.time() - t1:.2f} s.")
+
+        if dry_run or benchmark:
+            print(f"🔎 Dry-run: {len(dup_rows)} righe duplicate da eliminare {dup_rows[:20]}{' ...' if len(dup_rows) > 20 else ''}")
+            return
+
+        if dup_rows:
+            delete_rows_batched(worksheet, dup_rows)
+            print(f"✅ Successo! Rimosse {len(dup_rows)} righe duplicate.")
         else:
             print("✨ Nessun duplicato trovato.")
-            
+        # Punto di controllo solo a cancellazioni avvenute: un crash prima rifà lo stesso controllo
+        store.commit(new_fps, n_rows - len(dup_rows), header, reset=reset)
+
     except Exception as e:
         print(f"❌ Errore: {e}")
         raise e
 
 if __name__ == "__main__":
-    run_cleanup()
+    ap = argparse.ArgumentParser(description="Elimina le righe duplicate del foglio principale")
+    ap.add_argument("--dry-run", action="store_true", help="mostra i duplicati senza eliminarli")
+    ap.add_argument("--benchmark", action="store_true", help="dry-run con confronto rispetto alla lettura completa")
+    ap.add_argument("--full", action="store_true", help="ricontrolla tutto il foglio")
+    args = ap.parse_args()
+    run_cleanup(dry_run=args.dry_run, benchmark=args.benchmark, full=args.full)
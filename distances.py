@@ -0,0 +1,131 @@
+import os
+import time
+import requests
+from utils import sqlite_connect
+
+# --- DISTANZE STRADALI (OSRM) CON CACHE SU DISCO ---
+# Chiave = coordinate arrotondate di origine e destinazione, con scadenza (TTL).
+# Le distanze mancanti vengono chieste tutte insieme con una sola chiamata /table.
+
+OSRM_URL = os.environ.get("OSRM_URL", "https://router.project-osrm.org").rstrip("/")
+DIST_CACHE_PATH = os.environ.get("DIST_CACHE_PATH", os.path.join(".cache", "distances.db"))
+DIST_TTL_S = int(os.environ.get("DIST_TTL_S", str(30 * 24 * 3600)))
+ORIGIN_DECIMALS = 3   # ~100 m: la posizione utente (GPS) oscilla
+DEST_DECIMALS = 4     # ~10 m: i negozi sono fissi
+TABLE_MAX_COORDS = 100  # limite del server demo OSRM per /table
+
+
+class DistanceCache:
+    def __init__(self, path=DIST_CACHE_PATH, ttl_s=DIST_TTL_S):
+        self.path = path
+        self.ttl_s = ttl_s
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self.connect() as conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS dist (
+                lat1 REAL, lon1 REAL, lat2 REAL, lon2 REAL, km REAL, ts REAL,
+                PRIMARY KEY (lat1, lon1, lat2, lon2))""")
+        self.evict()
+
+    def connect(self):
+        return sqlite_connect(self.path)
+
+    def get_many(self, keys):
+        """{key: km} per le chiavi presenti e non scadute"""
+        out = {}
+        min_ts = time.time() - self.ttl_s
+        with self.connect() as conn:
+            for k in keys:
+                r = conn.execute("SELECT km FROM dist WHERE lat1=? AND lon1=? AND lat2=? AND lon2=? AND ts >= ?", (*k, min_ts)).fetchone()
+                if r: out[k] = r[0]
+        return out
+
+    def put_many(self, items):
+        now = time.time()
+        with self.connect() as conn:
+            conn.executemany("INSERT OR REPLACE INTO dist VALUES (?, ?, ?, ?, ?, ?)",
+                             [(*k, km, now) for k, km in items.items()])
+
+    def evict(self):
+        with self.connect() as conn:
+            conn.execute("DELETE FROM dist WHERE ts < ?", (time.time() - self.ttl_s,))
+
+
+def _key(origin, dest, origin_decimals=ORIGIN_DECIMALS):
+    return (round(origin[0], origin_decimals), round(origin[1], origin_decimals),
+            round(dest[0], DEST_DECIMALS), round(dest[1], DEST_DECIMALS))
+
+
+def osrm_table(origin, dests, timeout=10):
+    """Distanze (km) da origin a ogni destinazione con richieste /table a blocchi"""
+    out = []
+    step = TABLE_MAX_COORDS - 1
+    for i in range(0, len(dests), step):
+        chunk = dests[i:i + step]
+        coords = ";".join(f"{lon},{lat}" for lat, lon in [origin, *chunk])
+        url = f"{OSRM_URL}/table/v1/driving/{coords}?sources=0&annotations=distance"
+        try:
+            data = requests.get(url, timeout=timeout).json()
+            row = data["distances"][0] if data.get("code") == "Ok" else [None] * (len(chunk) + 1)
+        except: row = [None] * (len(chunk) + 1)
+        out += [round(m / 1000, 1) if m is not None else None for m in row[1:]]
+    return out
+
+
+def osrm_table_block(sources, dests, timeout=10):
+    """Matrice km sources x dests con una sola richiesta /table (len totale <= TABLE_MAX_COORDS)"""
+    coords = ";".join(f"{lon},{lat}" for lat, lon in [*sources, *dests])
+    src = ";".join(str(i) for i in range(len(sources)))
+    dst = ";".join(str(len(sources) + i) for i in range(len(dests)))
+    url = f"{OSRM_URL}/table/v1/driving/{coords}?sources={src}&destinations={dst}&annotations=distance"
+    try:
+        data = requests.get(url, timeout=timeout).json()
+        if data.get("code") == "Ok":
+            return [[round(m / 1000, 1) if m is not None else None for m in row] for row in data["distances"]]
+    except: pass
+    return [[None] * len(dests) for _ in sources]
+
+
+def distance_matrix(home, shops, cache=None):
+    """Matrice km (n+1) x (n+1) fra casa (indice 0) e negozi, None dove OSRM non risponde.
+    Usa la stessa cache di road_distances; le coppie mancanti vanno a blocchi su /table."""
+    pts = [home, *shops]
+    dec = [ORIGIN_DECIMALS] + [DEST_DECIMALS] * len(shops)
+    n = len(pts)
+    keys = {(i, j): _key(pts[i], pts[j], dec[i]) for i in range(n) for j in range(n) if i != j}
+    found = cache.get_many(set(keys.values())) if cache else {}
+
+    missing = [(i, j) for (i, j), k in keys.items() if k not in found]
+    half = TABLE_MAX_COORDS // 2
+    rows = sorted({i for i, _ in missing})
+    cols = sorted({j for _, j in missing})
+    new = {}
+    for a in range(0, len(rows), half):
+        for b in range(0, len(cols), half):
+            ri, cj = rows[a:a + half], cols[b:b + half]
+            if not any((i, j) in keys and keys[(i, j)] not in found for i in ri for j in cj): continue
+            block = osrm_table_block([pts[i] for i in ri], [pts[j] for j in cj])
+            for x, i in enumerate(ri):
+                for y, j in enumerate(cj):
+                    if i != j and block[x][y] is not None: new[keys[(i, j)]] = block[x][y]
+    if cache and new: cache.put_many(new)
+    found.update(new)
+    return [[0.0 if i == j else found.get(keys[(i, j)]) for j in range(n)] for i in range(n)]
+
+
+def road_distances(origin, dests, cache=None):
+    """Distanze stradali in km (None se non calcolabile), nell'ordine di dests"""
+    if not dests: return []
+    keys = [_key(origin, d) for d in dests]
+    found = cache.get_many(set(keys)) if cache else {}
+    missing = list(dict.fromkeys(k for k in keys if k not in found))
+    if missing:
+        o = (missing[0][0], missing[0][1])
+        kms = osrm_table(o, [(k[2], k[3]) for k in missing])
+        new = {k: km for k, km in zip(missing, kms) if km is not None}
+        if cache and new: cache.put_many(new)
+        found.update(new)
+    return [found.get(k) for k in keys]
+
+
+def get_road_distance(lat1, lon1, lat2, lon2, cache=None):
+    return road_distances((lat1, lon1), [(lat2, lon2)], cache=cache)[0]
@@ -0,0 +1,142 @@
+import os
+import json
+import time
+import random
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from extraction_cache import prompt_version, receipt_keys
+
+# --- ESTRAZIONE SCONTRINI CON GEMINI ---
+# Un job = uno scontrino (una o più foto). I job girano in parallelo su un pool di
+# thread limitato, con retry e backoff esponenziale; i risultati escono man mano
+# che arrivano, così la UI può mostrarli subito. Con una ExtractionCache gli scontrini
+# già visti (stessa versione del prompt) escono subito senza chiamare il modello.
+
+EXTRACTION_WORKERS = int(os.environ.get("EXTRACTION_WORKERS", "4"))
+EXTRACTION_RETRIES = int(os.environ.get("EXTRACTION_RETRIES", "3"))
+
+# --- PROMPT IBRIDO (CONTABILE + DATA MANAGER + SCONTRINO ID) ---
+PROMPT_TEMPLATE = """
+Agisci con due ruoli simultanei: 
+1. CONTABILE (per i calcoli di cassa precisi)
+2. DATA MANAGER (per la normalizzazione del database)
+
+Analizza le immagini dello scontrino seguendo rigorosamente queste FASI:
+
+--- FASE 1: TESTATA E IDENTIFICATIVI ---
+Cerca:
+- P.IVA (solo cifre)
+- Indirizzo completo
+- Data (YYYY-MM-DD)
+- NUMERO SCONTRINO: Cerca etichette come 'Scontrino n.', 'Doc.', 'RT', 'SF', '#'. Estrai il codice identificativo univoco.
+
+--- FASE 2: PULIZIA CONTABILE (Regole 'V18') ---
+A. SCONTI E PREZZI NEGATIVI: 
+   Se vedi righe come 'SCONTO', 'FIDATY', o importi col segno meno (-0.50) subito sotto un prodotto:
+   - NON creare una riga per lo sconto.
+   - SOTTRAI il valore al prezzo del prodotto sopra. 
+   - Imposta 'is_offerta' su "SI".
+
+B. MOLTIPLICATORI:
+   Se vedi '3 x 1.50' (3 pezzi a 1.50 l'uno):
+   - 'quantita_acquistata' = 3
+   - 'prezzo_unitario' = 1.50
+
+--- FASE 3: ESTRAZIONE E NORMALIZZAZIONE DATABASE ---
+Per ogni riga risultante dalla Fase 2, estrai:
+
+1. 'nome_grezzo': Testo originale.
+2. 'nome_normalizzato': Nome standard descrittivo (es. 'LATTE GRANAROLO P.S. 1L').
+   - Se simile a questi, usa ESATTAMENTE questo nome: {nomi_noti}
+3. 'brand': Marca (es. GRANAROLO). Se non c'è, 'GENERICO'.
+4. 'categoria': Macro categoria (es. LATTE, PASTA).
+5. 'formato': SOLO IL NUMERO (es. 1.0, 0.5).
+6. 'unita': SOLO 'KG', 'L', 'PZ'. Converti tutto (500ml -> 0.5 L).
+
+OUTPUT JSON:
+{{
+  "testata": {{ "p_iva": "", "indirizzo": "", "data_iso": "", "num_scontrino": "" }},
+  "prodotti": [
+    {{
+      "nome_grezzo": "...", "nome_normalizzato": "...", "brand": "...", "categoria": "...",
+      "formato": 1.0, "unita": "L", "prezzo_unitario": 0.0, "quantita_acquistata": 1, "is_offerta": "NO"
+    }}
+  ]
+}}
+"""
+
+
+def build_prompt(nomi_noti):
+    return PROMPT_TEMPLATE.format(nomi_noti=list(nomi_noti)[:50])
+
+
+def parse_response(text):
+    """JSON del modello (ripulito dai blocchi ```json)"""
+    return json.loads(text.strip().replace('```json', '').replace('```', ''))
+
+
+def group_jobs(names, images, same_receipt=False):
+    """[(etichetta, [immagini])]: tutte insieme se sono pezzi dello stesso scontrino, altrimenti una per job"""
+    if not images: return []
+    if same_receipt: return [(" + ".join(names), list(images))]
+    return [(n, [img]) for n, img in zip(names, images)]
+
+
+def extract_one(model, prompt, images, retries=EXTRACTION_RETRIES, backoff_s=2.0):
+    """Chiamata singola con retry (quota, errori di rete, JSON non valido)"""
+    for attempt in range(retries + 1):
+        try:
+            return parse_response(model.generate_content([prompt, *images]).text)
+        except Exception:
+            if attempt == retries: raise
+            time.sleep(backoff_s * (2 ** attempt) * (1 + random.random() / 2))
+
+
+def extract_receipts(model, prompt, jobs, max_workers=EXTRACTION_WORKERS, retries=EXTRACTION_RETRIES, cache=None):
+    """Genera (indice job, dati, errore, secondi, da cache, possibile duplicato) nell'ordine di completamento.
+    Possibile duplicato: foto simili a uno scontrino diverso già analizzato (da far confermare)."""
+    version = prompt_version(PROMPT_TEMPLATE, getattr(model, "model_name", ""))
+    keys, todo = {}, []
+    for i, (_, images) in enumerate(jobs):
+        if cache is None:
+            todo.append(i)
+            continue
+        t0 = time.time()
+        keys[i] = receipt_keys(images, version)
+        dati = cache.get(keys[i])
+        if dati is not None: yield i, dati, None, time.time() - t0, True, False
+        else: todo.append(i)
+
+    def run(i, images):
+        t0 = time.time()
+        try: return i, extract_one(model, prompt, images, retries=retries), None, time.time() - t0, False, False
+        except Exception as e: return i, None, e, time.time() - t0, False, False
+
+    if not todo: return
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        futures = [pool.submit(run, i, jobs[i][1]) for i in todo]
+        for fut in as_completed(futures):
+            res = fut.result()
+            if cache is not None and res[2] is None:
+                res = res[:5] + (cache.near_duplicate(keys[res[0]]),)
+                cache.put(keys[res[0]], res[1])
+            yield res
+
+
+class FakeModel:
+    """Sostituto locale di GenerativeModel per prove senza rete: risponde con un JSON fisso
+    (o con responder(parts) se fornito) dopo un ritardo simulato."""
+
+    class _Response:
+        def __init__(self, text): self.text = text
+
+    def __init__(self, payload=None, delay_s=0.0, responder=None):
+        self.payload = payload or {"testata": {"p_iva": "", "indirizzo": "", "data_iso": "2026-01-15", "num_scontrino": ""}, "prodotti": []}
+        self.delay_s = delay_s
+        self.responder = responder
+        self.calls = 0
+
+    def generate_content(self, parts):
+        self.calls += 1
+        time.sleep(self.delay_s)
+        data = self.responder(parts) if self.responder else self.payload
+        return self._Response("```json\n" + json.dumps(data) + "\n```")
@@ -0,0 +1,133 @@
+import io
+import os
+import json
+import time
+import hashlib
+import numpy as np
+from PIL import Image
+from utils import sqlite_connect
+
+# --- CACHE DEI RISULTATI DI ESTRAZIONE ---
+# Chiave = versione del prompt + hash esatto dei byte delle foto dello scontrino: solo la
+# stessa foto ricaricata riusa il risultato. L'hash percettivo (dHash 16x16) non basta a
+# distinguere due scontrini con la stessa impaginazione (coglie la sagoma del foglio, non
+# il testo), quindi serve solo a segnalare un "possibile duplicato" da far confermare
+# all'utente, mai a restituire dati. Cambiando il template del prompt o il modello cambia
+# la versione e le vecchie voci non vengono più lette (poi escono per LRU).
+# Accanto, i tempi di Gemini per le stesse foto originali inviate preparate ("prep") o
+# così come sono ("raw"): con "Ottimizza foto" acceso e spento si confronta la latenza.
+
+EXTRACT_CACHE_PATH = os.environ.get("EXTRACT_CACHE_PATH", os.path.join(".cache", "extractions.db"))
+EXTRACT_CACHE_MAX_ENTRIES = int(os.environ.get("EXTRACT_CACHE_MAX_ENTRIES", "5000"))
+EXTRACT_CACHE_MAX_MB = float(os.environ.get("EXTRACT_CACHE_MAX_MB", "50"))
+DHASH_SIDE = 16
+DHASH_MAX_BITS = 12
+
+
+def prompt_version(template, model_name=""):
+    return hashlib.sha256(f"{model_name}\n{template}".encode()).hexdigest()[:12]
+
+
+def _as_image(part):
+    if isinstance(part, dict): return Image.open(io.BytesIO(part["data"]))
+    return part
+
+
+def content_hash(part):
+    if isinstance(part, dict): data = part["data"]
+    else: data = part.tobytes() + repr((part.mode, part.size)).encode()
+    return hashlib.sha256(data).hexdigest()
+
+
+def photos_key(raw_bytes):
+    """Chiave delle foto originali di uno scontrino (byte caricati, in ordine), a prescindere dalla preparazione"""
+    return hashlib.sha256(b"|".join(hashlib.sha256(b).digest() for b in raw_bytes)).hexdigest()
+
+
+def dhash(part, side=DHASH_SIDE):
+    """Hash percettivo a differenze orizzontali (side*side bit, esadecimale)"""
+    img = _as_image(part).convert("L").resize((side + 1, side), Image.LANCZOS)
+    a = np.asarray(img, dtype=np.int16)
+    bits = (a[:, 1:] > a[:, :-1]).ravel()
+    return np.packbits(bits).tobytes().hex()
+
+
+def receipt_keys(parts, version):
+    """(chiave esatta, versione, hash percettivi) di uno scontrino (lista di foto in ordine)"""
+    key = hashlib.sha256((version + "|" + "|".join(content_hash(p) for p in parts)).encode()).hexdigest()
+    return key, version, "|".join(dhash(p) for p in parts)
+
+
+def _bits(phash):
+    return np.unpackbits(np.frombuffer(bytes.fromhex(phash.replace("|", "")), dtype=np.uint8))
+
+
+def similar(phash_a, phash_b, max_bits=DHASH_MAX_BITS):
+    """Stesso numero di foto e ognuna entro max_bits bit di differenza"""
+    a, b = phash_a.split("|"), phash_b.split("|")
+    return len(a) == len(b) and all(int((_bits(x) != _bits(y)).sum()) <= max_bits for x, y in zip(a, b))
+
+
+class ExtractionCache:
+    def __init__(self, path=EXTRACT_CACHE_PATH, max_entries=EXTRACT_CACHE_MAX_ENTRIES, max_mb=EXTRACT_CACHE_MAX_MB):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self.connect() as conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS extraction (
+                key TEXT PRIMARY KEY, version TEXT, phash TEXT, data TEXT, size INTEGER, used REAL)""")
+            conn.execute("CREATE INDEX IF NOT EXISTS extraction_version ON extraction (version)")
+            conn.execute("CREATE INDEX IF NOT EXISTS extraction_used ON extraction (used)")
+            conn.execute("CREATE TABLE IF NOT EXISTS latency (photos TEXT, mode TEXT, secs REAL, ts REAL, PRIMARY KEY (photos, mode))")
+
+    def connect(self):
+        return sqlite_connect(self.path)
+
+    def get(self, keys):
+        """Dati estratti per le stesse foto (chiave esatta), None se assenti; aggiorna l'uso (LRU)"""
+        with self.connect() as conn:
+            r = conn.execute("SELECT data FROM extraction WHERE key=?", (keys[0],)).fetchone()
+            if not r: return None
+            conn.execute("UPDATE extraction SET used=? WHERE key=?", (time.time(), keys[0]))
+        return json.loads(r[0])
+
+    def near_duplicate(self, keys):
+        """True se uno scontrino diverso già in cache ha foto percettivamente simili (solo un avviso)"""
+        key, version, phash = keys
+        with self.connect() as conn:
+            rows = conn.execute("SELECT phash FROM extraction WHERE version=? AND key<>?", (version, key))
+            return any(similar(phash, r[0]) for r in rows)
+
+    def put(self, keys, dati):
+        data = json.dumps(dati, ensure_ascii=False)
+        with self.connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO extraction VALUES (?, ?, ?, ?, ?, ?)",
+                         (*keys, data, len(data.encode()), time.time()))
+        self.evict()
+
+    def evict(self):
+        """Toglie le voci usate meno di recente oltre i limiti di numero e dimensione"""
+        with self.connect() as conn:
+            conn.execute("""DELETE FROM extraction WHERE key IN (SELECT key FROM extraction
+                            ORDER BY used DESC LIMIT -1 OFFSET ?)""", (self.max_entries,))
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM extraction").fetchone()[0]
+            if total <= self.max_bytes: return
+            for key, size in conn.execute("SELECT key, size FROM extraction ORDER BY used").fetchall():
+                conn.execute("DELETE FROM extraction WHERE key=?", (key,))
+                total -= size
+                if total <= self.max_bytes: break
+
+    def log_latency(self, photos, mode, secs=None):
+        """Registra (se secs è dato) il tempo di Gemini per le foto nella modalità data; {modalità: secondi} noti"""
+        with self.connect() as conn:
+            if secs is not None: conn.execute("INSERT OR REPLACE INTO latency VALUES (?, ?, ?, ?)", (photos, mode, secs, time.time()))
+            return dict(conn.execute("SELECT mode, secs FROM latency WHERE photos=?", (photos,)))
+
+    def stats(self):
+        with self.connect() as conn:
+            n, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM extraction").fetchone()
+        return {"entries": n, "bytes": size}
+
+    def clear(self):
+        with self.connect() as conn: conn.execute("DELETE FROM extraction")
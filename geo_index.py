@@ -0,0 +1,48 @@
+import math
+import numpy as np
+
+# --- INDICE GEOGRAFICO DEI NEGOZI ---
+# Negozi ordinati per latitudine: la fascia compatibile col raggio si trova con una
+# ricerca binaria, poi si applica l'haversine vettoriale solo a quella fascia.
+# La distanza in linea d'aria è un limite inferiore di quella stradale, quindi il
+# pre-filtro non scarta mai negozi che sarebbero nel raggio su strada.
+
+EARTH_R_KM = 6371.0088
+KM_PER_DEG_LAT = EARTH_R_KM * math.pi / 180   # stessa sfera dell'haversine: la fascia contiene il cerchio
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_R_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def parse_coords(rec):
+    """(lat, lon) float dal record Anagrafe_Negozi, None se mancanti o non validi"""
+    try:
+        lat = float(str(rec.get('Latitudine', '')).replace(',', '.'))
+        lon = float(str(rec.get('Longitudine', '')).replace(',', '.'))
+    except: return None
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180): return None
+    return lat, lon
+
+
+class ShopGeoIndex:
+    def __init__(self, shops):
+        pts = [(s, parse_coords(s)) for s in shops]
+        pts = sorted([(s, c) for s, c in pts if c], key=lambda x: x[1][0])
+        self.shops = [s for s, _ in pts]
+        self.lat = np.array([c[0] for _, c in pts], dtype=float)
+        self.lon = np.array([c[1] for _, c in pts], dtype=float)
+
+    def within(self, lat, lon, radius_km):
+        """[(record negozio, km in linea d'aria)] entro il raggio, ordinati per distanza"""
+        if not self.shops: return []
+        d_lat = radius_km / KM_PER_DEG_LAT
+        lo = np.searchsorted(self.lat, lat - d_lat, side='left')
+        hi = np.searchsorted(self.lat, lat + d_lat, side='right')
+        if lo >= hi: return []
+        km = haversine_km(lat, lon, self.lat[lo:hi], self.lon[lo:hi])
+        idx = np.nonzero(km <= radius_km)[0]
+        idx = idx[np.argsort(km[idx], kind='stable')]
+        return [(self.shops[lo + i], float(km[i])) for i in idx]
@@ -0,0 +1,95 @@
+import io
+import os
+import time
+import numpy as np
+from PIL import Image, ImageOps
+
+# --- PREPARAZIONE FOTO SCONTRINI PRIMA DELL'INVIO A GEMINI ---
+# Le foto del telefono (12+ Mpx) pesano sull'upload e sui token ma non servono all'OCR:
+# raddrizzamento EXIF, ritaglio sulla carta, scala di grigi, lato lungo limitato e JPEG
+# compatto. Le miniature per la UI sono separate e molto più piccole.
+
+PREP_MAX_SIDE = int(os.environ.get("PREP_MAX_SIDE", "2000"))      # px, lato lungo
+PREP_MIN_WIDTH = int(os.environ.get("PREP_MIN_WIDTH", "900"))     # px, sotto non si scala (testo leggibile)
+PREP_JPEG_QUALITY = int(os.environ.get("PREP_JPEG_QUALITY", "80"))
+THUMB_SIDE = 300
+CROP_MARGIN = 0.02          # frazione del lato aggiunta attorno al ritaglio
+CROP_MIN_AREA = 0.15        # sotto questa frazione il ritaglio è sospetto e si tiene la foto intera
+
+
+def otsu_threshold(gray):
+    """Soglia di Otsu su un array uint8"""
+    hist = np.bincount(gray.ravel(), minlength=256).astype(float)
+    w = np.cumsum(hist)
+    mu = np.cumsum(hist * np.arange(256))
+    total_w, total_mu = w[-1], mu[-1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        between = (total_mu * w - mu * total_w) ** 2 / (w * (total_w - w))
+    if np.isnan(between).all(): return int(gray.max())   # un solo livello di grigio: niente da separare
+    return int(np.nanargmax(between))
+
+
+def paper_bbox(gray_img, probe_side=400, min_frac=0.3):
+    """Riquadro (left, top, right, bottom) della carta, la zona chiara più estesa; None se incerto"""
+    small = gray_img.copy()
+    small.thumbnail((probe_side, probe_side))
+    a = np.asarray(small)
+    paper = a > otsu_threshold(a)
+    cols = np.nonzero(paper.mean(axis=0) > min_frac)[0]
+    rows = np.nonzero(paper.mean(axis=1) > min_frac)[0]
+    if not len(cols) or not len(rows): return None
+    h, w = a.shape
+    mx, my = int(w * CROP_MARGIN) + 1, int(h * CROP_MARGIN) + 1
+    l, r = max(cols[0] - mx, 0), min(cols[-1] + 1 + mx, w)
+    t, b = max(rows[0] - my, 0), min(rows[-1] + 1 + my, h)
+    if (r - l) * (b - t) < CROP_MIN_AREA * w * h: return None
+    sx, sy = gray_img.width / w, gray_img.height / h
+    return int(l * sx), int(t * sy), int(r * sx), int(b * sy)
+
+
+def prepare_image(img):
+    """Immagine pronta per l'OCR (scala di grigi, ritagliata, ridotta)"""
+    img = ImageOps.exif_transpose(img).convert("L")
+    box = paper_bbox(img)
+    if box: img = img.crop(box)
+    scale = min(PREP_MAX_SIDE / max(img.size), 1.0)
+    scale = max(scale, min(PREP_MIN_WIDTH / img.width, 1.0))
+    if scale < 1.0:
+        img = img.resize((round(img.width * scale), round(img.height * scale)), Image.LANCZOS)
+    return img
+
+
+def encode_jpeg(img, quality=PREP_JPEG_QUALITY):
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=quality, optimize=True)
+    return buf.getvalue()
+
+
+def make_thumbnail(img, side=THUMB_SIDE):
+    thumb = ImageOps.exif_transpose(img).copy()
+    thumb.thumbnail((side, side))
+    return thumb
+
+
+def prepare_upload(raw_bytes):
+    """Da byte originali a (parte per Gemini, miniatura, statistiche).
+    La parte è un blob JPEG {'mime_type', 'data'}: si invia esattamente ciò che si è misurato."""
+    t0 = time.time()
+    img = Image.open(io.BytesIO(raw_bytes))
+    data = encode_jpeg(prepare_image(img))
+    stats = {"bytes_orig": len(raw_bytes), "bytes_prep": len(data), "size_orig": img.size,
+             "prep_s": time.time() - t0}
+    return {"mime_type": "image/jpeg", "data": data}, make_thumbnail(img), stats
+
+
+def raw_upload(raw_bytes):
+    """Come prepare_upload ma senza preparazione (foto originale raddrizzata), per confronto"""
+    img = ImageOps.exif_transpose(Image.open(io.BytesIO(raw_bytes)))
+    return img, make_thumbnail(img), {"bytes_orig": len(raw_bytes), "bytes_prep": len(raw_bytes),
+                                      "size_orig": img.size, "prep_s": 0.0}
+
+
+def summarize(stats):
+    """Somma delle statistiche di più foto (uno scontrino)"""
+    return {"bytes_orig": sum(s["bytes_orig"] for s in stats), "bytes_prep": sum(s["bytes_prep"] for s in stats),
+            "prep_s": sum(s["prep_s"] for s in stats)}
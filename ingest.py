@@ -0,0 +1,160 @@
+from dataclasses import dataclass, field
+import numpy as np
+import pandas as pd
+from collections import Counter
+from snapshot import receipt_key, receipt_fields
+from utils import generate_short_id, clean_piva, norm_date, is_iso_date
+from aliases import alias_key
+from shop_registry import ADDR_COL
+
+# --- COSTRUZIONE RIGHE CATALOGO / SCONTRINI IN BLOCCO ---
+# Stesse regole del vecchio ciclo riga per riga del salvataggio, ma per colonne:
+# numeri convertiti in un colpo (virgola decimale, default se non numerici, NaN/inf -> 0
+# come sanitize_value), ID risolti con join su dizionari (alias -> nome in catalogo ->
+# nomi nuovi di questo salvataggio), un nuovo ID per ogni nome sconosciuto.
+# Usata dall'app e dall'importatore da riga di comando.
+
+# Colonne attese nel DataFrame (nomi dell'estrazione Gemini; ID = prodotto già risolto, opzionale)
+COLUMNS = ["nome_grezzo", "nome_normalizzato", "brand", "categoria", "formato", "unita",
+           "prezzo_unitario", "quantita_acquistata", "is_offerta"]
+
+
+ALIAS_FIELDS = [("nome_normalizzato", "NOME_NORMALIZZATO"), ("brand", "BRAND"), ("categoria", "CATEGORIA"),
+                ("formato", "FORMATO"), ("unita", "UNITA")]
+
+
+@dataclass
+class IngestResult:
+    rows_catalogo: list = field(default_factory=list)   # nuovi prodotti (6 colonne)
+    rows_scontrini: list = field(default_factory=list)  # righe scontrino (12 colonne)
+    aliases: dict = field(default_factory=dict)         # (nome grezzo, negozio) -> ID_PRODOTTO
+    skipped: int = 0                                     # righe già salvate (stesso scontrino)
+
+
+def text(s):
+    """str() di ogni cella, come nel vecchio ciclo (None -> 'None', NaN -> 'nan')"""
+    return s.map(str)
+
+
+def to_float(s, default):
+    """Come float(str(x).replace(',', '.')) con default sugli errori e sanitize_value (NaN/inf -> 0.0)"""
+    txt = text(s).str.strip().str.replace(",", ".", regex=False)
+    out = pd.to_numeric(txt, errors="coerce")
+    literal = txt.str.lower().str.lstrip("+-").isin(["nan", "inf", "infinity"])
+    out = out.where(out.notna() | literal, default)
+    return out.where(np.isfinite(out), 0.0).astype(float)
+
+
+def upper(s):
+    return text(s).str.upper().str.strip()
+
+
+def build_rows(df, testata, id_by_name, cat_by_id=None, already=None, new_id=generate_short_id):
+    """df: righe (colonne COLUMNS [+ ID]); testata: data, insegna, indirizzo, num.
+    already: Counter di receipt_line delle righe già salvate di questo scontrino (vengono saltate)."""
+    res = IngestResult()
+    if df.empty: return res
+    df = df.reset_index(drop=True).reindex(columns=COLUMNS + ["ID"])
+
+    p_unit = to_float(df["prezzo_unitario"], 0.0)
+    qta = to_float(df["quantita_acquistata"], 1.0)
+    fmt = to_float(df["formato"], np.nan)     # vuoto in catalogo se illeggibile: units non lo scambia per 1
+    tot = (p_unit * qta).where(np.isfinite(p_unit * qta), 0.0)
+    raw = text(df["nome_grezzo"]).str.upper()
+
+    # Righe già presenti: la k-esima copia di una riga si salta se ne esistono già più di k
+    keep = pd.Series(True, index=df.index)
+    if already:
+        lines = pd.DataFrame({"n": raw.str.strip(), "p": p_unit.round(2), "q": qta.round(3)})
+        rank = lines.groupby(["n", "p", "q"], sort=False).cumcount()
+        seen = pd.Series([already.get(t, 0) for t in zip(lines["n"], lines["p"], lines["q"])], index=df.index)
+        keep = rank >= seen
+        res.skipped = int((~keep).sum())
+
+    names = upper(df["nome_normalizzato"])
+    # 0. Riga risolta da alias e nome non modificato, A. nome nel catalogo
+    alias_id = df["ID"].where(df["ID"].notna(), "").astype(str).str.strip()
+    cat_name = alias_id.map(lambda i: str((cat_by_id or {}).get(i, {}).get("NOME_NORMALIZZATO", "")) if i else None)
+    ids = alias_id.where((alias_id != "") & (cat_name == names), None)
+    ids = ids.fillna(names.map(id_by_name))
+
+    # B./C. Nomi sconosciuti: un ID nuovo per nome, dati dalla prima riga che lo usa
+    brand, cat, unit = upper(df["brand"]), upper(df["categoria"]), upper(df["unita"])
+    missing = ids.isna() & keep
+    new_ids = {}
+    for i in np.flatnonzero(missing.to_numpy()):
+        n = names.iat[i]
+        if n in new_ids: continue
+        new_ids[n] = str(new_id())
+        f = float(fmt.iat[i])
+        res.rows_catalogo.append([new_ids[n], n, brand.iat[i], cat.iat[i], "" if np.isnan(f) else f, unit.iat[i]])
+    ids = ids.fillna(names.map(new_ids)).astype(str)
+
+    t = {k: str(testata.get(k, "")) for k in ("data", "insegna", "indirizzo", "num")}
+    offerta = text(df["is_offerta"]).str.upper()
+    k = keep.to_numpy()
+    res.rows_scontrini = [
+        [t["data"], t["insegna"], t["indirizzo"], r, float(tt), 0, float(p), o, float(q), "SI", pid, t["num"]]
+        for r, tt, p, o, q, pid in zip(raw[k], tot[k], p_unit[k], offerta[k], qta[k], ids[k])
+    ]
+    res.aliases = {alias_key(r, t["insegna"]): pid for r, pid in zip(raw[k], ids[k])}
+    return res
+
+
+def catalog_maps(df_cat):
+    """({ID_PRODOTTO: riga catalogo}, {NOME_NORMALIZZATO: ID_PRODOTTO}) per le ricerche per chiave"""
+    if df_cat.empty or 'ID_PRODOTTO' not in df_cat.columns: return {}, {}
+    df = df_cat.assign(ID_PRODOTTO=df_cat['ID_PRODOTTO'].astype(str).str.strip())
+    by_id = {r['ID_PRODOTTO']: r for r in df.drop_duplicates('ID_PRODOTTO').to_dict('records') if r['ID_PRODOTTO']}
+    # Come prima (primo match nel foglio) per nome normalizzato
+    by_name = dict(zip(df['NOME_NORMALIZZATO'].astype(str)[::-1], df['ID_PRODOTTO'][::-1]))
+    return by_id, by_name
+
+
+def header_fields(testata, registry):
+    """Valori proposti per la testata: negozio e indirizzo dall'anagrafe (per P.IVA) se noto.
+    Una data mancante o illeggibile resta vuota (mai inventata): va completata in revisione."""
+    piva = clean_piva(testata.get('p_iva', ''))
+    data = norm_date(testata.get('data_iso', ''))
+    match = registry.find_by_piva(piva) if registry else None
+    return {
+        "insegna": (match['Insegna_Standard'] if match else f"NUOVO ({piva})").upper(),
+        "data": data if is_iso_date(data) else "",
+        "num": str(testata.get('num_scontrino', '')).upper(),
+        "indirizzo": str(match[ADDR_COL] if match else testata.get('indirizzo', '')).upper(),
+        "match": match,
+    }
+
+
+def apply_aliases(df, insegna, alias_store, cat_by_id):
+    """Righe già viste in questo negozio: colonna ID e dati di catalogo dal prodotto dell'alias.
+    Modifica df (colonne dell'estrazione) e restituisce il numero di righe riconosciute."""
+    df['ID'] = ""
+    if df.empty or 'nome_grezzo' not in df.columns: return 0
+    keys = [alias_key(r, insegna) for r in df['nome_grezzo']]
+    noti = alias_store.get_many(keys)
+    n = 0
+    for i, k in zip(df.index, keys):
+        rec = cat_by_id.get(noti.get(k))
+        if not rec: continue
+        df.at[i, 'ID'] = noti[k]
+        for col, c in ALIAS_FIELDS:
+            if col in df.columns: df.at[i, col] = rec.get(c, "")
+        n += 1
+    return n
+
+
+def use_suggestions(df):
+    """Righe con "usa_suggerito" spuntato: il nome suggerito dal catalogo sostituisce quello del modello"""
+    if "usa_suggerito" not in df.columns or "nome_suggerito" not in df.columns: return df
+    usa = df["usa_suggerito"].fillna(False).astype(bool) & (df["nome_suggerito"].fillna("").astype(str).str.strip() != "")
+    return df.assign(nome_normalizzato=df["nome_normalizzato"].where(~usa, df["nome_suggerito"]))
+
+
+def saved_lines(snapshot, pending_rows, data, insegna, indirizzo, num):
+    """Counter delle righe già salvate dello scontrino: indice dello snapshot + righe ancora in coda"""
+    out = Counter(snapshot.receipt_lines(data, insegna, indirizzo, num))
+    key = receipt_key(data, insegna, indirizzo, num)
+    if key[3]:
+        out.update(line for k, line in map(receipt_fields, pending_rows) if k == key)
+    return out
@@ -0,0 +1,213 @@
+from itertools import permutations
+import numpy as np
+
+# --- MOTORE MULTI-TAPPA ---
+# Lavora su una matrice densa prezzi (articoli x negozi, inf = non disponibile).
+# Punteggio di un piano = mancanti * MISSING_PENALTY + somma dei minimi per articolo,
+# lo stesso usato finora nel loop su itertools.combinations.
+# Esplora le combinazioni in profondità con branch-and-bound: il limite inferiore di un
+# prefisso assume di poter prendere, per ogni articolo, il minimo fra tutti i negozi
+# ancora disponibili. Limiti e ultimi due livelli sono calcolati in blocco con NumPy.
+# A parità di punteggio vince la prima combinazione in ordine itertools, come prima.
+# Con travel=(D, €/km) al punteggio si somma il costo del giro casa -> negozi -> casa
+# (D = matrice km con casa in posizione 0 e la colonna j dei prezzi in posizione j+1);
+# il giro di un prefisso è un limite inferiore finché le distanze rispettano la
+# disuguaglianza triangolare, come accade (quasi sempre) per quelle stradali.
+# Il giro rende il limite molto più debole (k! permutazioni per nodo): in modalità viaggio
+# la ricerca gira su al massimo TRAVEL_MAX_SHOPS negozi scelti da travel_candidates.
+# Anche senza giro, da POOL_FROM_STOPS tappe in su i nodi crescono come C(n, k-2) e con
+# molti negozi nel raggio la ricerca può durare minuti: il chiamante la restringe a
+# EXACT_MAX_SHOPS negozi con pool_candidates (esatta su quel pool).
+
+MISSING_PENALTY = 10000
+MAX_STOPS = 5
+TRAVEL_MAX_SHOPS = 30
+TRAVEL_PER_ITEM = 2     # per ogni articolo restano comunque i suoi 2 negozi più convenienti
+EXACT_MAX_SHOPS = 40
+POOL_FROM_STOPS = 4
+
+
+def plan_scores(mins):
+    """Punteggi per righe di minimi per articolo (shape (..., articoli))"""
+    finite = np.isfinite(mins)
+    missing = (~finite).sum(axis=-1)
+    tot = np.where(finite, mins, 0.0).sum(axis=-1)
+    return missing * MISSING_PENALTY + tot
+
+
+def best_combo(prices, k, candidates=None, travel=None):
+    """Miglior combinazione di k colonne fra candidates (indici di colonna, in ordine).
+    Restituisce (tupla di colonne, punteggio) oppure (None, inf) se i candidati sono meno di k."""
+    prices = np.asarray(prices, dtype=float)
+    cand = list(range(prices.shape[1])) if candidates is None else list(candidates)
+    n = len(cand)
+    if k < 1 or n < k: return None, float('inf')
+
+    # Si esplorano prima i negozi più convenienti da soli: buone soluzioni subito e potature
+    # più efficaci. L'ordine originale serve solo per gli spareggi.
+    order = np.argsort(plan_scores(prices[:, cand].T), kind='stable')
+    sub = prices[:, cand][:, order]
+    # suffix[i] = minimo per articolo fra i negozi i..n-1 (suffix[n] = tutto inf)
+    suffix = np.full((n + 1, prices.shape[0]), np.inf)
+    for i in range(n - 1, -1, -1):
+        suffix[i] = np.minimum(suffix[i + 1], sub[:, i])
+
+    D, cost_km = (np.asarray(travel[0], dtype=float), float(travel[1])) if travel else (None, 0.0)
+    node = np.array([cand[o] + 1 for o in order])  # posizione nell'ordine di visita -> indice in D
+
+    def travel_cost(chosen, pool):
+        """Costo del giro migliore su chosen + ciascun negozio di pool (vettore)"""
+        if D is None: return 0.0
+        return cost_km * insertion_tours(D, [int(node[i]) for i in chosen], node[pool])
+
+    # Soglia iniziale da una soluzione greedy (raggiungibile, quindi la ricerca resta esatta;
+    # il margine assorbe gli arrotondamenti fra formule diverse del giro)
+    g_score, g_cols = greedy(sub, k)
+    if D is not None: g_score += cost_km * tour_length(D, [int(node[i]) for i in g_cols])
+    best = {"score": g_score + 1e-6, "combo": None}
+
+    def lex(chosen):
+        return tuple(sorted(int(order[i]) for i in chosen))
+
+    def lex_floor(chosen, start, r):
+        """Combinazione più piccola (in ordine originale) che completa chosen da start in poi"""
+        return tuple(sorted([int(order[i]) for i in chosen] + sorted(int(o) for o in order[start:])[:r]))
+
+    def pruned(lb, chosen, start, r):
+        if lb != best["score"]: return lb > best["score"]
+        return best["combo"] is not None and lex_floor(chosen, start, r) >= best["combo"]
+
+    def offer(sc, combo_at):
+        """Aggiorna il migliore con i punteggi sc; combo_at(indice di sc) -> combinazione"""
+        m = sc.min()
+        if m > best["score"]: return
+        c = min(lex(combo_at(*idx)) for idx in zip(*np.nonzero(sc == m)))
+        if m < best["score"] or best["combo"] is None or c < best["combo"]:
+            best["score"], best["combo"] = float(m), c
+
+    def visit(start, cur, chosen):
+        remaining = k - len(chosen)
+        if remaining == 1:
+            sc = plan_scores(np.minimum(cur[:, None], sub[:, start:]).T) + travel_cost(chosen, np.arange(start, n))
+            offer(sc, lambda j: chosen + [start + j])
+            return
+        stop = n - remaining + 1
+        nxt_all = np.minimum(cur[:, None], sub[:, start:stop])
+        lbs = plan_scores(np.minimum(nxt_all, suffix[start + 1:stop + 1].T).T)
+        if remaining > 2:
+            # Secondo limite (sottomodularità): con r tappe ancora da scegliere il risparmio
+            # non supera la somma dei r migliori risparmi dei singoli negozi rimasti
+            gains = plan_scores(cur) - plan_scores(np.minimum(cur[:, None], sub[:, start:]).T)
+            lbs = np.maximum(lbs, plan_scores(nxt_all.T) - top_suffix_sums(gains, remaining - 1)[1:stop - start + 1] - 1e-6)
+        lbs = lbs + travel_cost(chosen, np.arange(start, stop))
+        keep = [off for off in range(stop - start) if not pruned(lbs[off], chosen + [start + off], start + off + 1, remaining - 1)]
+        if remaining == 2 and keep and D is None:
+            # Ultimi due livelli in un colpo: (figli rimasti) x (ultimo negozio)
+            sc = plan_scores(np.minimum(nxt_all[:, keep][:, :, None], sub[:, None, start + 1:]).transpose(1, 2, 0))
+            sc[np.arange(sub.shape[1] - start - 1)[None, :] < np.array(keep)[:, None]] = np.inf
+            offer(sc, lambda r, b: chosen + [start + keep[r], start + 1 + b])
+            return
+        for off in keep:
+            visit(start + off + 1, nxt_all[:, off], chosen + [start + off])
+
+    visit(0, np.full(prices.shape[0], np.inf), [])
+    if best["combo"] is None:  # distanze non metriche: resta il piano greedy
+        return tuple(cand[i] for i in sorted(int(order[c]) for c in g_cols)), g_score
+    return tuple(cand[i] for i in best["combo"]), best["score"]
+
+
+def pool_candidates(prices, candidates, n=EXACT_MAX_SHOPS, trip=None):
+    """Al massimo n colonne fra candidates: per ogni articolo le TRAVEL_PER_ITEM più convenienti
+    (prezzo + metà di trip, il costo di andata e ritorno per colonna se dato), poi le migliori da sole
+    (punteggio + trip). Restituisce gli indici in ordine crescente."""
+    prices = np.asarray(prices, dtype=float)
+    cand = np.array(list(candidates), dtype=int)
+    if len(cand) <= n: return sorted(int(j) for j in cand)
+    trip = np.zeros(len(cand)) if trip is None else np.asarray(trip, dtype=float)
+    sub = prices[:, cand]
+    per_item = np.argsort(sub + trip[None, :] / 2, axis=1, kind='stable')[:, :TRAVEL_PER_ITEM]
+    keep = []
+    for c in per_item.T.ravel():
+        if np.isfinite(sub[:, c]).any() and c not in keep: keep.append(int(c))
+    for c in np.argsort(plan_scores(sub.T) + trip, kind='stable'):
+        if c not in keep: keep.append(int(c))
+    return sorted(int(cand[c]) for c in keep[:n])
+
+
+def travel_candidates(prices, candidates, D, cost_km, n=TRAVEL_MAX_SHOPS):
+    """pool_candidates per la modalità viaggio (trip = andata e ritorno da casa, D con casa in 0)"""
+    cand = np.array(list(candidates), dtype=int)
+    D = np.asarray(D, dtype=float)
+    return pool_candidates(prices, cand, n, trip=cost_km * (D[0, cand + 1] + D[cand + 1, 0]))
+
+
+def top_suffix_sums(values, r):
+    """out[i] = somma dei r valori più grandi in values[i:] (out[len] = 0)"""
+    m = len(values)
+    g = np.where(np.triu(np.ones((m, m), dtype=bool)), values[None, :], 0.0)
+    if r < m: g = -np.partition(-g, r - 1, axis=1)[:, :r]
+    return np.append(g.sum(axis=1), 0.0)
+
+
+def greedy(sub, k):
+    """Piano costruito aggiungendo ogni volta il negozio più utile: (punteggio, colonne)"""
+    cur = np.full(sub.shape[0], np.inf)
+    free = np.ones(sub.shape[1], dtype=bool)
+    cols = []
+    for _ in range(k):
+        sc = plan_scores(np.minimum(cur[:, None], sub).T)
+        sc[~free] = np.inf
+        j = int(np.argmin(sc))
+        free[j] = False
+        cols.append(j)
+        cur = np.minimum(cur, sub[:, j])
+    return float(plan_scores(cur)), cols
+
+
+def tour_length(D, nodes):
+    """Giro più corto casa -> nodes -> casa (nodes sono indici di D, al massimo MAX_STOPS)"""
+    if not nodes: return 0.0
+    return min(D[0, p[0]] + sum(D[p[i], p[i + 1]] for i in range(len(p) - 1)) + D[p[-1], 0]
+               for p in permutations(nodes))
+
+
+def insertion_tours(D, nodes, cands):
+    """Per ogni c in cands il giro più corto su nodes + [c]: ogni giro si ottiene inserendo c
+    in un lato di qualche permutazione di nodes, quindi basta il minimo su tutte."""
+    cands = np.asarray(cands)
+    if not nodes: return D[0, cands] + D[cands, 0]
+    A, B, C = [], [], []
+    for p in permutations(nodes):
+        path = [0, *p, 0]
+        L = sum(D[path[i], path[i + 1]] for i in range(len(path) - 1))
+        for i in range(len(path) - 1):
+            A.append(path[i]); B.append(path[i + 1]); C.append(L - D[path[i], path[i + 1]])
+    A, B, C = np.array(A), np.array(B), np.array(C)
+    return (C[:, None] + D[A][:, cands] + D[cands][:, B].T).min(axis=0)
+
+
+def best_mix(prices, candidates=None):
+    """Modalità illimitata: per ogni articolo il negozio più economico fra i candidati"""
+    prices = np.asarray(prices, dtype=float)
+    cand = list(range(prices.shape[1])) if candidates is None else list(candidates)
+    return tuple(cand), float(plan_scores(prices[:, cand].min(axis=1))) if cand else float('inf')
+
+
+def best_any(prices, candidates=None, travel=None, max_stops=MAX_STOPS):
+    """Modalità illimitata col costo del viaggio: miglior piano con 1..max_stops tappe (oltre MAX_STOPS
+    il giro esatto non si calcola). (tupla di colonne, punteggio); a parità vince quello con meno tappe."""
+    best = (None, float('inf'))
+    for k in range(1, max_stops + 1):
+        combo, score = best_combo(prices, k, candidates, travel=travel)
+        if score < best[1] - 1e-9: best = (combo, score)
+    return best
+
+
+def assign(prices, combo):
+    """Per ogni articolo la colonna scelta dentro combo (None se non disponibile)"""
+    if not combo: return [None] * len(prices)
+    prices = np.asarray(prices, dtype=float)
+    cols = list(combo)
+    sub = prices[:, cols]
+    pick = np.argmin(sub, axis=1)
+    return [cols[j] if np.isfinite(sub[r, j]) else None for r, j in enumerate(pick)]
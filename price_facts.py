@@ -0,0 +1,146 @@
+import json
+import pandas as pd
+from units import normalize
+from price_history import day_numbers
+
+# --- TABELLA "PRICE FACTS" MATERIALIZZATA ---
+# Join Scontrini x Catalogo già pulito e tipizzato, salvato nello snapshot SQLite.
+# Viene ricostruita solo quando uno dei due fogli viene riscaricato da zero;
+# altrimenti si aggiungono le sole righe nuove di Scontrini (più quelle rimaste
+# orfane perché il loro prodotto non era ancora nel Catalogo).
+# PREZZO_STD è il prezzo in €/UNITA_STD (KG, L, PZ) secondo units.normalize; STD_OK dice
+# se la conversione è affidabile. FACTS_SCHEMA cambia quando cambiano le colonne calcolate:
+# le tabelle create con uno schema diverso vengono ricostruite.
+# Ricerca e carrello leggono con latest() solo i prodotti che servono: query SQL sull'indice
+# (ID_PRODOTTO, SHOP_ID), ultima osservazione per coppia scelta per DAY (giorno numerico).
+
+FACTS_TABLE = "price_facts"
+FACTS_SCHEMA = 4
+S_COLS = ["Data", "Negozio", "Indirizzo", "In_Offerta", "Prezzo_Unitario", "ID_PRODOTTO"]
+C_COLS = ["ID_PRODOTTO", "NOME_NORMALIZZATO", "BRAND", "CATEGORIA", "FORMATO", "UNITA"]
+TEXT_COLS = ["Data", "Negozio", "Indirizzo", "In_Offerta", "NOME_NORMALIZZATO", "BRAND", "CATEGORIA", "UNITA"]
+CATEGORY_COLS = ["ID_PRODOTTO", "SHOP_ID", "Negozio", "Indirizzo", "UNITA_STD"]
+
+
+def shop_key(negozio, indirizzo):
+    """Chiave negozio usata in tutta l'app ("Negozio - Indirizzo")"""
+    return f"{negozio} - {indirizzo}"
+
+
+def compute_facts(df_s, df_c):
+    """Join vettoriale + colonne derivate. df_s deve avere la colonna _src (rowid Scontrini)."""
+    s = df_s.reindex(columns=["_src"] + S_COLS)
+    c = df_c.reindex(columns=C_COLS)
+    s["ID_PRODOTTO"] = s["ID_PRODOTTO"].fillna("").astype(str).str.strip()
+    c["ID_PRODOTTO"] = c["ID_PRODOTTO"].fillna("").astype(str).str.strip()
+    c = c.drop_duplicates("ID_PRODOTTO")
+    norm = [normalize(*r) for r in zip(c["FORMATO"], c["UNITA"], c["NOME_NORMALIZZATO"])]
+    c["QTA_STD"] = [round(q, 6) for q, _, _ in norm]
+    c["UNITA_STD"] = [u for _, u, _ in norm]
+    c["STD_OK"] = [ok for _, _, ok in norm]
+
+    f = s.merge(c, on="ID_PRODOTTO", how="inner")
+    for col in TEXT_COLS:
+        f[col] = f[col].fillna("").astype(str)
+    f["Prezzo_Unitario"] = pd.to_numeric(f["Prezzo_Unitario"], errors="coerce").fillna(0.0)
+    f["FORMATO"] = pd.to_numeric(f["FORMATO"], errors="coerce").fillna(1)
+    f["PREZZO_AL_L_KG"] = f["Prezzo_Unitario"] / f["FORMATO"]
+    f["STD_OK"] = f["STD_OK"].astype(bool) & (f["Prezzo_Unitario"] > 0)
+    f["PREZZO_STD"] = (f["Prezzo_Unitario"] / f["QTA_STD"]).where(f["STD_OK"])
+    f["SHOP_ID"] = f["Negozio"] + " - " + f["Indirizzo"]
+    f["DAY"] = day_numbers(f["Data"])
+    return f
+
+
+def _read_meta(conn):
+    conn.execute("CREATE TABLE IF NOT EXISTS facts_meta (k TEXT PRIMARY KEY, v TEXT)")
+    r = conn.execute("SELECT v FROM facts_meta WHERE k = 'state'").fetchone()
+    return json.loads(r[0]) if r else None
+
+
+def _write_meta(conn, state):
+    conn.execute("INSERT OR REPLACE INTO facts_meta VALUES ('state', ?)", (json.dumps(state),))
+
+
+def _sql_type(dtype):
+    if pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_integer_dtype(dtype): return "INTEGER"
+    return "REAL" if pd.api.types.is_float_dtype(dtype) else "TEXT"
+
+
+def _append_facts(conn, facts):
+    """INSERT nella transazione aperta (to_sql farebbe commit a metà e lascerebbe il lock).
+    _src è unico: una riga di Scontrini già materializzata non entra una seconda volta."""
+    cols = ["_src"] + [c for c in facts.columns if c != "_src"]
+    defs = ", ".join(f'"{c}" {_sql_type(facts[c].dtype)}' for c in cols)
+    conn.execute(f'CREATE TABLE IF NOT EXISTS "{FACTS_TABLE}" ({defs})')
+    conn.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS "{FACTS_TABLE}_src" ON "{FACTS_TABLE}" (_src)')
+    conn.execute(f'CREATE INDEX IF NOT EXISTS "{FACTS_TABLE}_key" ON "{FACTS_TABLE}" (ID_PRODOTTO, SHOP_ID)')
+    names, ph = ", ".join(f'"{c}"' for c in cols), ", ".join("?" for _ in cols)
+    conn.executemany(f'INSERT OR IGNORE INTO "{FACTS_TABLE}" ({names}) VALUES ({ph})',
+                     zip(*(facts[c].tolist() for c in cols)))
+
+
+def materialize(snapshot):
+    """Aggiorna (se serve) la tabella price_facts nello snapshot e la restituisce come DataFrame.
+    Lettura dello stato, aggiunta delle righe e nuovo stato stanno in una transazione BEGIN IMMEDIATE
+    (come il sync dello snapshot): chiamate concorrenti, anche da processi diversi, si mettono in fila
+    e la seconda rilegge lo stato già aggiornato dalla prima."""
+    with snapshot.connect() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        m_s, m_c = snapshot._meta(conn, "Scontrini"), snapshot._meta(conn, "Catalogo")
+        if not m_s or not m_c or not m_s["header"] or not m_c["header"]:
+            return pd.DataFrame()
+        state = _read_meta(conn)
+        gens = [m_s["generation"], m_c["generation"]]
+        full = state is None or state["gens"] != gens or state.get("schema") != FACTS_SCHEMA
+        if full:
+            state = {"gens": gens, "schema": FACTS_SCHEMA, "src": 0, "cat_rows": 0, "orphans": []}
+            conn.execute(f'DROP TABLE IF EXISTS "{FACTS_TABLE}"')
+
+        # Righe candidate: nuove in Scontrini + orfane se il Catalogo è cresciuto
+        df_new = pd.read_sql_query('SELECT rowid AS _src, * FROM "Scontrini" WHERE rowid > ?', conn, params=(state["src"],))
+        if state["orphans"] and m_c["n_rows"] > state["cat_rows"]:
+            ph = ",".join("?" for _ in state["orphans"])
+            df_orf = pd.read_sql_query(f'SELECT rowid AS _src, * FROM "Scontrini" WHERE rowid IN ({ph})', conn, params=state["orphans"])
+            df_new = pd.concat([df_orf, df_new], ignore_index=True)
+            state["orphans"] = []
+
+        if not df_new.empty or full:
+            df_c = pd.read_sql_query('SELECT * FROM "Catalogo"', conn)
+            facts = compute_facts(df_new, df_c)
+            _append_facts(conn, facts)
+            matched = set(facts["_src"].tolist())
+            state["orphans"] += [int(x) for x in df_new["_src"] if x not in matched]
+            if not df_new.empty: state["src"] = max(state["src"], int(df_new["_src"].max()))
+        state["cat_rows"] = m_c["n_rows"]
+        _write_meta(conn, state)
+
+    with snapshot.connect() as conn:
+        if not conn.execute("SELECT name FROM sqlite_master WHERE name = ?", (FACTS_TABLE,)).fetchone():
+            return pd.DataFrame()
+        df = pd.read_sql_query(f'SELECT * FROM "{FACTS_TABLE}" ORDER BY _src', conn)
+
+    return typed_facts(df)
+
+
+def latest(snapshot, ids):
+    """Ultima osservazione per prodotto/negozio dei soli ID dati (come PriceHistory.current() filtrato
+    su ids: a parità di giorno vince l'ultima caricata), in ordine di caricamento"""
+    with snapshot.connect() as conn:
+        if not conn.execute("SELECT name FROM sqlite_master WHERE name = ?", (FACTS_TABLE,)).fetchone():
+            return pd.DataFrame()
+        df = pd.read_sql_query(f"""SELECT * FROM (
+                SELECT *, ROW_NUMBER() OVER (PARTITION BY ID_PRODOTTO, SHOP_ID ORDER BY DAY DESC, _src DESC) AS _rn
+                FROM "{FACTS_TABLE}" WHERE ID_PRODOTTO IN (SELECT value FROM json_each(?)))
+            WHERE _rn = 1 ORDER BY _src""", conn, params=(json.dumps(sorted(map(str, ids))),))
+    return typed_facts(df.drop(columns="_rn"))
+
+
+def typed_facts(df):
+    """Tipi compatti per il frame in memoria (categorie + float32)"""
+    for col in CATEGORY_COLS:
+        df[col] = df[col].astype("category")
+    for col in ["Prezzo_Unitario", "PREZZO_AL_L_KG", "FORMATO", "QTA_STD", "PREZZO_STD"]:
+        df[col] = df[col].astype("float32")
+    df["STD_OK"] = df["STD_OK"].astype(bool)
+    return df.reset_index(drop=True)
@@ -0,0 +1,100 @@
+import os
+import numpy as np
+import pandas as pd
+from datetime import date
+from utils import norm_date
+
+# --- STORICO PREZZI PER (PRODOTTO, NEGOZIO) ---
+# Dai price facts una serie ordinata per data di (giorno, prezzo, offerta) per ogni coppia
+# prodotto/negozio, tenuta in array contigui (una fetta per serie). Ultimo prezzo in O(1),
+# finestre "ultimi N giorni" con ricerca binaria sulla fetta: mediana e trend toccano solo
+# le osservazioni della finestra. A parità di data vale l'ordine di caricamento, come prima.
+# Ricerca e carrello confrontano i prezzi attuali (ultima osservazione) invece dello storico.
+
+HISTORY_DAYS = int(os.environ.get("PRICE_HISTORY_DAYS", "90"))
+NO_DATE = -10 ** 6      # giorno assegnato alle date illeggibili: contano come le più vecchie
+EPOCH = pd.Timestamp("1970-01-01")
+
+
+def day_numbers(values):
+    """Giorni dal 1970-01-01 per ogni valore di Data (formati del foglio), NO_DATE se illeggibile"""
+    s = pd.Series(values).astype(str)
+    uniq = s.unique()
+    iso = pd.to_datetime(pd.Series([norm_date(u) for u in uniq]), format="%Y-%m-%d", errors="coerce")
+    days = (iso - EPOCH).dt.days.fillna(NO_DATE).astype(np.int64)
+    return s.map(dict(zip(uniq, days))).to_numpy(np.int64)
+
+
+def day_to_iso(d):
+    return "" if d == NO_DATE else (EPOCH + pd.Timedelta(days=int(d))).strftime("%Y-%m-%d")
+
+
+class PriceHistory:
+    def __init__(self, facts, price_col="Prezzo_Unitario"):
+        self.facts = facts
+        self.span, self._current = {}, None
+        if facts.empty:
+            self.days, self.prices, self.offerta = np.zeros(0, np.int64), np.zeros(0), np.zeros(0, bool)
+            self.latest_rows = np.zeros(0, np.int64)
+            return
+        pid = facts["ID_PRODOTTO"].astype(str).to_numpy()
+        shop = facts["SHOP_ID"].astype(str).to_numpy()
+        codes = pd.MultiIndex.from_arrays([pid, shop]).factorize()[0]
+        days = day_numbers(facts["Data"])
+        order = np.lexsort((days, codes))      # per serie, poi per data (stabile)
+
+        self.days = days[order]
+        self.prices = facts[price_col].to_numpy(float).round(4)[order]
+        self.offerta = (facts["In_Offerta"].astype(str).str.upper().str.strip() == "SI").to_numpy()[order]
+        starts = np.flatnonzero(np.r_[True, np.diff(codes[order]) != 0])
+        ends = np.r_[starts[1:], len(order)]
+        first = order[starts]
+        self.span = {(p, s): (a, b) for p, s, a, b in zip(pid[first], shop[first], starts.tolist(), ends.tolist())}
+        # Posizioni (in facts) dell'ultima osservazione di ogni serie, in ordine di caricamento
+        self.latest_rows = np.sort(order[ends - 1])
+
+    def __len__(self):
+        return len(self.span)
+
+    def series(self, pid, shop):
+        """(giorni, prezzi, offerta) della serie, ordinati per data"""
+        a, b = self.span.get((pid, shop), (0, 0))
+        return self.days[a:b], self.prices[a:b], self.offerta[a:b]
+
+    def latest(self, pid, shop):
+        """(data ISO, prezzo, in offerta) dell'ultima osservazione, None se la coppia non esiste"""
+        if (pid, shop) not in self.span: return None
+        i = self.span[(pid, shop)][1] - 1
+        return day_to_iso(self.days[i]), float(self.prices[i]), bool(self.offerta[i])
+
+    def _window(self, pid, shop, days, today):
+        """Indici [a, b) delle osservazioni negli ultimi `days` giorni fino a today (incluso)"""
+        a, b = self.span.get((pid, shop), (0, 0))
+        t = (pd.Timestamp(today or date.today()) - EPOCH).days
+        d = self.days[a:b]
+        return a + int(np.searchsorted(d, t - days + 1, "left")), a + int(np.searchsorted(d, t, "right"))
+
+    def median(self, pid, shop, days=HISTORY_DAYS, today=None):
+        """Prezzo mediano negli ultimi `days` giorni, None senza osservazioni"""
+        a, b = self._window(pid, shop, days, today)
+        return float(np.median(self.prices[a:b])) if b > a else None
+
+    def trend(self, pid, shop, days=HISTORY_DAYS, today=None):
+        """Pendenza dei prezzi nella finestra in €/30 giorni (minimi quadrati), None con meno di 2 giorni distinti"""
+        a, b = self._window(pid, shop, days, today)
+        x, y = self.days[a:b].astype(float), self.prices[a:b]
+        if b - a < 2 or x[0] == x[-1]: return None
+        x = x - x.mean()
+        return float((x * (y - y.mean())).sum() / (x * x).sum() * 30)
+
+    def stats(self, pids, shops, days=HISTORY_DAYS, today=None):
+        """Mediana, trend e numero di osservazioni per le coppie date (righe allineate all'input)"""
+        out = [(self.median(p, s, days, today), self.trend(p, s, days, today), len(self.series(p, s)[0]))
+               for p, s in zip(pids, shops)]
+        return pd.DataFrame(out, columns=["MEDIANA", "TREND", "N_OSS"])
+
+    def current(self):
+        """Righe dei price facts con solo l'ultima osservazione per prodotto/negozio"""
+        if self._current is None:
+            self._current = self.facts.iloc[self.latest_rows].reset_index(drop=True)
+        return self._current
@@ -0,0 +1,72 @@
+from dataclasses import dataclass
+import numpy as np
+import pandas as pd
+
+# --- MATRICE PREZZI ARTICOLI x NEGOZI ---
+# Costruita in un solo passaggio: articoli -> ID prodotto (indice invertito),
+# join con i price facts dei negozi validi e un unico groupby(articolo, negozio).idxmin().
+# Con rank_col (es. PREZZO_STD) il prodotto scelto per cella è quello col miglior prezzo per
+# unità, fra i prodotti nell'unità più comune per quell'articolo; in matrice resta il prezzo
+# della confezione (price_col), così i totali sono spesa vera.
+
+
+@dataclass
+class PriceMatrix:
+    items: list          # articoli della lista (righe, anche ripetuti)
+    shops: list          # chiavi negozio "Negozio - Indirizzo" (colonne)
+    prices: np.ndarray   # float, inf = non disponibile
+    names: np.ndarray    # NOME_NORMALIZZATO del prodotto scelto ("" se assente)
+
+    def __post_init__(self):
+        self.col = {s: j for j, s in enumerate(self.shops)}
+
+    def entry(self, i, shop):
+        """(prezzo, nome) dell'articolo i nel negozio, None se non disponibile"""
+        j = self.col[shop]
+        return (float(self.prices[i, j]), self.names[i, j]) if np.isfinite(self.prices[i, j]) else None
+
+    def take(self, items):
+        """Copia con le righe nell'ordine di items (articoli già presenti, anche ripetuti)"""
+        row = {it: i for i, it in enumerate(self.items)}
+        idx = [row[it] for it in items]
+        return PriceMatrix(list(items), self.shops, self.prices[idx], self.names[idx])
+
+    def shop_totals(self):
+        """(totale, trovati) per negozio, nell'ordine di shops"""
+        finite = np.isfinite(self.prices)
+        return np.where(finite, self.prices, 0.0).sum(axis=0), finite.sum(axis=0)
+
+
+def build_price_matrix(facts, items, shops, index, price_col='Prezzo_Unitario', rank_col=None):
+    prices = np.full((len(items), len(shops)), np.inf)
+    names = np.full((len(items), len(shops)), "", dtype=object)
+    pm = PriceMatrix(items, shops, prices, names)
+
+    links = [(item, pid) for item in dict.fromkeys(items) for pid in index.search(item)]
+    if not links or facts.empty: return pm
+    links = pd.DataFrame(links, columns=['ITEM', 'ID_PRODOTTO'])
+
+    f = facts[facts['SHOP_ID'].isin(shops) & facts['ID_PRODOTTO'].isin(links['ID_PRODOTTO'])]
+    f = pd.DataFrame({
+        'ID_PRODOTTO': f['ID_PRODOTTO'].astype(str), 'SHOP_ID': f['SHOP_ID'].astype(str),
+        'PREZZO': f[price_col].astype(float).round(4), 'NOME': f['NOME_NORMALIZZATO'],
+        'RANK': f[rank_col or price_col].astype(float).round(4),
+        'UNITA': f['UNITA_STD'].astype(str) if rank_col else '',
+    })
+    m = f.merge(links, on='ID_PRODOTTO', how='inner')
+    m = m[m['PREZZO'].notna() & m['RANK'].notna()]
+    if rank_col and not m.empty:
+        main_unit = m.groupby('ITEM')['UNITA'].agg(lambda u: u.mode().iat[0])
+        m = m[m['UNITA'] == m['ITEM'].map(main_unit)]
+    if m.empty: return pm
+
+    # A parità di prezzo vince la prima osservazione in ordine di caricamento
+    best = m.loc[m.groupby(['ITEM', 'SHOP_ID'], sort=False)['RANK'].idxmin()]
+    rows = {}
+    for i, item in enumerate(items): rows.setdefault(item, []).append(i)
+    for item, shop, p, n in zip(best['ITEM'], best['SHOP_ID'], best['PREZZO'], best['NOME']):
+        j = pm.col[shop]
+        for i in rows[item]:
+            prices[i, j] = p
+            names[i, j] = n
+    return pm
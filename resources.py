@@ -0,0 +1,70 @@
+import os
+import time
+import threading
+import streamlit as st
+from storage import open_backend, STORAGE_BACKEND
+from shop_registry import ShopRegistry, SHOP_REGISTRY_TTL_S
+
+# --- RISORSE CONDIVISE DAL PROCESSO ---
+# Credenziali, client Sheets, worksheet e modello Gemini nascono una volta sola (alla
+# prima richiesta) e sono condivisi da tutte le sessioni: un rerun di Streamlit non fa
+# più chiamate di rete per "riconnettersi". Ogni RESOURCE_HEALTH_S si verifica che il
+# backend risponda; se no (o se chi lo usa segnala un errore con reconnect) le risorse
+# vengono ricreate alla richiesta successiva.
+
+GEMINI_MODEL = os.environ.get("GEMINI_MODEL", "models/gemini-2.5-flash")
+RESOURCE_HEALTH_S = int(os.environ.get("RESOURCE_HEALTH_S", "300"))
+TABLE_NAMES = {"scontrini": "Scontrini", "catalogo": "Catalogo", "negozi": "Anagrafe_Negozi"}
+
+_health = {"checked_at": 0.0, "lock": threading.Lock()}
+
+
+@st.cache_resource(show_spinner=False)
+def _backend(kind):
+    return open_backend(kind, google_info=dict(st.secrets))
+
+
+@st.cache_resource(show_spinner=False)
+def _tables(kind):
+    b = _backend(kind)
+    return {k: b.table(name) for k, name in TABLE_NAMES.items()}
+
+
+@st.cache_resource(show_spinner=False)
+def get_model():
+    import google.generativeai as genai
+    genai.configure(api_key=st.secrets["GEMINI_API_KEY"])
+    return genai.GenerativeModel(GEMINI_MODEL)
+
+
+def healthy(tables):
+    """Controllo leggero: l'intestazione di Catalogo si legge senza errori"""
+    try:
+        tables["catalogo"].row_values(1)
+        return True
+    except: return False
+
+
+def get_tables():
+    """{'scontrini', 'catalogo', 'negozi'} -> worksheet (o tabella locale), con controllo periodico"""
+    tables = _tables(STORAGE_BACKEND)
+    with _health["lock"]:
+        if time.time() - _health["checked_at"] < RESOURCE_HEALTH_S: return tables
+        _health["checked_at"] = time.time()
+    if healthy(tables): return tables
+    reconnect()
+    return _tables(STORAGE_BACKEND)
+
+
+def reconnect():
+    """Dimentica client e worksheet: verranno ricreati alla prossima get_tables"""
+    _backend.clear()
+    _tables.clear()
+    get_shop_registry.clear()
+    _health["checked_at"] = time.time()
+
+
+# Anagrafe negozi condivisa fra sessioni e tab, riletta dal foglio ogni SHOP_REGISTRY_TTL_S
+@st.cache_resource(ttl=SHOP_REGISTRY_TTL_S, show_spinner=False)
+def get_shop_registry():
+    return ShopRegistry(get_tables()["negozi"].get_all_records())
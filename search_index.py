@@ -0,0 +1,49 @@
+import re
+from bisect import bisect_left
+
+# --- INDICE INVERTITO DEL CATALOGO ---
+# token -> insieme di ID_PRODOTTO, costruito da NOME_NORMALIZZATO, BRAND e CATEGORIA.
+# Le query sono AND tra token, ognuno cercato come prefisso (es. "GRAN LAT" -> GRANAROLO + LATTE).
+
+INDEXED_COLS = ["NOME_NORMALIZZATO", "BRAND", "CATEGORIA"]
+
+
+def tokenize(text):
+    return re.findall(r"\w+", str(text).upper())
+
+
+class TokenIndex:
+    def __init__(self, df_catalogo):
+        self.postings = {}
+        if not df_catalogo.empty and "ID_PRODOTTO" in df_catalogo.columns:
+            cols = [c for c in INDEXED_COLS if c in df_catalogo.columns]
+            ids = df_catalogo["ID_PRODOTTO"].fillna("").astype(str).str.strip()
+            for pid, *texts in zip(ids, *(df_catalogo[c] for c in cols)):
+                if not pid: continue
+                for tok in tokenize(" ".join(str(t) for t in texts)):
+                    self.postings.setdefault(tok, set()).add(pid)
+        self.tokens = sorted(self.postings)
+        self._prefix_cache = {}
+
+    def prefix_ids(self, prefix):
+        """Unione delle posting list di tutti i token che iniziano con prefix"""
+        if prefix in self._prefix_cache: return self._prefix_cache[prefix]
+        out = set()
+        i = bisect_left(self.tokens, prefix)
+        while i < len(self.tokens) and self.tokens[i].startswith(prefix):
+            out |= self.postings[self.tokens[i]]
+            i += 1
+        if len(self._prefix_cache) > 4096: self._prefix_cache.clear()
+        self._prefix_cache[prefix] = out
+        return out
+
+    def search(self, query):
+        """ID_PRODOTTO che contengono tutti i token della query (come prefisso)"""
+        toks = tokenize(query)
+        if not toks: return set()
+        sets = sorted((self.prefix_ids(t) for t in set(toks)), key=len)
+        res = set(sets[0])
+        for s in sets[1:]:
+            res &= s
+            if not res: break
+        return res
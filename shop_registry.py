@@ -0,0 +1,43 @@
+import os
+import time
+from utils import clean_piva, norm_addr
+from geo_index import ShopGeoIndex, parse_coords
+
+# --- ANAGRAFE NEGOZI IN MEMORIA ---
+# Dizionari precalcolati (indirizzo normalizzato, P.IVA) e coordinate già convertite:
+# ogni ricerca è un accesso O(1) invece di una scansione con regex su tutta la lista.
+
+ADDR_COL = 'Indirizzo_Standard (Pulito)'
+SHOP_REGISTRY_TTL_S = int(os.environ.get("SHOP_REGISTRY_TTL_S", "600"))
+
+
+class ShopRegistry:
+    def __init__(self, records):
+        self.records = records
+        self.by_addr = {}
+        self.by_piva = {}
+        self.points = {}
+        for rec in records:
+            a = norm_addr(rec.get(ADDR_COL, ''))
+            if a and a not in self.by_addr:
+                self.by_addr[a] = rec
+                self.points[a] = parse_coords(rec)
+            p = clean_piva(rec.get('P_IVA', ''))
+            if p: self.by_piva.setdefault(p, rec)
+        self.geo = ShopGeoIndex(records)
+        self.loaded_at = time.time()
+
+    def find_by_addr(self, indirizzo):
+        return self.by_addr.get(norm_addr(indirizzo))
+
+    def find_by_piva(self, piva):
+        p = clean_piva(piva)
+        return self.by_piva.get(p) if p else None
+
+    def point(self, indirizzo):
+        """(lat, lon) del negozio, None se assente o con coordinate non valide"""
+        return self.points.get(norm_addr(indirizzo))
+
+    def addrs_within(self, lat, lon, radius_km):
+        """Indirizzi normalizzati dei negozi entro il raggio in linea d'aria"""
+        return {norm_addr(rec.get(ADDR_COL, '')) for rec, _ in self.geo.within(lat, lon, radius_km)}
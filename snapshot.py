@@ -0,0 +1,241 @@
+import os
+import json
+import time
+import hashlib
+import threading
+import pandas as pd
+from gspread.utils import rowcol_to_a1
+from utils import clean_price, parse_float, norm_date, sqlite_connect, scontrini_cols
+
+# --- SNAPSHOT LOCALE DEI FOGLI (SQLite su disco) ---
+# Ogni foglio viene copiato in una tabella con lo stesso nome. Al refresh si scaricano
+# solo le righe aggiunte dopo l'ultimo sync (il foglio cresce solo in coda con append_rows).
+# Cancellazioni e modifiche in mezzo al foglio (clean_db, catalog_dedup) non cambiano per
+# forza il numero di righe: a ogni sync si confronta un'impronta della colonna A (già letta
+# per contare le righe), della colonna ID_PRODOTTO se non è la A (la rimappa di
+# catalog_dedup la cambia sul posto) e dell'ultima riga nota; se non torna, o se l'ultima
+# ricostruzione è più vecchia di SNAPSHOT_REBUILD_S, si riscarica tutto. Sync concorrenti (sessioni,
+# processi diversi) scrivono in una transazione BEGIN IMMEDIATE che ricontrolla lo stato:
+# una coda già aggiunta da altri non viene inserita due volte.
+
+SNAPSHOT_PATH = os.environ.get("SNAPSHOT_PATH", os.path.join(".cache", "snapshot.db"))
+# Finestra di validità: entro questo tempo le letture non toccano Google Sheets
+SNAPSHOT_MAX_AGE_S = int(os.environ.get("SNAPSHOT_MAX_AGE_S", "300"))
+# Ricostruzione completa periodica: rete di sicurezza per modifiche in mezzo al foglio
+SNAPSHOT_REBUILD_S = int(os.environ.get("SNAPSHOT_REBUILD_S", str(24 * 3600)))
+
+# Indice scontrini: (data, negozio, indirizzo, numero) -> righe; colonne dall'intestazione (utils.scontrini_cols)
+RECEIPT_TABLE = "Scontrini"
+RECEIPT_INDEX_VERSION = 2   # PRAGMA user_version: indici creati con regole vecchie (o mancanti) vengono ricostruiti
+
+# Colonne tipizzate: nome -> (tipo SQL, convertitore)
+TYPED_COLS = {
+    "Prezzo_Unitario": ("REAL", clean_price),
+    "FORMATO": ("REAL", parse_float),
+}
+
+
+_sync_locks, _sync_locks_guard = {}, threading.Lock()
+
+
+def _sync_lock(path):
+    """Un lock per file di snapshot: nello stesso processo un solo sync alla volta"""
+    with _sync_locks_guard:
+        return _sync_locks.setdefault(os.path.abspath(path), threading.Lock())
+
+
+def fingerprint(cols, n, last_row):
+    """Impronta delle prime n righe dati delle colonne date (valori col_values) e dell'ultima riga"""
+    clean = lambda r: [str(v) for v in r] if r else []
+    last = clean(last_row)
+    while last and last[-1] == "": last.pop()
+    return hashlib.sha1(json.dumps([clean(c[1:n + 1]) for c in cols] + [last]).encode()).hexdigest()
+
+
+class Snapshot:
+    def __init__(self, path=SNAPSHOT_PATH, max_age_s=SNAPSHOT_MAX_AGE_S, rebuild_s=SNAPSHOT_REBUILD_S):
+        self.path = path
+        self.max_age_s = max_age_s
+        self.rebuild_s = rebuild_s
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self.connect() as conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS sync_meta (
+                tbl TEXT PRIMARY KEY, n_rows INTEGER, header TEXT,
+                synced_at REAL, generation INTEGER, fingerprint TEXT, rebuilt_at REAL)""")
+            cols = {r[1] for r in conn.execute("PRAGMA table_info(sync_meta)")}
+            for c, t in (("fingerprint", "TEXT"), ("rebuilt_at", "REAL")):
+                if c not in cols: conn.execute(f"ALTER TABLE sync_meta ADD COLUMN {c} {t}")
+            conn.execute("""CREATE TABLE IF NOT EXISTS receipt_index (
+                data TEXT, negozio TEXT, indirizzo TEXT, num TEXT, nome TEXT, prezzo REAL, qta REAL)""")
+            conn.execute("CREATE INDEX IF NOT EXISTS receipt_key ON receipt_index (data, negozio, indirizzo, num)")
+
+    def connect(self):
+        return sqlite_connect(self.path)
+
+    def _meta(self, conn, table):
+        r = conn.execute("""SELECT n_rows, header, synced_at, generation, fingerprint, rebuilt_at
+                            FROM sync_meta WHERE tbl = ?""", (table,)).fetchone()
+        if not r: return None
+        return {"n_rows": r[0], "header": json.loads(r[1]), "synced_at": r[2], "generation": r[3],
+                "fingerprint": r[4], "rebuilt_at": r[5] or 0}
+
+    def sync(self, ws, table, force=False):
+        """Allinea la tabella locale al foglio. Restituisce il numero di righe nuove."""
+        with _sync_lock(self.path):
+            return self._sync(ws, table, force)
+
+    def _sync(self, ws, table, force):
+        with self.connect() as conn:
+            meta = self._meta(conn, table)
+            if table == RECEIPT_TABLE and conn.execute("PRAGMA user_version").fetchone()[0] < RECEIPT_INDEX_VERSION:
+                meta = dict(meta, header=None, synced_at=0) if meta else None
+        if meta and not force and time.time() - meta["synced_at"] < self.max_age_s:
+            return 0
+
+        header = [h.strip() for h in ws.row_values(1)]
+        # La colonna A è sempre valorizzata (Data / ID_PRODOTTO): basta per contare le righe
+        col_a = ws.col_values(1)
+        n_remote = max(len(col_a) - 1, 0)
+        cols = [col_a]
+        if "ID_PRODOTTO" in header[1:]: cols.append(ws.col_values(header.index("ID_PRODOTTO") + 1))
+
+        # Primo sync, schema cambiato, righe cancellate, ricostruzione scaduta o righe già note cambiate
+        stale = (meta is None or meta["header"] != header or n_remote < meta["n_rows"]
+                 or time.time() - meta["rebuilt_at"] > self.rebuild_s)
+        last = []
+        if not stale and meta["n_rows"]:
+            last = ws.row_values(meta["n_rows"] + 1)
+            stale = meta["fingerprint"] != fingerprint(cols, meta["n_rows"], last)
+        if stale:
+            rows = ws.get_all_values()[1:n_remote + 1] if header else []
+            fp = fingerprint(cols, n_remote, rows[-1] if rows else [])
+            self._rebuild(table, header, rows, n_remote, meta, fp)
+            return len(rows)
+
+        rows = []
+        if n_remote > meta["n_rows"]:
+            rng = f"{rowcol_to_a1(meta['n_rows'] + 2, 1)}:{rowcol_to_a1(n_remote + 1, len(header))}"
+            rows = ws.get(rng)
+        fp = fingerprint(cols, n_remote, rows[-1] if rows else last)
+        return self._append(table, header, rows, n_remote, meta, fp)
+
+    def meta(self, table):
+        with self.connect() as conn:
+            return self._meta(conn, table)
+
+    def invalidate(self, table=None):
+        """Forza un controllo remoto alla prossima lettura (es. dopo un salvataggio)"""
+        with self.connect() as conn:
+            if table: conn.execute("UPDATE sync_meta SET synced_at = 0 WHERE tbl = ?", (table,))
+            else: conn.execute("UPDATE sync_meta SET synced_at = 0")
+
+    def frame(self, table):
+        with self.connect() as conn:
+            meta = self._meta(conn, table)
+            if not meta or not meta["header"]: return pd.DataFrame()
+            return pd.read_sql_query(f'SELECT * FROM "{table}" ORDER BY rowid', conn)
+
+    def receipt_lines(self, data, negozio, indirizzo, num):
+        """Righe già salvate dello scontrino [(nome grezzo, prezzo, qtà)]; [] se nuovo o senza numero"""
+        key = receipt_key(data, negozio, indirizzo, num)
+        if not key[3]: return []
+        with self.connect() as conn:
+            return conn.execute("""SELECT nome, prezzo, qta FROM receipt_index
+                WHERE data = ? AND negozio = ? AND indirizzo = ? AND num = ?""", key).fetchall()
+
+    def version(self):
+        """Identificativo dello stato dei dati (cambia a ogni riga nuova o ricostruzione)"""
+        with self.connect() as conn:
+            rows = conn.execute("SELECT tbl, n_rows, generation FROM sync_meta ORDER BY tbl").fetchall()
+        return "|".join(f"{t}:{n}:{g}" for t, n, g in rows)
+
+    # --- interni ---
+
+    def _cols(self, header):
+        return [(i, h) for i, h in enumerate(header) if h]
+
+    def _typed(self, header, rows):
+        cols = self._cols(header)
+        out = []
+        for r in rows:
+            r = list(r) + [""] * (len(header) - len(r))
+            if not any(str(v).strip() for v in r): continue
+            rec = []
+            for i, h in cols:
+                v = r[i]
+                if h in TYPED_COLS: v = TYPED_COLS[h][1](v)
+                elif h == "ID_PRODOTTO": v = str(v).strip()
+                rec.append(v)
+            out.append(rec)
+        return out
+
+    def _index_receipts(self, conn, header, rows):
+        recs = []
+        for r in rows:
+            key, line = receipt_fields(r, header)
+            if key[3]: recs.append((*key, *line))
+        conn.executemany("INSERT INTO receipt_index VALUES (?, ?, ?, ?, ?, ?, ?)", recs)
+
+    def _same_base(self, conn, table, base):
+        """Lo stato locale è ancora quello letto prima delle chiamate remote (stessa generazione)?"""
+        cur = self._meta(conn, table)
+        return cur, (cur or {}).get("generation") == (base or {}).get("generation")
+
+    def _rebuild(self, table, header, rows, n_rows, base, fp):
+        cols = self._cols(header)
+        with self.connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            # Un altro sync ha già ricostruito nel frattempo: la sua copia è fresca quanto questa
+            if not self._same_base(conn, table, base)[1]: return
+            generation = (base or {}).get("generation", 0) + 1
+            conn.execute(f'DROP TABLE IF EXISTS "{table}"')
+            if cols:
+                defs = ", ".join(f'"{h}" {TYPED_COLS.get(h, ("TEXT",))[0]}' for _, h in cols)
+                conn.execute(f'CREATE TABLE "{table}" ({defs})')
+                ph = ", ".join("?" for _ in cols)
+                conn.executemany(f'INSERT INTO "{table}" VALUES ({ph})', self._typed(header, rows))
+            if table == RECEIPT_TABLE:
+                conn.execute("DELETE FROM receipt_index")
+                self._index_receipts(conn, header, rows)
+                conn.execute(f"PRAGMA user_version = {RECEIPT_INDEX_VERSION}")
+            now = time.time()
+            conn.execute("""INSERT OR REPLACE INTO sync_meta (tbl, n_rows, header, synced_at, generation, fingerprint, rebuilt_at)
+                            VALUES (?, ?, ?, ?, ?, ?, ?)""", (table, n_rows, json.dumps(header), now, generation, fp, now))
+
+    def _append(self, table, header, rows, n_rows, base, fp):
+        """Aggiunge la coda scaricata (righe base.n_rows+1..n_rows) saltando quelle già aggiunte da un sync concorrente"""
+        cols = self._cols(header)
+        with self.connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            cur, same = self._same_base(conn, table, base)
+            if not same: return 0
+            if cur["n_rows"] >= n_rows:
+                conn.execute("UPDATE sync_meta SET synced_at = ? WHERE tbl = ?", (time.time(), table))
+                return 0
+            rows = rows[cur["n_rows"] - base["n_rows"]:]
+            if rows and cols:
+                ph = ", ".join("?" for _ in cols)
+                conn.executemany(f'INSERT INTO "{table}" VALUES ({ph})', self._typed(header, rows))
+            if table == RECEIPT_TABLE: self._index_receipts(conn, header, rows)
+            conn.execute("UPDATE sync_meta SET n_rows = ?, synced_at = ?, fingerprint = ? WHERE tbl = ?",
+                         (n_rows, time.time(), fp, table))
+        return n_rows - cur["n_rows"]
+
+
+def receipt_key(data, negozio, indirizzo, num):
+    up = lambda x: str(x).strip().upper()
+    return norm_date(data), up(negozio), up(indirizzo), up(num)
+
+
+def receipt_fields(row, header=()):
+    """(receipt_key, receipt_line) di una riga di Scontrini; senza intestazione come le righe di build_rows"""
+    c = scontrini_cols(header)
+    get = lambda f: row[c[f]] if c[f] < len(row) else ""
+    return (receipt_key(get("data"), get("negozio"), get("indirizzo"), get("num")),
+            receipt_line(get("nome_grezzo"), get("prezzo"), get("quantita")))
+
+
+def receipt_line(nome, prezzo, qta):
+    """Riga confrontabile: nome grezzo maiuscolo, prezzo e quantità arrotondati"""
+    q = parse_float(qta)
+    return str(nome).strip().upper(), round(clean_price(prezzo), 2), round(q if q is not None else 1.0, 3)
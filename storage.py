@@ -0,0 +1,249 @@
+import os
+import sys
+import json
+import zlib
+import argparse
+from gspread.utils import a1_to_rowcol, numericise
+from utils import sqlite_connect
+
+# --- BACKEND DI ARCHIVIAZIONE ---
+# L'app usa i fogli tramite poche operazioni in stile gspread (row_values, col_values,
+# get, get_all_values, get_all_records, append_row/append_rows; per gli script di
+# manutenzione anche batch_update di celle, delete_rows e spreadsheet.batch_update con
+# deleteDimension). Il backend Sheets restituisce i worksheet veri; quello SQLite tabelle
+# locali indicizzate per numero di riga con la stessa interfaccia, così Snapshot, app,
+# clean_db, catalog_dedup e bulk_import non cambiano e girano anche senza rete.
+# Scelta con STORAGE_BACKEND = sheets | sqlite.
+#
+# Migrazione: python storage.py migrate --src sheets --dst sqlite [--replace]
+
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "sheets")
+STORAGE_SQLITE_PATH = os.environ.get("STORAGE_SQLITE_PATH", os.path.join("data", "prezzi.db"))
+SPREADSHEET = "Database_Prezzi"
+TABLES = ["Scontrini", "Catalogo", "Anagrafe_Negozi"]
+INDEXED_HEADERS = ["ID_PRODOTTO", "NOME_NORMALIZZATO", "P_IVA"]   # indici secondari se presenti
+SCOPES = ["https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"]
+
+
+class SheetsBackend:
+    def __init__(self, google_info):
+        import gspread
+        from google.oauth2.service_account import Credentials
+        creds = Credentials.from_service_account_info(google_info, scopes=SCOPES)
+        self.sh = gspread.authorize(creds).open(SPREADSHEET)
+
+    def table(self, name):
+        return self.sh.worksheet(name)
+
+
+class SQLiteBackend:
+    """Database SQLite con l'interfaccia dello spreadsheet: tabelle come worksheet, batch_update
+    per le richieste deleteDimension (una transazione per tutte, come una batch_update di Sheets)"""
+
+    def __init__(self, path=STORAGE_SQLITE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self.connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS sheet_header (tbl TEXT PRIMARY KEY, header TEXT)")
+
+    def connect(self):
+        return sqlite_connect(self.path)
+
+    def table(self, name):
+        return SqlTable(self, name)
+
+    def batch_update(self, body):
+        """Esegue in ordine le richieste deleteDimension (ROWS) di body["requests"]"""
+        tables = {}
+        with self.connect() as conn:
+            for name, in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name GLOB 'sheet_*'"):
+                t = SqlTable(self, name[len("sheet_"):], create=False)
+                tables[t.id] = t
+            for req in body.get("requests", []):
+                rng = req.get("deleteDimension", {}).get("range", {})
+                if rng.get("dimension") != "ROWS" or rng.get("sheetId") not in tables:
+                    raise ValueError(f"Richiesta non supportata dal backend SQLite: {req}")
+                tables[rng["sheetId"]]._delete(conn, rng["startIndex"] + 1, rng["endIndex"])
+        return {"replies": [{} for _ in body.get("requests", [])]}
+
+
+class SqlTable:
+    """Tabella SQLite con l'interfaccia di un worksheet: riga 1 = intestazione, dati dalla riga 2.
+    Le righe sono chiavi primarie (r = numero di riga), le colonne c1..cN testo."""
+
+    def __init__(self, backend, name, create=True):
+        self.backend = backend
+        self.title = name
+        self.id = zlib.crc32(name.encode()) & 0x7FFFFFFF   # sheetId stabile per le richieste deleteDimension
+        self._t = f'"sheet_{name}"'
+        if create:
+            with self.backend.connect() as conn:
+                conn.execute(f"CREATE TABLE IF NOT EXISTS {self._t} (r INTEGER PRIMARY KEY)")
+
+    @property
+    def spreadsheet(self):
+        return self.backend
+
+    # --- letture ---
+
+    def _width(self, conn):
+        return len(conn.execute(f"PRAGMA table_info({self._t})").fetchall()) - 1
+
+    def _header(self, conn):
+        r = conn.execute("SELECT header FROM sheet_header WHERE tbl = ?", (self.title,)).fetchone()
+        return json.loads(r[0]) if r else []
+
+    def _rows(self, conn, first=2, last=None, c1=1, c2=None):
+        """Righe first..last (numeri di riga del foglio), colonne c1..c2, vuote finali tolte come gspread"""
+        c2 = min(c2 or self._width(conn), self._width(conn))
+        cols = ", ".join(f"c{i}" for i in range(c1, c2 + 1)) or "NULL"
+        q = f"SELECT r, {cols} FROM {self._t} WHERE r >= ?" + (" AND r <= ?" if last else "") + " ORDER BY r"
+        out, expect = [], first
+        for r, *vals in conn.execute(q, (first, last) if last else (first,)):
+            out += [[] for _ in range(r - expect)]
+            vals = ["" if v is None else v for v in vals]
+            while vals and vals[-1] == "": vals.pop()
+            out.append(vals)
+            expect = r + 1
+        return out
+
+    def row_values(self, row):
+        with self.backend.connect() as conn:
+            if row == 1: return self._header(conn)
+            rows = self._rows(conn, row, row)
+        return rows[0] if rows else []
+
+    def col_values(self, col):
+        with self.backend.connect() as conn:
+            header = self._header(conn)
+            vals = [header[col - 1] if col <= len(header) else ""] + [r[0] if r else "" for r in self._rows(conn, c1=col, c2=col)]
+        while vals and vals[-1] == "": vals.pop()
+        return vals
+
+    def get_all_values(self):
+        with self.backend.connect() as conn:
+            rows = [self._header(conn)] + self._rows(conn)
+        w = max(len(r) for r in rows)
+        return [r + [""] * (w - len(r)) for r in rows] if w else []
+
+    def get(self, rng):
+        start, _, end = rng.partition(":")
+        r1, c1 = a1_to_rowcol(start)
+        r2, c2 = a1_to_rowcol(end or start)
+        with self.backend.connect() as conn:
+            head = [self._header(conn)[c1 - 1:c2]] if r1 == 1 else []
+            rows = head + self._rows(conn, max(r1, 2), r2, c1, c2)
+        while rows and not rows[-1]: rows.pop()
+        return rows
+
+    def get_all_records(self):
+        values = self.get_all_values()
+        if not values: return []
+        header = values[0]
+        return [dict(zip(header, (numericise(v, empty2zero=False, default_blank="") for v in r))) for r in values[1:]]
+
+    # --- scritture ---
+
+    def _ensure_width(self, conn, w):
+        for i in range(self._width(conn) + 1, w + 1):
+            conn.execute(f"ALTER TABLE {self._t} ADD COLUMN c{i} TEXT")
+
+    def _set_header(self, conn, header):
+        conn.execute("INSERT OR REPLACE INTO sheet_header VALUES (?, ?)", (self.title, json.dumps(header)))
+        self._ensure_width(conn, len(header))
+        for i, h in enumerate(header, 1):
+            if h.strip() in INDEXED_HEADERS:
+                conn.execute(f'CREATE INDEX IF NOT EXISTS "ix_{self.title}_c{i}" ON {self._t} (c{i})')
+
+    def append_rows(self, values, value_input_option=None):
+        values = [["" if v is None else str(v) for v in row] for row in values]
+        if not values: return
+        with self.backend.connect() as conn:
+            if not self._header(conn):
+                self._set_header(conn, values[0])
+                values = values[1:]
+            self._ensure_width(conn, max((len(r) for r in values), default=0))
+            nxt = (conn.execute(f"SELECT MAX(r) FROM {self._t}").fetchone()[0] or 1) + 1
+            for k, row in enumerate(values):
+                cols = ", ".join(["r"] + [f"c{i}" for i in range(1, len(row) + 1)])
+                conn.execute(f"INSERT INTO {self._t} ({cols}) VALUES ({', '.join('?' * (len(row) + 1))})", [nxt + k, *row])
+
+    def append_row(self, values, value_input_option=None):
+        self.append_rows([values], value_input_option)
+
+    def batch_update(self, data, value_input_option=None):
+        """data: [{"range": "A1" o "A1:C2", "values": [[...]]}], come Worksheet.batch_update"""
+        with self.backend.connect() as conn:
+            header = self._header(conn)
+            for upd in data:
+                r0, c0 = a1_to_rowcol(upd["range"].partition(":")[0])
+                for dr, row in enumerate(upd["values"]):
+                    row = ["" if v is None else str(v) for v in row]
+                    if r0 + dr == 1:
+                        header = header + [""] * (c0 - 1 + len(row) - len(header))
+                        header[c0 - 1:c0 - 1 + len(row)] = row
+                        self._set_header(conn, header)
+                        continue
+                    self._ensure_width(conn, c0 - 1 + len(row))
+                    conn.execute(f"INSERT OR IGNORE INTO {self._t} (r) VALUES (?)", (r0 + dr,))
+                    sets = ", ".join(f"c{c0 + k} = ?" for k in range(len(row)))
+                    conn.execute(f"UPDATE {self._t} SET {sets} WHERE r = ?", [*row, r0 + dr])
+
+    def _delete(self, conn, top, bottom):
+        """Elimina le righe top..bottom (dati, >= 2) e fa risalire quelle sotto, come Sheets"""
+        if top < 2: raise ValueError("L'intestazione (riga 1) non si elimina")
+        n = bottom - top + 1
+        conn.execute(f"DELETE FROM {self._t} WHERE r BETWEEN ? AND ?", (top, bottom))
+        # In due passi: spostare le chiavi direttamente può collidere con righe non ancora spostate
+        conn.execute(f"UPDATE {self._t} SET r = -(r - ?) WHERE r > ?", (n, bottom))
+        conn.execute(f"UPDATE {self._t} SET r = -r WHERE r < 0")
+
+    def delete_rows(self, start_index, end_index=None):
+        with self.backend.connect() as conn:
+            self._delete(conn, start_index, end_index or start_index)
+
+    def clear(self):
+        with self.backend.connect() as conn:
+            conn.execute(f"DELETE FROM {self._t}")
+            conn.execute("DELETE FROM sheet_header WHERE tbl = ?", (self.title,))
+
+
+def open_backend(kind=None, google_info=None):
+    kind = kind or STORAGE_BACKEND
+    if kind == "sqlite": return SQLiteBackend(STORAGE_SQLITE_PATH)
+    if kind == "sheets": return SheetsBackend(google_info if google_info is not None else json.loads(os.environ['GOOGLE_SHEETS_JSON']))
+    raise ValueError(f"Backend sconosciuto: {kind}")
+
+
+def migrate(src, dst, tables=TABLES, replace=False, chunk=1000):
+    """Copia intestazione e righe di ogni tabella da src a dst; {tabella: righe copiate}"""
+    out = {}
+    for name in tables:
+        values = src.table(name).get_all_values()
+        target = dst.table(name)
+        if target.row_values(1):
+            if not replace: raise RuntimeError(f"{name}: destinazione non vuota (usa --replace)")
+            target.clear()
+        if not values: continue
+        target.append_row(values[0])
+        for i in range(1, len(values), chunk):
+            target.append_rows(values[i:i + chunk], value_input_option='USER_ENTERED')
+        out[name] = len(values) - 1
+    return out
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Strumenti per i backend di archiviazione")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    m = sub.add_parser("migrate", help="copia tutte le tabelle da un backend all'altro")
+    m.add_argument("--src", choices=["sheets", "sqlite"], required=True)
+    m.add_argument("--dst", choices=["sheets", "sqlite"], required=True)
+    m.add_argument("--replace", action="store_true", help="svuota le tabelle di destinazione")
+    args = ap.parse_args(argv)
+    if args.src == args.dst: ap.error("sorgente e destinazione coincidono")
+    for name, n in migrate(open_backend(args.src), open_backend(args.dst), replace=args.replace).items():
+        print(f"✅ {name}: {n} righe copiate")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,25 @@
+import os
+import sys
+
+# I moduli sono al primo livello del repository (nessun pacchetto installabile)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+import storage
+
+
+@pytest.fixture
+def backend(tmp_path):
+    """Backend SQLite locale: tabelle con l'interfaccia dei worksheet, senza rete"""
+    return storage.SQLiteBackend(str(tmp_path / "db.sqlite"))
+
+
+@pytest.fixture
+def sheet(backend):
+    """sheet(nome, intestazione, righe): tabella del backend già riempita"""
+    def make(name, header, rows=()):
+        t = backend.table(name)
+        t.append_row(header)
+        if rows: t.append_rows([list(r) for r in rows])
+        return t
+    return make
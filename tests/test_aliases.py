@@ -0,0 +1,20 @@
+from aliases import AliasStore, alias_key
+
+KEYS = [alias_key("LATTE PS", "COOP"), alias_key("LATTE P.S.", "COOP"), alias_key("PANE", "COOP")]
+
+
+def test_prune_drops_deleted_products_but_not_queued_ones(tmp_path):
+    store = AliasStore(str(tmp_path / "aliases.db"))
+    store.put_many(dict(zip(KEYS, ["P1", "P2", "P3"])))
+    assert store.prune_due()
+    # P2 eliminato (duplicato unito), P3 appena salvato: la sua riga di Catalogo è ancora in coda
+    assert store.prune({"P1"}, keep={"P3"}) == 1
+    assert set(store.get_many(KEYS).values()) == {"P1", "P3"}
+    # Pulizia registrata (vale per tutti i processi che usano lo stesso file)
+    assert not AliasStore(store.path).prune_due() and AliasStore(store.path).prune_due(every_s=0)
+
+
+def test_prune_with_empty_catalog_keeps_everything(tmp_path):
+    store = AliasStore(str(tmp_path / "aliases.db"))
+    store.put_many({KEYS[0]: "P1"})
+    assert store.prune(set()) == 0 and store.count() == 1 and store.prune_due()
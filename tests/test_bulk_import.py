@@ -0,0 +1,18 @@
+import io
+from PIL import Image
+import bulk_import
+
+
+def test_receipt_without_products_is_left_for_review(tmp_path, monkeypatch, backend):
+    # Modello finto (nessun prodotto letto) e backend SQLite: nessuna rete, file locali in tmp_path
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(bulk_import, "open_backend", lambda: backend)
+    foto = tmp_path / "foto"
+    foto.mkdir()
+    buf = io.BytesIO()
+    Image.new("RGB", (60, 120), "white").save(buf, format="JPEG")
+    (foto / "s1.jpg").write_bytes(buf.getvalue())
+
+    bulk_import.main([str(foto), "--fake", "--workers", "1"])
+    assert bulk_import.Checkpoint().statuses() == {str(foto / "s1.jpg"): "review"}
+    assert backend.table("Scontrini").get_all_values() == []
@@ -0,0 +1,20 @@
+import pandas as pd
+from candidates import CandidateIndex
+
+CATALOGO = pd.DataFrame({"ID_PRODOTTO": ["P1", "P2", "P3"],
+                         "NOME_NORMALIZZATO": ["LATTE GRANAROLO PS 1L", "PANE INTEGRALE", "BIRRA MORETTI 66CL"]})
+
+
+def scontrino(shop, raw, pid):
+    return ["2026-01-02", shop, "VIA A", raw, 1.0, 0, 1.0, "NO", 1.0, "SI", pid, "1"]
+
+
+def test_prompt_names_follow_the_shop_history_not_just_popularity():
+    # PANE è il più comprato in assoluto, ma da LIDL si leggono nomi di latte
+    rows = [scontrino("COOP", "PANE INT", "P2")] * 5 + [scontrino("LIDL", "LATTE GRAN PS", "P1"),
+                                                           scontrino("LIDL", "LATTE GRANAROLO", "")]
+    idx = CandidateIndex(pd.DataFrame(rows), CATALOGO)
+    assert idx.prompt_names(n=1, shop="lidl") == ["LATTE GRANAROLO PS 1L"]
+    assert idx.prompt_names(n=1, shop="COOP") == ["PANE INTEGRALE"]
+    assert idx.prompt_names(n=3)[0] == "PANE INTEGRALE" and len(idx.prompt_names(n=3)) == 3
+    assert idx.shops() == ["COOP", "LIDL"]
@@ -0,0 +1,25 @@
+from cart_cache import CartCache, cart_key
+
+
+def key(items=("latte", "Pane"), lat=45.46421, version="Catalogo:10:1|Scontrini:50:1", **opts):
+    return cart_key(items, lat, 9.19, 5, 2, version, **opts)
+
+
+def test_key_ignores_order_case_and_tiny_moves_but_not_data_or_options():
+    assert key() == key(items=("PANE ", "LATTE")) == key(lat=45.46449)
+    assert key() != key(items=("LATTE", "PANE", "PANE"))
+    assert key() != key(lat=45.4660)
+    assert key() != key(version="Catalogo:10:1|Scontrini:51:1")      # righe nuove nello snapshot
+    assert key(costo_km=0.2) != key(costo_km=0.3)
+
+
+def test_lru_and_invalidation_on_save():
+    cache = CartCache(max_entries=2)
+    cache.put(key(items=("A",)), 1)
+    cache.put(key(items=("B",)), 2)
+    assert cache.get(key(items=("A",))) == 1
+    cache.put(key(items=("C",)), 3)                                   # esce B, il meno usato
+    assert cache.get(key(items=("B",))) is None and len(cache) == 2
+    cache.invalidate()                                                # salvataggio: righe in coda non nello snapshot
+    assert cache.get(key(items=("A",))) is None and len(cache) == 0
+    assert cache.stats == {"hits": 1, "misses": 2, "evictions": 1, "invalidations": 1}
@@ -0,0 +1,56 @@
+import pandas as pd
+import catalog_dedup
+from catalog_dedup import find_duplicates, apply_merge
+
+# --- DEDUPLICA DEL CATALOGO: SOLO VARIANTI DI SCRITTURA, GRUPPI A LEGAME COMPLETO ---
+
+C_HEADER = ["ID_PRODOTTO", "NOME_NORMALIZZATO", "BRAND", "CATEGORIA", "FORMATO", "UNITA"]
+
+
+def catalogo(*names):
+    return pd.DataFrame([[f"P{i}", n, "MARCA", "CAT", "1", "PZ"] for i, n in enumerate(names)], columns=C_HEADER)
+
+
+def test_spelling_variants_are_merged():
+    df = catalogo("LATTE GRANAROLO PS", "PANE", "LATTE GRANAROLO P.S.")
+    assert find_duplicates(df) == [("P0", ["P2"], 1.0)]
+
+
+def test_extra_word_is_another_product():
+    a, b = "BISCOTTI PAN DI STELLE MULINO BIANCO", "BISCOTTI PAN DI STELLE MULINO BIANCO GOCCE"
+    assert catalog_dedup.jaccard(catalog_dedup.trigram_set(a), catalog_dedup.trigram_set(b)) >= 0.8
+    assert find_duplicates(catalogo(a, b)) == []
+    assert find_duplicates(catalogo("COCA COLA", "COCA COLA ZERO"), threshold=0.5) == []
+
+
+def test_no_merge_by_chain():
+    # B~A e B~C sopra soglia, A~C no: al massimo una delle due coppie, mai A con C
+    names = ["CREMA SPALMABILE NOCCIOLE CACAO FONDENTE", "CRE SPALMABILE NOCCIOLE CACAO FONDENTE",
+             "CRE SPALMABI NOCCIOLE CACAO FONDENTE"]
+    groups = find_duplicates(catalogo(*names), threshold=0.85)
+    assert len(groups) == 1
+    canon, dups, sim = groups[0]
+    assert {canon, *dups} == {"P1", "P2"} and sim >= 0.85
+
+
+def counted(monkeypatch, cls, label, calls):
+    """Conta le chiamate a cls.batch_update (una scrittura verso il foglio)"""
+    orig = cls.batch_update
+    def wrapper(self, *args, **kw):
+        calls.append(label)
+        return orig(self, *args, **kw)
+    monkeypatch.setattr(cls, "batch_update", wrapper)
+
+
+def test_apply_merge_one_write_per_sheet(sheet, backend, monkeypatch):
+    s = sheet("Scontrini", ["Data", "ID_PRODOTTO"], [["2026-01-02", pid] for pid in ["P0", "P2", "P1", "P4", "P2"]])
+    df = catalogo("LATTE PS", "PANE", "LATTE P.S.", "ACQUA", "LATTE P S")
+    c = sheet("Catalogo", C_HEADER, df.values.tolist())
+    calls = []
+    counted(monkeypatch, type(s), "celle", calls)
+    counted(monkeypatch, type(backend), "righe", calls)
+
+    assert apply_merge(s, c, df, [("P0", ["P2", "P4"], 1.0)]) == (3, 2)
+    assert calls == ["celle", "righe"]
+    assert s.col_values(2)[1:] == ["P0", "P0", "P1", "P0", "P0"]
+    assert [r[0] for r in c.get_all_values()[1:]] == ["P0", "P1", "P3"]
@@ -0,0 +1,37 @@
+from types import SimpleNamespace
+import clean_db
+
+HEADER = ["Data", "Supermercato", "Indirizzo", "Prodotto", "Prezzo_Netto"]
+
+
+class Counting:
+    """Tabella del backend che conta le celle lette con get (solo le righe nuove devono arrivare)"""
+    def __init__(self, ws): self.ws, self.read = ws, 0
+    def __getattr__(self, name): return getattr(self.ws, name)
+    def get(self, rng):
+        rows = self.ws.get(rng)
+        self.read += len(rows)
+        return rows
+
+
+def test_second_run_reads_only_new_rows(tmp_path, monkeypatch, sheet, backend):
+    monkeypatch.chdir(tmp_path)
+    latte, pane = ["2026-01-02", "COOP", "VIA A", "LATTE", "1.5"], ["2026-01-02", "COOP", "VIA A", "PANE", "2"]
+    ws = Counting(sheet("Scontrini", HEADER, [latte, pane, latte]))
+    tables = SimpleNamespace(table=lambda n: ws if n == "Scontrini" else backend.table(n))
+    monkeypatch.setattr(clean_db, "open_backend", lambda: tables)
+    store = clean_db.FingerprintStore(str(tmp_path / "fp.db"))
+
+    clean_db.run_cleanup(store=store)
+    assert ws.read == 3 and [r[3] for r in ws.get_all_values()[1:]] == ["LATTE", "PANE"]
+    assert store.checkpoint()["n_rows"] == 2
+
+    # Riga nuova già vista (impronta salvata) + una nuova: si legge solo la coda
+    ws.append_rows([pane, ["2026-01-03", "COOP", "VIA A", "BIRRA", "1"]])
+    clean_db.run_cleanup(store=store)
+    assert ws.read == 3 + 2 and [r[3] for r in ws.get_all_values()[1:]] == ["LATTE", "PANE", "BIRRA"]
+
+    # Intestazione cambiata: controllo completo
+    ws.batch_update([{"range": "F1", "values": [["Prezzo Un."]]}])
+    clean_db.run_cleanup(store=store)
+    assert ws.read == 5 + 3 and store.checkpoint()["n_rows"] == 3
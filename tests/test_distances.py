@@ -0,0 +1,81 @@
+import json
+import math
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+import pytest
+import distances
+
+# --- SERVER OSRM FINTO ---
+# Risponde a /table/v1/driving/... come OSRM, con distanze in linea d'aria (metri);
+# conta le richieste e le coordinate ricevute per verificare cache e suddivisione in blocchi.
+
+
+def haversine_m(a, b):
+    (lat1, lon1), (lat2, lon2) = a, b
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    h = math.sin((p2 - p1) / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2
+    return 2 * 6371000 * math.asin(math.sqrt(h))
+
+
+class OSRMHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlsplit(self.path)
+        coords = [tuple(map(float, c.split(",")))[::-1] for c in url.path.split("/")[-1].split(";")]
+        q = parse_qs(url.query)
+        src = [int(i) for i in q["sources"][0].split(";")] if "sources" in q else range(len(coords))
+        dst = [int(i) for i in q["destinations"][0].split(";")] if "destinations" in q else range(len(coords))
+        self.server.requests.append(len(coords))
+        body = {"code": "Ok", "distances": [[haversine_m(coords[i], coords[j]) for j in dst] for i in src]}
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(json.dumps(body).encode())
+
+    def log_message(self, *args): pass
+
+
+@pytest.fixture
+def osrm(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), OSRMHandler)
+    server.requests = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(distances, "OSRM_URL", f"http://127.0.0.1:{server.server_address[1]}")
+    yield server
+    server.shutdown()
+
+
+HOME = (45.464, 9.190)      # già arrotondata come la chiave della cache (ORIGIN_DECIMALS)
+SHOPS = [(45.464 + 0.01 * i, 9.1900 + 0.007 * (i % 5)) for i in range(1, 13)]
+
+
+def test_road_distances_cached(osrm, tmp_path):
+    cache = distances.DistanceCache(str(tmp_path / "d.db"))
+    km = distances.road_distances(HOME, SHOPS, cache=cache)
+    assert km == [round(haversine_m(HOME, s) / 1000, 1) for s in SHOPS]
+    assert osrm.requests == [len(SHOPS) + 1]
+    assert distances.road_distances(HOME, SHOPS, cache=cache) == km
+    assert len(osrm.requests) == 1     # seconda volta tutto dalla cache
+
+
+def test_road_distances_split_in_blocks(osrm, monkeypatch):
+    monkeypatch.setattr(distances, "TABLE_MAX_COORDS", 5)
+    km = distances.road_distances(HOME, SHOPS)
+    assert None not in km and len(km) == len(SHOPS)
+    assert max(osrm.requests) <= 5 and sum(n - 1 for n in osrm.requests) == len(SHOPS)
+
+
+def test_distance_matrix(osrm, tmp_path, monkeypatch):
+    monkeypatch.setattr(distances, "TABLE_MAX_COORDS", 8)
+    cache = distances.DistanceCache(str(tmp_path / "d.db"))
+    D = distances.distance_matrix(HOME, SHOPS, cache=cache)
+    pts = [HOME, *SHOPS]
+    assert all(D[i][i] == 0.0 for i in range(len(pts)))
+    assert D[3][7] == round(haversine_m(pts[3], pts[7]) / 1000, 1)
+    n = len(osrm.requests)
+    assert distances.distance_matrix(HOME, SHOPS, cache=cache) == D and len(osrm.requests) == n
+
+
+def test_server_down_gives_none(monkeypatch):
+    monkeypatch.setattr(distances, "OSRM_URL", "http://127.0.0.1:9")
+    assert distances.road_distances(HOME, SHOPS[:2]) == [None, None]
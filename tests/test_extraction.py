@@ -0,0 +1,89 @@
+import io
+import numpy as np
+from PIL import Image, ImageDraw
+import extraction
+from extraction import FakeModel, extract_receipts, extract_one, group_jobs, build_prompt
+from extraction_cache import ExtractionCache, photos_key
+
+# --- ESTRAZIONE IN PARALLELO CON FakeModel ---
+
+
+def receipt_part(text, noise=0):
+    """Foto finta di uno scontrino: blob JPEG come quelli di prepare_upload"""
+    img = Image.new("L", (240, 480), 255)
+    ImageDraw.Draw(img).text((20, 20), text, fill=0)
+    if noise:
+        a = np.asarray(img, dtype=np.int16)
+        a[-4:, -4:] = 255 - noise     # pochi pixel in un angolo: stessa sagoma, byte diversi
+        img = Image.fromarray(a.astype(np.uint8))
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=90)
+    return {"mime_type": "image/jpeg", "data": buf.getvalue()}
+
+
+def echo_model(**kw):
+    """Risponde con un numero di scontrino diverso per ogni foto (lunghezza dei byte)"""
+    return FakeModel(responder=lambda parts: {"testata": {"num_scontrino": str(len(parts[1]["data"]))}, "prodotti": []}, **kw)
+
+
+def run(model, jobs, **kw):
+    return sorted(extract_receipts(model, build_prompt([]), jobs, max_workers=4, **kw), key=lambda r: r[0])
+
+
+def test_parallel_results_per_job():
+    parts = [receipt_part(f"SCONTRINO {i}") for i in range(6)]
+    jobs = group_jobs([f"f{i}.jpg" for i in range(6)], parts)
+    model = echo_model(delay_s=0.05)
+    res = run(model, jobs)
+    assert [r[0] for r in res] == list(range(6)) and model.calls == 6
+    assert all(r[2] is None for r in res)
+    assert [r[1]["testata"]["num_scontrino"] for r in res] == [str(len(p["data"])) for p in parts]
+
+
+def test_same_receipt_is_one_job():
+    jobs = group_jobs(["a.jpg", "b.jpg"], [receipt_part("A"), receipt_part("B")], same_receipt=True)
+    assert len(jobs) == 1 and len(jobs[0][1]) == 2
+
+
+def test_cache_exact_hit_and_near_duplicate(tmp_path):
+    cache = ExtractionCache(str(tmp_path / "x.db"))
+    part = receipt_part("ESSELUNGA 12,50")
+    model = echo_model()
+    first = run(model, [("a", [part])], cache=cache)
+    assert first[0][4] is False and model.calls == 1
+
+    again = run(model, [("a", [part])], cache=cache)
+    assert again[0][4] is True and again[0][1] == first[0][1] and model.calls == 1
+
+    # Foto quasi uguale: niente dati dalla cache, solo l'avviso di possibile duplicato
+    simile = run(model, [("b", [receipt_part("ESSELUNGA 12,50", noise=60)])], cache=cache)
+    assert simile[0][4] is False and simile[0][5] is True and model.calls == 2
+
+
+def test_errors_are_reported_per_job(monkeypatch):
+    monkeypatch.setattr(extraction.time, "sleep", lambda s: None)
+    bad = FakeModel(responder=lambda parts: {"prodotti": set()})   # non serializzabile: errore a ogni tentativo
+    res = run(bad, [("a", [receipt_part("X")])], retries=2)
+    assert res[0][1] is None and isinstance(res[0][2], TypeError) and bad.calls == 3
+
+
+def test_extract_one_retries_until_valid():
+    answers = iter(["non json", '{"prodotti": []}'])
+
+    class Flaky(FakeModel):
+        def generate_content(self, parts):
+            self.calls += 1
+            return self._Response(next(answers))
+
+    model = Flaky()
+    assert extract_one(model, "p", [receipt_part("X")], retries=1, backoff_s=0) == {"prodotti": []}
+    assert model.calls == 2
+
+
+def test_latency_logged_per_photos_and_mode(tmp_path):
+    cache = ExtractionCache(str(tmp_path / "c.db"))
+    foto = photos_key([b"foto1", b"foto2"])
+    assert foto != photos_key([b"foto2", b"foto1"])
+    assert cache.log_latency(foto, "raw", 7.5) == {"raw": 7.5}
+    assert cache.log_latency(foto, "prep", 3.0) == {"raw": 7.5, "prep": 3.0}
+    assert cache.log_latency(foto, "prep") == {"raw": 7.5, "prep": 3.0}
@@ -0,0 +1,33 @@
+import numpy as np
+from geo_index import ShopGeoIndex, haversine_km, parse_coords
+
+# Milano Duomo e dintorni (~1 km, ~7 km), più Roma e un negozio senza coordinate
+SHOPS = [{"Nome": "ROMA", "Latitudine": "41.9028", "Longitudine": "12.4964"},
+         {"Nome": "SESTO", "Latitudine": "45.5356", "Longitudine": "9.2306"},
+         {"Nome": "CENTRO", "Latitudine": "45,4700", "Longitudine": "9,1900"},
+         {"Nome": "SENZA", "Latitudine": "", "Longitudine": ""}]
+DUOMO = (45.4642, 9.1900)
+
+
+def test_within_matches_brute_force_haversine():
+    idx = ShopGeoIndex(SHOPS)
+    for radius in (0.5, 2, 10, 600):
+        got = [(s["Nome"], round(km, 6)) for s, km in idx.within(*DUOMO, radius)]
+        ref = sorted((s["Nome"], round(float(haversine_km(*DUOMO, *parse_coords(s))), 6))
+                     for s in SHOPS if parse_coords(s))
+        assert got == sorted([r for r in ref if r[1] <= radius], key=lambda r: r[1])
+    assert [s["Nome"] for s, _ in idx.within(*DUOMO, 10)] == ["CENTRO", "SESTO"]
+
+
+def test_parse_coords_rejects_invalid():
+    assert parse_coords({"Latitudine": "95", "Longitudine": "9"}) is None
+    assert parse_coords({"Latitudine": "x"}) is None
+    assert np.isclose(haversine_km(0, 0, 0, 1), 111.19, atol=0.01)
+
+
+def test_shop_exactly_at_radius_along_meridian():
+    # 10 km esatti a nord (e a sud) secondo haversine: la fascia di latitudine non deve tagliarli
+    d_lat = 10 / (6371.0088 * np.pi / 180)
+    shops = [{"Nome": n, "Latitudine": DUOMO[0] + s * d_lat, "Longitudine": DUOMO[1]} for n, s in (("NORD", 1), ("SUD", -1))]
+    radius = max(float(haversine_km(*DUOMO, *parse_coords(s))) for s in shops)
+    assert sorted(s["Nome"] for s, _ in ShopGeoIndex(shops).within(*DUOMO, radius)) == ["NORD", "SUD"]
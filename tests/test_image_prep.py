@@ -0,0 +1,58 @@
+import io
+import numpy as np
+from PIL import Image, ImageDraw
+from image_prep import THUMB_SIDE, otsu_threshold, paper_bbox, prepare_image, prepare_upload, raw_upload
+
+PAPER = (300, 200, 900, 1400)       # carta nella foto (left, top, right, bottom)
+
+
+def receipt_photo():
+    """Scontrino finto: foglio chiaro con righe di testo su un tavolo scuro, con un po' di rumore"""
+    img = Image.new("L", (1200, 1600), 40)
+    d = ImageDraw.Draw(img)
+    d.rectangle([PAPER[0], PAPER[1], PAPER[2] - 1, PAPER[3] - 1], fill=235)
+    for y in range(PAPER[1] + 60, PAPER[3] - 60, 40):
+        d.rectangle([PAPER[0] + 40, y, PAPER[2] - 80, y + 12], fill=20)
+    noise = np.random.default_rng(0).integers(-10, 10, (1600, 1200))
+    return Image.fromarray(np.clip(np.asarray(img, int) + noise, 0, 255).astype(np.uint8)).convert("RGB")
+
+
+def jpeg(img):
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=95)
+    return buf.getvalue()
+
+
+def test_otsu_separates_paper_from_background():
+    a = np.asarray(receipt_photo().convert("L"))
+    t = otsu_threshold(a)
+    assert a[:PAPER[1]].max() <= t < a[PAPER[1] + 10, PAPER[0] + 10:PAPER[0] + 30].min()   # tavolo sotto, carta sopra
+    assert otsu_threshold(np.full((10, 10), 128, np.uint8)) == 128      # un solo livello: nessuna soglia sensata
+
+
+def test_receipt_is_cropped_to_the_paper():
+    box = paper_bbox(receipt_photo().convert("L"))
+    # Margine CROP_MARGIN attorno alla carta, misurato sulla sonda ridotta
+    assert all(abs(b - p) <= 60 for b, p in zip(box, PAPER))
+    assert box[0] <= PAPER[0] and box[1] <= PAPER[1] and box[2] >= PAPER[2] and box[3] >= PAPER[3]
+    out = prepare_image(receipt_photo())
+    assert out.mode == "L" and out.size == (box[2] - box[0], box[3] - box[1])
+
+
+def test_uniform_photo_is_left_unchanged():
+    img = Image.new("RGB", (1000, 1500), (250, 250, 250))
+    assert paper_bbox(img.convert("L")) is None
+    out = prepare_image(img)
+    assert out.size == img.size and np.array_equal(np.asarray(out), np.asarray(img.convert("L")))
+
+
+def test_prepare_upload_is_smaller_and_raw_upload_is_a_passthrough():
+    raw = jpeg(receipt_photo())
+    part, thumb, stats = prepare_upload(raw)
+    assert part["mime_type"] == "image/jpeg" and stats["bytes_prep"] == len(part["data"]) < len(raw)
+    assert max(thumb.size) <= THUMB_SIDE and stats["bytes_orig"] == len(raw)
+
+    img, thumb, stats = raw_upload(raw)
+    assert np.array_equal(np.asarray(img), np.asarray(Image.open(io.BytesIO(raw))))
+    assert stats == {"bytes_orig": len(raw), "bytes_prep": len(raw), "size_orig": (1200, 1600), "prep_s": 0.0}
+    assert max(thumb.size) <= THUMB_SIDE
@@ -0,0 +1,84 @@
+from collections import Counter
+from itertools import count
+import pandas as pd
+from aliases import alias_key
+from ingest import build_rows, saved_lines
+from snapshot import Snapshot, receipt_line
+from utils import sanitize_value
+
+TESTATA = {"data": "2026-01-02", "insegna": "COOP", "indirizzo": "VIA A", "num": "7"}
+CAT_BY_ID = {"P1": {"NOME_NORMALIZZATO": "LATTE PS 1L"}, "P2": {"NOME_NORMALIZZATO": "PANE"}}
+ID_BY_NAME = {"LATTE PS 1L": "P1", "PANE": "P2"}
+RIGHE = pd.DataFrame([
+    # nome grezzo, nome, marca, cat, formato, unità, prezzo, qtà, offerta, ID (alias)
+    ["latte ps", "latte ps 1l", "gran", "latte", "1", "l", "1,19", "2", "no", "P1"],
+    ["PANE", "Pane", "", "forno", "x", "kg", "2.5", "", "SI", None],
+    ["BIRRA", "BIRRA 33CL", "moretti", "bevande", "0,33", "l", "nan", "3", "no", None],
+    ["BIRRA", "BIRRA 33CL", "moretti", "bevande", "0,33", "l", "0.99", "inf", "no", None],
+    ["LATTE GRAN", "LATTE ZYMIL", "gran", "latte", "1", "l", "1.5", "1", "no", "P1"],   # alias, nome cambiato
+    ["PANE", "Pane", "", "forno", "x", "kg", "2.5", "", "SI", None],
+], columns=["nome_grezzo", "nome_normalizzato", "brand", "categoria", "formato", "unita",
+            "prezzo_unitario", "quantita_acquistata", "is_offerta", "ID"])
+
+
+def old_rows(df, t, already, new_id):
+    """Il vecchio ciclo riga per riga del salvataggio (riferimento)"""
+    already, cat, sc, new_by_name, aliases = Counter(already), [], [], {}, {}
+    num = lambda v, d: sanitize_value(_float(v, d))
+    for _, row in df.iterrows():
+        p_unit, qta = num(row["prezzo_unitario"], 0.0), num(row["quantita_acquistata"], 1.0)
+        tot = sanitize_value(p_unit * qta)
+        linea = receipt_line(row["nome_grezzo"], p_unit, qta)
+        if already[linea] > 0:
+            already[linea] -= 1
+            continue
+        name = str(row["nome_normalizzato"]).upper().strip()
+        alias_id = str(row["ID"]).strip() if pd.notna(row.get("ID")) else ""
+        pid = alias_id if alias_id and str(CAT_BY_ID.get(alias_id, {}).get("NOME_NORMALIZZATO", "")) == name else None
+        pid = pid or ID_BY_NAME.get(name) or new_by_name.get(name)
+        if not pid:
+            pid = new_by_name[name] = new_id()
+            fmt = _float(row["formato"], None)   # formato illeggibile: vuoto, non 1
+            cat.append([pid, name, str(row["brand"]).upper().strip(), str(row["categoria"]).upper().strip(),
+                        "" if fmt is None else sanitize_value(fmt), str(row["unita"]).upper().strip()])
+        aliases[alias_key(row["nome_grezzo"], t["insegna"])] = pid
+        sc.append([t["data"], t["insegna"], t["indirizzo"], str(row["nome_grezzo"]).upper(), tot, 0, p_unit,
+                   str(row["is_offerta"]).upper(), qta, "SI", pid, t["num"]])
+    return cat, sc, aliases
+
+
+def _float(v, default):
+    try: return float(str(v).replace(",", "."))
+    except: return default
+
+
+def ids():
+    c = count(1)
+    return lambda: f"N{next(c)}"
+
+
+def test_build_rows_matches_old_per_row_loop():
+    for already in (Counter(), Counter({("PANE", 2.5, 1.0): 1, ("BIRRA", 0.0, 3.0): 5})):
+        res = build_rows(RIGHE, TESTATA, ID_BY_NAME, CAT_BY_ID, already=already, new_id=ids())
+        cat, sc, aliases = old_rows(RIGHE, TESTATA, already, ids())
+        assert (res.rows_catalogo, res.rows_scontrini, res.aliases) == (cat, sc, aliases)
+        assert res.skipped == len(RIGHE) - len(sc)
+
+
+def test_resaved_receipt_only_adds_new_lines(tmp_path, sheet):
+    # Primo salvataggio: metà delle righe è già sul foglio, il resto ancora in coda
+    first = build_rows(RIGHE, TESTATA, ID_BY_NAME, CAT_BY_ID, new_id=ids()).rows_scontrini
+    header = ["Data", "Negozio", "Indirizzo", "Nome_Grezzo", "Totale", "Sconto", "Prezzo_Unitario",
+              "In_Offerta", "Quantita", "Confermato", "ID_PRODOTTO", "Num_Scontrino"]
+    ws = sheet("Scontrini", header, first[:3])
+    snap = Snapshot(str(tmp_path / "snap.db"))
+    snap.sync(ws, "Scontrini")
+    gia = saved_lines(snap, first[3:], TESTATA["data"], "coop", "via a", TESTATA["num"])
+    assert sum(gia.values()) == len(first)
+
+    # Stesso scontrino ricaricato con una riga in più: passa solo quella
+    extra = RIGHE.iloc[[0]].assign(nome_grezzo="UOVA", nome_normalizzato="UOVA X6", ID=None)
+    res = build_rows(pd.concat([RIGHE, extra]), TESTATA, ID_BY_NAME, CAT_BY_ID, already=gia, new_id=ids())
+    assert [r[3] for r in res.rows_scontrini] == ["UOVA"] and res.skipped == len(RIGHE)
+    # Altro numero di scontrino: niente da saltare
+    assert saved_lines(snap, first[3:], TESTATA["data"], "COOP", "VIA A", "8") == Counter()
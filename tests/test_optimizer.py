@@ -0,0 +1,84 @@
+from itertools import combinations
+import numpy as np
+import pytest
+import optimizer
+
+# --- best_combo contro il vecchio loop su itertools.combinations ---
+# Prezzi interi (centesimi): le somme sono esatte, quindi anche gli spareggi devono coincidere.
+
+
+def old_loop(P, k, candidates):
+    """Il loop che best_combo ha sostituito: primo punteggio strettamente migliore in ordine itertools"""
+    best, best_total = None, float('inf')
+    for combo in combinations(candidates, k):
+        tot, missing = 0, 0
+        for i in range(P.shape[0]):
+            min_p = min((P[i, j] for j in combo if np.isfinite(P[i, j])), default=None)
+            if min_p is None: missing += 1
+            else: tot += min_p
+        score = missing * optimizer.MISSING_PENALTY + tot
+        if score < best_total: best, best_total = combo, score
+    return best, best_total
+
+
+def random_case(rng):
+    items, shops = rng.integers(1, 9), rng.integers(2, 11)
+    P = rng.integers(50, 400, size=(items, shops)).astype(float)
+    P[rng.random(P.shape) < rng.uniform(0.1, 0.7)] = np.inf
+    if rng.random() < 0.3: P[:, rng.integers(shops)] = P[:, 0]   # negozi identici: spareggi
+    cand = sorted(rng.choice(shops, size=rng.integers(1, shops + 1), replace=False).tolist())
+    return P, int(rng.integers(1, min(len(cand), optimizer.MAX_STOPS) + 1)), cand
+
+
+@pytest.mark.parametrize("seed", range(6))
+def test_best_combo_matches_combinations_loop(seed):
+    rng = np.random.default_rng(seed)
+    for _ in range(500):
+        P, k, cand = random_case(rng)
+        combo, score = optimizer.best_combo(P, k, cand)
+        ref, ref_score = old_loop(P, k, cand)
+        assert combo == ref and score == ref_score
+
+
+def test_best_combo_with_travel_matches_brute_force():
+    rng = np.random.default_rng(42)
+    for _ in range(200):
+        P, k, cand = random_case(rng)
+        pts = rng.uniform(0, 20, size=(P.shape[1] + 1, 2))
+        D = np.linalg.norm(pts[:, None] - pts[None], axis=2)
+        combo, score = optimizer.best_combo(P, k, cand, travel=(D, 0.3))
+        ref = min(optimizer.plan_scores(P[:, list(c)].min(axis=1)) + 0.3 * optimizer.tour_length(D, [j + 1 for j in c])
+                  for c in combinations(cand, k))
+        assert score == pytest.approx(ref, abs=1e-6)
+
+
+def test_too_few_candidates():
+    assert optimizer.best_combo(np.ones((2, 3)), 3, [0, 1]) == (None, float('inf'))
+
+
+def test_travel_candidates_keeps_cheapest_shop_per_item():
+    rng = np.random.default_rng(0)
+    P = rng.uniform(1, 5, size=(6, 80))
+    P[3, 57] = 0.1      # unico negozio molto conveniente per l'articolo 3
+    D = np.zeros((81, 81))
+    cand = optimizer.travel_candidates(P, range(80), D, 0.3, n=10)
+    assert len(cand) == 10 and cand == sorted(cand) and 57 in cand
+    assert optimizer.travel_candidates(P, [5, 2], D, 0.3) == [2, 5]
+
+
+def test_pool_candidates_caps_large_searches():
+    rng = np.random.default_rng(3)
+    P = rng.uniform(1, 5, size=(8, 120))
+    P[5, 99] = 0.1
+    pool = optimizer.pool_candidates(P, range(120))
+    assert len(pool) == optimizer.EXACT_MAX_SHOPS and 99 in pool
+    combo, score = optimizer.best_combo(P, 5, pool)
+    assert 99 in combo and score <= optimizer.greedy(P, 5)[0] + 1e-9
+
+
+def test_best_any_pays_for_each_extra_stop():
+    # La seconda tappa fa risparmiare 2 € ma allunga il giro da 2 a 11 km
+    P = np.array([[1.0, 3.0], [3.0, 1.0]])
+    D = np.array([[0, 1, 5], [1, 0, 5], [5, 5, 0]], dtype=float)
+    assert optimizer.best_any(P, travel=(D, 0.5)) == ((0,), pytest.approx(4.0 + 0.5 * 2))
+    assert optimizer.best_any(P, travel=(D, 0.01))[0] == (0, 1)
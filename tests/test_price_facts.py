@@ -0,0 +1,54 @@
+import threading
+import price_facts
+from snapshot import Snapshot
+
+# --- PRICE FACTS: RIGHE NUOVE, ORFANE E CHIAMATE CONCORRENTI ---
+
+S_HEADER = ["Data", "Negozio", "Indirizzo", "In_Offerta", "Prezzo_Unitario", "ID_PRODOTTO"]
+C_HEADER = ["ID_PRODOTTO", "NOME_NORMALIZZATO", "BRAND", "CATEGORIA", "FORMATO", "UNITA"]
+
+
+def riga(pid, prezzo="1.0"):
+    return ["2026-01-02", "COOP", "VIA A", "NO", prezzo, pid]
+
+
+def synced(snap, s, c):
+    snap.sync(s, "Scontrini", force=True)
+    snap.sync(c, "Catalogo", force=True)
+
+
+def test_incremental_rows_and_orphans(sheet, tmp_path):
+    s = sheet("Scontrini", S_HEADER, [riga("A"), riga("B")])
+    c = sheet("Catalogo", C_HEADER, [["A", "LATTE 1L", "X", "LATTE", "1", "L"]])
+    snap = Snapshot(str(tmp_path / "snap.db"))
+    synced(snap, s, c)
+    assert price_facts.materialize(snap)["ID_PRODOTTO"].tolist() == ["A"]
+
+    # B arriva nel Catalogo dopo la sua riga: l'orfana entra al giro successivo, senza rifare le altre
+    s.append_rows([riga("A", "1.2")])
+    c.append_rows([["B", "PANE 1KG", "Y", "PANE", "1", "KG"]])
+    synced(snap, s, c)
+    f = price_facts.materialize(snap)
+    assert sorted(zip(f["_src"], f["ID_PRODOTTO"])) == [(1, "A"), (2, "B"), (3, "A")]
+
+
+def test_concurrent_materialize_adds_each_row_once(sheet, tmp_path):
+    s = sheet("Scontrini", S_HEADER, [riga("A")])
+    c = sheet("Catalogo", C_HEADER, [["A", "LATTE 1L", "X", "LATTE", "1", "L"]])
+    path = str(tmp_path / "snap.db")
+    synced(Snapshot(path), s, c)
+    price_facts.materialize(Snapshot(path))
+
+    s.append_rows([riga("A", str(1 + i / 100)) for i in range(200)])
+    synced(Snapshot(path), s, c)
+    start = threading.Barrier(4)
+
+    def run():
+        start.wait()
+        price_facts.materialize(Snapshot(path))     # ogni sessione con il suo oggetto, stesso file
+
+    threads = [threading.Thread(target=run) for _ in range(4)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    f = price_facts.materialize(Snapshot(path))
+    assert len(f) == 201 and f["_src"].is_unique
@@ -0,0 +1,30 @@
+import pandas as pd
+import pytest
+from price_history import PriceHistory
+
+FACTS = pd.DataFrame({
+    "ID_PRODOTTO": ["A", "A", "A", "B", "A", "A"],
+    "SHOP_ID": ["COOP", "COOP", "LIDL", "COOP", "COOP", "COOP"],
+    "Data": ["2026-01-05", "2026-01-03", "2026-01-04", "2026-01-04", "05/01/2026", "illeggibile"],
+    "Prezzo_Unitario": [1.5, 1.2, 2.0, 3.0, 1.1, 9.9],
+    "In_Offerta": ["NO", "NO", "NO", "NO", "SI", "NO"],
+})
+
+
+def test_current_is_last_observation_per_pair_in_upload_order():
+    h = PriceHistory(FACTS)
+    cur = h.current()
+    # A/COOP: due osservazioni il 5 gennaio, vince l'ultima caricata; data illeggibile = la più vecchia
+    assert list(zip(cur["ID_PRODOTTO"], cur["SHOP_ID"], cur["Prezzo_Unitario"])) == [
+        ("A", "LIDL", 2.0), ("B", "COOP", 3.0), ("A", "COOP", 1.1)]
+    assert h.latest("A", "COOP") == ("2026-01-05", 1.1, True) and h.latest("B", "LIDL") is None
+    assert len(h) == 3 and h.current() is cur
+
+
+def test_window_median_and_trend():
+    h = PriceHistory(FACTS)
+    assert h.median("A", "COOP", days=3, today="2026-01-05") == pytest.approx(1.2)
+    assert h.median("A", "COOP", days=1, today="2026-01-02") is None
+    assert h.trend("A", "COOP", days=10, today="2026-01-05") == pytest.approx(1.5)   # €/30 giorni
+    assert h.trend("A", "LIDL") is None
+    assert PriceHistory(FACTS.iloc[:0]).current().empty
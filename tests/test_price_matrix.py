@@ -0,0 +1,35 @@
+import numpy as np
+import pandas as pd
+from price_matrix import build_price_matrix
+from search_index import TokenIndex
+
+CATALOGO = pd.DataFrame({"ID_PRODOTTO": ["P1", "P2", "P3", "P4"],
+                         "NOME_NORMALIZZATO": ["LATTE INTERO 1L", "LATTE PS 1L", "PANE", "BIRRA 33CL"]})
+SHOPS = ["COOP - VIA A", "LIDL - VIA B", "DIA - VIA C"]
+
+
+def facts(seed, n=60):
+    rng = np.random.default_rng(seed)
+    pid = rng.choice(CATALOGO["ID_PRODOTTO"], n)
+    return pd.DataFrame({"ID_PRODOTTO": pid, "SHOP_ID": rng.choice(SHOPS + ["ALTRO - VIA D"], n),
+                         "Prezzo_Unitario": rng.integers(50, 300, n) / 100,
+                         "NOME_NORMALIZZATO": CATALOGO.set_index("ID_PRODOTTO").loc[pid, "NOME_NORMALIZZATO"].to_numpy(),
+                         "UNITA_STD": "L"})
+
+
+def test_matches_old_per_cell_filtering():
+    index = TokenIndex(CATALOGO)
+    items = ["LATTE", "PANE", "GELATO", "LATTE"]
+    for seed in range(5):
+        df = facts(seed)
+        pm = build_price_matrix(df, items, SHOPS, index)
+        # Vecchio ciclo: per articolo e negozio la prima riga col prezzo minimo
+        for i, item in enumerate(items):
+            df_item = df[df["ID_PRODOTTO"].isin(index.search(item))]
+            for shop in SHOPS:
+                sub = df_item[df_item["SHOP_ID"] == shop]
+                exp = None if sub.empty else tuple(sub.loc[sub["Prezzo_Unitario"].idxmin(), ["Prezzo_Unitario", "NOME_NORMALIZZATO"]])
+                assert pm.entry(i, shop) == exp
+        totals, found = pm.shop_totals()
+        assert found.tolist() == [sum(pm.entry(i, s) is not None for i in range(len(items))) for s in SHOPS]
+        assert pm.take(["PANE"]).prices.tolist() == [pm.prices[1].tolist()]
@@ -0,0 +1,68 @@
+import pytest
+import streamlit as st
+import resources
+
+
+class Table:
+    def __init__(self, name, ok):
+        self.name, self.ok = name, ok
+
+    def row_values(self, i):
+        if not self.ok["catalogo"]: raise ConnectionError("handle scaduto")
+        return ["ID_PRODOTTO", "Nome"]
+
+    def get_all_records(self):
+        return [{"Negozio": "COOP", "Indirizzo": "VIA A", "Lat": "45.0", "Lon": "9.0"}]
+
+
+class Backend:
+    def __init__(self):
+        self.ok = {"catalogo": True}
+
+    def table(self, name):
+        return Table(name, self.ok)
+
+
+@pytest.fixture
+def opened(monkeypatch):
+    """open_backend finto: fallisce alla prima apertura, poi restituisce backend nuovi"""
+    calls = []
+    def open_backend(kind, google_info=None):
+        calls.append(kind)
+        if len(calls) == 1: raise ConnectionError("rete giù")
+        return Backend()
+    monkeypatch.setattr(resources, "open_backend", open_backend)
+    monkeypatch.setattr(st, "secrets", {})
+    resources.reconnect()
+    monkeypatch.setitem(resources._health, "checked_at", 0.0)
+    yield calls
+    resources.reconnect()
+
+
+def test_failed_open_is_retried_after_reconnect(opened):
+    with pytest.raises(ConnectionError): resources.get_tables()
+    resources.reconnect()
+    tables = resources.get_tables()
+    assert len(opened) == 2 and tables["catalogo"].name == "Catalogo"
+    # Handle sano e controllo recente: stesso oggetto, nessuna nuova apertura
+    assert resources.get_tables() is tables and len(opened) == 2
+
+
+def test_stale_handle_is_replaced_on_health_check(opened, monkeypatch):
+    with pytest.raises(ConnectionError): resources.get_tables()
+    resources.reconnect()
+    vecchie = resources.get_tables()
+    vecchie["catalogo"].ok["catalogo"] = False
+    monkeypatch.setattr(resources, "RESOURCE_HEALTH_S", 0)
+    nuove = resources.get_tables()
+    assert nuove is not vecchie and len(opened) == 3
+    assert resources.healthy(nuove) and not resources.healthy(vecchie)
+
+
+def test_reconnect_drops_the_cached_shop_registry(opened):
+    with pytest.raises(ConnectionError): resources.get_tables()
+    resources.reconnect()
+    reg = resources.get_shop_registry()
+    assert resources.get_shop_registry() is reg
+    resources.reconnect()
+    assert resources.get_shop_registry() is not reg and len(opened) == 3
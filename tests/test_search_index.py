@@ -0,0 +1,22 @@
+import pandas as pd
+from search_index import TokenIndex
+
+CATALOGO = pd.DataFrame({
+    "ID_PRODOTTO": ["P1", "P2", "P3", ""],
+    "NOME_NORMALIZZATO": ["LATTE GRANAROLO PS 1L", "LATTE PARMALAT ZYMIL", "YOGURT GRANAROLO BIANCO", "SENZA ID"],
+    "BRAND": ["GRANAROLO", "PARMALAT", "GRANAROLO", ""],
+    "CATEGORIA": ["LATTICINI", "LATTICINI", "YOGURT", ""],
+})
+
+
+def test_and_of_token_prefixes():
+    idx = TokenIndex(CATALOGO)
+    assert idx.search("latte") == {"P1", "P2"}
+    assert idx.search("GRAN") == {"P1", "P3"}
+    assert idx.search("gran lat") == {"P1"}            # LAT = LATTE o LATTICINI, e GRANAROLO
+    assert idx.search("zymil granarolo") == set()
+    assert idx.search("  ") == set() and idx.search("SENZA") == set()
+
+
+def test_empty_catalog():
+    assert TokenIndex(pd.DataFrame()).search("LATTE") == set()
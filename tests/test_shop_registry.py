@@ -0,0 +1,18 @@
+from shop_registry import ShopRegistry, ADDR_COL
+
+RECORDS = [
+    {"Insegna_Standard": "COOP", "P_IVA": "123", ADDR_COL: "Via Roma, 1 - Milano", "Latitudine": "45.47", "Longitudine": "9.19"},
+    {"Insegna_Standard": "COOP BIS", "P_IVA": "00000000123", ADDR_COL: "VIA ROMA 1 MILANO", "Latitudine": "", "Longitudine": ""},
+    {"Insegna_Standard": "LIDL", "P_IVA": "", ADDR_COL: "Corso Como 5", "Latitudine": "91", "Longitudine": "9"},
+]
+
+
+def test_lookups_by_normalized_address_and_piva():
+    reg = ShopRegistry(RECORDS)
+    # Primo record vince, come la vecchia scansione della lista
+    assert reg.find_by_addr("via roma 1, milano")["Insegna_Standard"] == "COOP"
+    assert reg.find_by_piva("IT 123")["Insegna_Standard"] == "COOP"
+    assert reg.find_by_piva("") is None and reg.find_by_addr("Via Verdi") is None
+    assert reg.point("VIA ROMA 1 - MILANO") == (45.47, 9.19)
+    assert reg.point("corso como 5") is None          # latitudine non valida
+    assert reg.addrs_within(45.47, 9.19, 1) == {"VIAROMA1MILANO"}
@@ -0,0 +1,58 @@
+from collections import Counter
+from ingest import saved_lines
+from snapshot import Snapshot
+from utils import scontrini_cols
+
+# Colonne in ordine diverso da quello di build_rows: contano i nomi dell'intestazione
+MOVED = ["Num_Scontrino", "Data", "Negozio", "Indirizzo", "ID_PRODOTTO", "Nome_Grezzo", "Quantita", "Prezzo_Unitario"]
+
+
+def test_scontrini_cols_by_name_then_position():
+    assert scontrini_cols()["num"] == 11 and scontrini_cols()["id"] == 10
+    c = scontrini_cols(MOVED)
+    assert (c["num"], c["nome_grezzo"], c["prezzo"], c["quantita"], c["id"]) == (0, 5, 7, 6, 4)
+
+
+def test_receipt_index_follows_header_names(tmp_path, sheet):
+    ws = sheet("Scontrini", MOVED, [["7", "2026-01-02", "COOP", "VIA A", "P1", "LATTE PS", "2", "1.10"]])
+    snap = Snapshot(str(tmp_path / "snap.db"))
+    snap.sync(ws, "Scontrini", force=True)
+    assert snap.receipt_lines("2026-01-02", "COOP", "VIA A", "7") == [("LATTE PS", 1.1, 2.0)]
+    # Righe ancora in coda: layout di build_rows
+    pending = [["2026-01-02", "COOP", "VIA A", "PANE", 1.5, 0, 1.5, "NO", 1.0, "SI", "P2", "7"]]
+    assert saved_lines(snap, pending, "2026-01-02", "COOP", "VIA A", "7") == Counter(
+        {("LATTE PS", 1.1, 2.0): 1, ("PANE", 1.5, 1.0): 1})
+
+
+HEADER = ["Data", "Negozio", "Indirizzo", "Prodotto", "Prezzo_Unitario", "x", "y", "z", "Quantita", "w", "ID_PRODOTTO", "Num_Scontrino"]
+
+
+def riga(data, prodotto, pid, num="1"):
+    return [data, "COOP", "VIA A", prodotto, "1,50", 0, 1.5, "NO", 1, "SI", pid, num]
+
+
+def test_sync_appends_new_rows_and_rebuilds_after_edits(tmp_path, sheet):
+    ws = sheet("Scontrini", HEADER, [riga("2026-01-02", "LATTE", "P1"), riga("2026-01-02", "PANE", "P2")])
+    snap = Snapshot(str(tmp_path / "snap.db"), max_age_s=3600)
+    assert snap.sync(ws, "Scontrini") == 2
+    gen = snap.meta("Scontrini")["generation"]
+    assert snap.frame("Scontrini")["Prezzo_Unitario"].tolist() == [1.5, 1.5]
+
+    # Entro max_age_s nessuna lettura remota; forzato scarica solo la coda
+    ws.append_row(riga("2026-01-03", "BIRRA", "P3", "2"))
+    assert snap.sync(ws, "Scontrini") == 0
+    assert snap.sync(ws, "Scontrini", force=True) == 1
+    assert snap.meta("Scontrini")["generation"] == gen and len(snap.frame("Scontrini")) == 3
+    assert snap.receipt_lines("2026-01-03", "COOP", "VIA A", "2") == [("BIRRA", 1.5, 1.0)]
+
+    # Rimappa di un ID in mezzo al foglio (stesso numero di righe): ricostruzione completa
+    ws.batch_update([{"range": "K2", "values": [["P9"]]}])
+    v = snap.version()
+    assert snap.sync(ws, "Scontrini", force=True) == 3
+    assert snap.meta("Scontrini")["generation"] == gen + 1 and snap.version() != v
+    assert snap.frame("Scontrini")["ID_PRODOTTO"].tolist() == ["P9", "P2", "P3"]
+
+    # Righe cancellate: ricostruzione, indice scontrini compreso
+    ws.delete_rows(4)
+    assert snap.sync(ws, "Scontrini", force=True) == 2
+    assert snap.receipt_lines("2026-01-03", "COOP", "VIA A", "2") == []
@@ -0,0 +1,74 @@
+import pandas as pd
+import pytest
+import storage
+import clean_db
+import price_facts
+from price_history import PriceHistory
+from snapshot import Snapshot
+
+# --- BACKEND SQLITE: STESSA INTERFACCIA DEI WORKSHEET, SENZA RETE ---
+
+HEADER = ["Data", "Negozio", "Indirizzo", "Prodotto", "Prezzo_Unitario"]
+
+
+def filled(backend, rows, name="Scontrini"):
+    t = backend.table(name)
+    t.append_row(HEADER)
+    t.append_rows(rows)
+    return t
+
+
+def test_reads_like_gspread(backend):
+    t = filled(backend, [["2026-01-02", "COOP", "VIA A", "LATTE", "1.5"], ["2026-01-03", "COOP", "", "", ""]])
+    assert t.row_values(1) == HEADER and t.row_values(3) == ["2026-01-03", "COOP"]
+    assert t.col_values(3) == ["Indirizzo", "VIA A"]
+    assert t.get("B2:C3") == [["COOP", "VIA A"], ["COOP"]]
+    assert t.get_all_values()[2] == ["2026-01-03", "COOP", "", "", ""]
+    assert t.get_all_records()[0]["Prezzo_Unitario"] == 1.5
+
+
+def test_batch_update_and_delete_rows(backend):
+    t = filled(backend, [[f"2026-01-0{i}", "COOP", "VIA A", f"P{i}", "1"] for i in range(1, 7)])
+    t.batch_update([{"range": "D3", "values": [["NUOVO"]]}, {"range": "F1", "values": [["ID_PRODOTTO"]]}])
+    assert t.row_values(3)[3] == "NUOVO" and t.row_values(1)[-1] == "ID_PRODOTTO"
+    t.delete_rows(2, 3)
+    assert [r[3] for r in t.get_all_values()[1:]] == ["P3", "P4", "P5", "P6"]
+    # Come clean_db: richieste deleteDimension dal basso verso l'alto in una sola batch_update
+    clean_db.delete_rows_batched(t, [5, 2])
+    assert [r[3] for r in t.get_all_values()[1:]] == ["P4", "P5"]
+    t.append_row(["2026-01-09", "COOP", "VIA A", "P9", "1"])
+    assert t.row_values(4)[3] == "P9"
+
+
+def test_migrate_between_backends(backend, tmp_path):
+    filled(backend, [["2026-01-02", "COOP", "VIA A", "LATTE", "1.5"]])
+    dst = storage.SQLiteBackend(str(tmp_path / "dst.sqlite"))
+    assert storage.migrate(backend, dst, tables=["Scontrini"]) == {"Scontrini": 1}
+    assert dst.table("Scontrini").get_all_values() == backend.table("Scontrini").get_all_values()
+    with pytest.raises(RuntimeError): storage.migrate(backend, dst, tables=["Scontrini"])
+
+
+def test_clean_db_on_sqlite_backend(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, "STORAGE_BACKEND", "sqlite")
+    monkeypatch.setattr(storage, "STORAGE_SQLITE_PATH", str(tmp_path / "db.sqlite"))
+    riga = ["2026-01-02", "COOP", "VIA A", "LATTE", "1.5"]
+    t = filled(storage.open_backend(), [riga, ["2026-01-02", "COOP", "VIA A", "PANE", "2"], riga])
+    clean_db.run_cleanup(store=clean_db.FingerprintStore(str(tmp_path / "fp.db")))
+    assert [r[3] for r in t.get_all_values()[1:]] == ["LATTE", "PANE"]
+
+
+def test_latest_facts_match_price_history(sheet, tmp_path):
+    s = sheet("Scontrini", ["Data", "Negozio", "Indirizzo", "In_Offerta", "Prezzo_Unitario", "ID_PRODOTTO"],
+              [["2026-01-05", "COOP", "VIA A", "NO", "1.5", "A"], ["2026-01-03", "COOP", "VIA A", "NO", "1.2", "A"],
+               ["05/01/2026", "COOP", "VIA A", "SI", "1.1", "A"], ["2026-01-04", "DIMAR", "VIA B", "NO", "2", "A"],
+               ["2026-01-04", "COOP", "VIA A", "NO", "3", "B"]])
+    c = sheet("Catalogo", ["ID_PRODOTTO", "NOME_NORMALIZZATO", "BRAND", "CATEGORIA", "FORMATO", "UNITA"],
+              [["A", "LATTE 1L", "X", "LATTE", "1", "L"], ["B", "PANE 500G", "Y", "PANE", "0.5", "KG"]])
+    snap = Snapshot(str(tmp_path / "snap.db"))
+    snap.sync(s, "Scontrini")
+    snap.sync(c, "Catalogo")
+    cur = PriceHistory(price_facts.materialize(snap)).current()
+    got = price_facts.latest(snap, {"A"})
+    assert got["Prezzo_Unitario"].tolist() == pytest.approx([1.1, 2.0])
+    exp = cur[cur["ID_PRODOTTO"] == "A"].reset_index(drop=True)
+    pd.testing.assert_frame_equal(got[exp.columns].astype(str), exp.astype(str))
@@ -0,0 +1,31 @@
+import pytest
+from units import normalize
+
+
+def test_formato_wins_when_name_agrees_or_is_silent_on_size():
+    assert normalize("500", "G", "PASTA PENNE 500G") == (pytest.approx(0.5), "KG", True)
+    assert normalize("0,75", "L", "VINO ROSSO") == (pytest.approx(0.75), "L", True)
+
+
+def test_pack_in_name_beats_single_piece_formato():
+    # FORMATO riporta la bottiglia, il prezzo è della confezione da 6
+    assert normalize("1.5", "L", "ACQUA 6X1.5L") == (pytest.approx(9.0), "L", True)
+    assert normalize("9", "L", "ACQUA 6X1.5L") == (pytest.approx(9.0), "L", True)
+
+
+def test_name_formato_conflict_is_not_valid():
+    assert normalize("0.75", "KG", "CAFFE 500G")[2] is False
+
+
+def test_formato_one_is_a_real_size():
+    assert normalize(1, "PZ", "ANANAS") == (1.0, "PZ", True)
+    assert normalize("1", "L", "LATTE INTERO GRANAROLO") == (1.0, "L", True)
+    assert normalize(1, "KG", "ZUCCHERO SEMOLATO") == (1.0, "KG", True)
+    # Righe vecchie: 1 scritto al posto di un formato illeggibile, il nome dice altro
+    assert normalize("1", "KG", "ZUCCHERO 500G") == (pytest.approx(0.5), "KG", True)
+
+
+def test_blank_formato_without_size_in_name_is_not_valid():
+    assert normalize("", "KG", "BANANE")[2] is False
+    assert normalize(None, "KG", "BANANE")[2] is False
+    assert normalize("", "L", "LATTE 1L") == (1.0, "L", True)
@@ -0,0 +1,57 @@
+import pytest
+import write_queue
+from write_queue import WriteQueue
+
+
+class Sheet:
+    """Worksheet finto: registra le righe accodate; on_append viene chiamata durante la scrittura"""
+    def __init__(self, on_append=None):
+        self.rows, self.on_append = [], on_append
+
+    def append_rows(self, rows, value_input_option=None):
+        if self.on_append: self.on_append()
+        self.rows += rows
+
+
+def test_rows_leased_by_a_running_flush_are_not_written_twice(tmp_path):
+    q = WriteQueue(str(tmp_path / "q.db"))
+    q.enqueue([("Scontrini", [["A"], ["B"]])])
+    other = Sheet()
+    # Un secondo processo prova a svuotare la coda mentre il primo sta scrivendo
+    first = Sheet(on_append=lambda: q.flush({"Scontrini": other}))
+    assert q.flush({"Scontrini": first}) == 2
+    assert first.rows == [["A"], ["B"]] and other.rows == [] and q.depth()[0] == 0
+
+
+def test_rows_survive_a_crash_mid_flush(tmp_path, monkeypatch):
+    q = WriteQueue(str(tmp_path / "q.db"))
+    q.enqueue([("Scontrini", [["A"]]), ("Catalogo", [["P1"]])])
+
+    # Errore durante append_rows: prenotazione rilasciata, righe ancora in coda
+    def boom(): raise RuntimeError("429")
+    with pytest.raises(RuntimeError):
+        q.flush({"Scontrini": Sheet(on_append=boom), "Catalogo": Sheet()})
+    assert q.depth()[0] == 2
+
+    # Processo morto a metà: la prenotazione resta, nessuno la scrive finché non scade
+    with q.connect() as conn:
+        conn.execute("UPDATE pending SET owner = 'morto', lease_until = ? WHERE tbl = 'Scontrini'",
+                     (write_queue.time.time() + write_queue.FLUSH_LEASE_S,))
+    sc, cat = Sheet(), Sheet()
+    assert q.flush({"Scontrini": sc, "Catalogo": cat}) == 1 and cat.rows == [["P1"]] and sc.rows == []
+    now = write_queue.time.time()
+    monkeypatch.setattr(write_queue.time, "time", lambda: now + write_queue.FLUSH_LEASE_S + 1)
+    assert q.flush({"Scontrini": sc, "Catalogo": cat}) == 1
+    assert sc.rows == [["A"]] and cat.rows == [["P1"]] and q.depth()[0] == 0
+
+
+def test_failed_connection_releases_the_lease(tmp_path):
+    q = WriteQueue(str(tmp_path / "q.db"))
+    q.enqueue([("Scontrini", [["A"]])])
+
+    def no_sheets(): raise ConnectionError("auth")
+    with pytest.raises(ConnectionError):
+        q.flush(no_sheets)
+    # Nessuna attesa di FLUSH_LEASE_S: il tentativo successivo scrive subito
+    sc = Sheet()
+    assert q.flush(lambda: {"Scontrini": sc}) == 1 and sc.rows == [["A"]]
@@ -0,0 +1,72 @@
+import re
+import math
+
+# --- NORMALIZZAZIONE UNITÀ DI MISURA ---
+# Ogni prodotto del catalogo viene ricondotto a una quantità in unità canoniche (KG, L, PZ),
+# così il prezzo di una confezione diventa €/KG, €/L o €/PZ confrontabile fra marche e
+# formati. Fonti, in ordine: FORMATO + UNITA del catalogo; quantità scritta nel nome
+# ("500G", "6X1.5L", "4 X 125 G") quando FORMATO manca (build_rows lo lascia vuoto se
+# non è un numero) o vale 1 e il nome dice altro nella stessa unità (righe vecchie, che
+# scrivevano 1 al posto di un formato illeggibile). Se nome e FORMATO non tornano vale il
+# totale della confezione quando FORMATO è il singolo pezzo ("6X1.5L" con 1.5), altrimenti
+# il flag è False. Se nessuna fonte è affidabile il prodotto resta fuori dai confronti per unità.
+
+# unità scritta -> (unità canonica, fattore)
+UNIT_ALIASES = {
+    "KG": ("KG", 1.0), "KILO": ("KG", 1.0), "KGR": ("KG", 1.0), "HG": ("KG", 0.1),
+    "G": ("KG", 0.001), "GR": ("KG", 0.001), "GRAMMI": ("KG", 0.001),
+    "L": ("L", 1.0), "LT": ("L", 1.0), "LITRI": ("L", 1.0), "LITRO": ("L", 1.0),
+    "DL": ("L", 0.1), "CL": ("L", 0.01), "ML": ("L", 0.001),
+    "PZ": ("PZ", 1.0), "PEZZI": ("PZ", 1.0), "N": ("PZ", 1.0), "NR": ("PZ", 1.0), "CONF": ("PZ", 1.0),
+}
+GRAMS_AS_KG = 50      # KG/L con formato >= 50 sono quasi sempre grammi/ml scritti nell'unità sbagliata
+_NUM = r"(\d+(?:[.,]\d+)?)"
+_UNIT = r"(KG|KGR|HG|GR|G|LT|L|DL|CL|ML|PZ)"
+NAME_PACK = re.compile(rf"\b(\d+)\s*X\s*{_NUM}\s*{_UNIT}\b")
+NAME_QTY = re.compile(rf"(?<![\d.,]){_NUM}\s*{_UNIT}\b")
+
+
+def _num(s):
+    return float(s.replace(",", "."))
+
+
+def _name_sizes(nome):
+    """(totale, unità canonica, singolo pezzo) scritti nel nome; singolo è None se non è una confezione multipla"""
+    s = str(nome).upper()
+    m = NAME_PACK.search(s)
+    if m:
+        unit, k = UNIT_ALIASES[m.group(3)]
+        single = _num(m.group(2)) * k
+        return int(m.group(1)) * single, unit, single
+    found = {(round(_num(q) * UNIT_ALIASES[u][1], 6), UNIT_ALIASES[u][0]) for q, u in NAME_QTY.findall(s)}
+    return (*found.pop(), None) if len(found) == 1 else None
+
+
+def name_quantity(nome):
+    """(quantità, unità canonica) scritta nel nome del prodotto, None se assente o ambigua"""
+    sizes = _name_sizes(nome)
+    return sizes[:2] if sizes else None
+
+
+def _same(a, b):
+    return math.isclose(a, b, rel_tol=0.01)
+
+
+def normalize(formato, unita, nome=""):
+    """(quantità in unità canonica, unità canonica, valido) per un prodotto del catalogo"""
+    unit, k = UNIT_ALIASES.get(str(unita).strip().upper().rstrip("."), (None, 1.0))
+    try: fmt = float(str(formato).replace(",", "."))
+    except: fmt = None
+    if fmt is not None and (math.isnan(fmt) or fmt <= 0): fmt = None
+    if fmt is not None and unit in ("KG", "L") and k == 1.0 and fmt >= GRAMS_AS_KG: fmt *= 0.001
+
+    dal_nome = _name_sizes(nome)
+    if unit is None or fmt is None or (fmt == 1.0 and dal_nome and dal_nome[1] == unit):
+        # FORMATO assente (o 1 contraddetto dal nome): conta solo la taglia scritta nel nome
+        if dal_nome: return dal_nome[0], dal_nome[1], dal_nome[0] > 0
+        return (fmt or 1.0) * k, unit or "", False
+    qty = fmt * k
+    if not dal_nome or dal_nome[1] != unit or _same(qty, dal_nome[0]): return qty, unit, True
+    total, _, single = dal_nome
+    if single is not None and _same(qty, single): return total, unit, True   # FORMATO = un pezzo della confezione
+    return qty, unit, False
@@ -0,0 +1,86 @@
+import re
+import math
+import uuid
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime
+
+# --- FUNZIONI DI PULIZIA CONDIVISE (app, snapshot, script) ---
+
+def clean_piva(piva):
+    solo_numeri = re.sub(r'\D', '', str(piva))
+    return solo_numeri.zfill(11) if solo_numeri else ""
+
+def clean_price(price_str):
+    if isinstance(price_str, (int, float)): return float(price_str)
+    cleaned = re.sub(r'[^\d,.-]', '', str(price_str)).replace(',', '.')
+    try: return float(cleaned)
+    except: return 0.0
+
+def parse_float(val):
+    """Come clean_price ma restituisce None se il valore non è un numero (es. FORMATO vuoto)"""
+    if isinstance(val, (int, float)):
+        return None if isinstance(val, float) and math.isnan(val) else float(val)
+    try: return float(str(val).strip().replace(',', '.'))
+    except: return None
+
+def generate_short_id():
+    return str(uuid.uuid4())[:8]
+
+def sanitize_value(val):
+    """Pulisce i valori per evitare errori JSON in Google Sheets"""
+    if val is None: return ""
+    if isinstance(val, float):
+        if math.isnan(val) or math.isinf(val): return 0.0
+    return val
+
+def norm_addr(indirizzo):
+    """Indirizzo ridotto a sole lettere/cifre maiuscole, per confronti robusti"""
+    return re.sub(r'\W+', '', str(indirizzo)).upper()
+
+def norm_date(val):
+    """Data in formato ISO (YYYY-MM-DD) anche se il foglio l'ha riformattata (es. 15/01/2026)"""
+    s = str(val).strip()
+    for fmt in ("%Y-%m-%d", "%d/%m/%Y", "%d/%m/%y", "%Y/%m/%d", "%d-%m-%Y", "%d.%m.%Y"):
+        try: return datetime.strptime(s, fmt).strftime("%Y-%m-%d")
+        except: pass
+    return s
+
+def is_iso_date(val):
+    """True se val è una data valida in formato YYYY-MM-DD"""
+    try: return datetime.strptime(str(val), "%Y-%m-%d").strftime("%Y-%m-%d") == str(val)
+    except: return False
+
+# --- FILE SQLITE LOCALI (snapshot, cache, code, punti di controllo) ---
+
+SQLITE_TIMEOUT_S = 30   # attesa massima sul lock di un file SQLite condiviso fra processi
+
+@contextmanager
+def sqlite_connect(path, timeout=SQLITE_TIMEOUT_S):
+    """Connessione SQLite per un blocco: commit (o rollback su errore) e chiusura all'uscita"""
+    conn = sqlite3.connect(path, timeout=timeout)
+    try:
+        with conn: yield conn
+    finally: conn.close()
+
+# --- COLONNE DI SCONTRINI ---
+# Campo -> (posizione nelle righe scritte da ingest.build_rows, nomi possibili in intestazione).
+# Se l'intestazione nomina la colonna vale il nome (colonne spostate o aggiunte nel foglio),
+# altrimenti la posizione: così anche le righe ancora in coda (senza intestazione).
+
+SCONTRINI_COLS = {
+    "data": (0, ("Data",)),
+    "negozio": (1, ("Negozio", "Supermercato")),
+    "indirizzo": (2, ("Indirizzo",)),
+    "nome_grezzo": (3, ("Nome_Grezzo", "Nome_Scontrino", "Prodotto")),
+    "prezzo": (6, ("Prezzo_Unitario", "Prezzo Un.")),
+    "quantita": (8, ("Quantita", "Quantità", "Qta", "Qtà")),
+    "id": (10, ("ID_PRODOTTO",)),
+    "num": (11, ("Num_Scontrino", "Numero_Scontrino", "N_Scontrino")),
+}
+
+def scontrini_cols(header=()):
+    """{campo: indice di colonna} per l'intestazione data (lista o colonne di un DataFrame)"""
+    key = lambda s: re.sub(r"[\s_.]+", "", str(s)).upper()
+    pos = {key(h): i for i, h in reversed(list(enumerate(header)))}
+    return {f: next((pos[key(n)] for n in names if key(n) in pos), p) for f, (p, names) in SCONTRINI_COLS.items()}
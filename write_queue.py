@@ -0,0 +1,121 @@
+import os
+import json
+import time
+import uuid
+import random
+import threading
+from utils import sqlite_connect
+
+# --- CODA DI SCRITTURA VERSO I FOGLI (WRITE-BEHIND) ---
+# Il salvataggio mette le righe in una coda SQLite su disco e torna subito; un thread
+# in background le accoda ai fogli in blocchi unici per tabella (append_rows), in ordine
+# di arrivo. Su errore (429 di quota compreso) le righe restano in coda e si riprova con
+# backoff esponenziale. Consegna "almeno una volta": un crash fra l'append e la
+# cancellazione dalla coda può ripetere un blocco (clean_db toglie i duplicati).
+# Più processi possono svuotare la stessa coda (app e bulk_import): ogni flush prenota
+# le righe (owner + scadenza FLUSH_LEASE_S) prima di scriverle, così nessuna riga viene
+# accodata due volte; una prenotazione scaduta (processo morto) torna disponibile.
+
+QUEUE_PATH = os.environ.get("WRITE_QUEUE_PATH", os.path.join(".cache", "write_queue.db"))
+FLUSH_INTERVAL_S = float(os.environ.get("FLUSH_INTERVAL_S", "5"))
+FLUSH_MAX_ROWS = 1000           # righe per append_rows
+BACKOFF_BASE_S, BACKOFF_MAX_S = 2.0, 300.0
+FLUSH_LEASE_S = 600             # oltre questo tempo una prenotazione è considerata abbandonata
+
+
+def is_quota_error(e):
+    return getattr(getattr(e, "response", None), "status_code", None) == 429 or "429" in str(e)
+
+
+class WriteQueue:
+    def __init__(self, path=QUEUE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self.connect() as conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS pending (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, tbl TEXT, row TEXT, enqueued REAL, owner TEXT, lease_until REAL)""")
+            cols = {r[1] for r in conn.execute("PRAGMA table_info(pending)")}
+            for c, t in (("owner", "TEXT"), ("lease_until", "REAL")):
+                if c not in cols: conn.execute(f"ALTER TABLE pending ADD COLUMN {c} {t}")
+        self.stats = {"flushed": 0, "last_flush_s": None, "last_flush_at": None, "last_error": None, "retry_in_s": 0.0}
+
+    def connect(self):
+        return sqlite_connect(self.path)
+
+    def enqueue(self, batches):
+        """batches: [(tabella, [righe])], salvati in un'unica transazione e nell'ordine dato"""
+        now = time.time()
+        with self.connect() as conn:
+            for tbl, rows in batches:
+                conn.executemany("INSERT INTO pending (tbl, row, enqueued) VALUES (?, ?, ?)",
+                                 [(tbl, json.dumps(r, ensure_ascii=False), now) for r in rows])
+
+    def pending(self, tbl):
+        """Righe di tbl non ancora scritte (per non perderle nei controlli prima del flush)"""
+        with self.connect() as conn:
+            return [json.loads(r) for r, in conn.execute("SELECT row FROM pending WHERE tbl = ? ORDER BY id", (tbl,))]
+
+    def depth(self):
+        """(righe in coda, età in secondi della più vecchia)"""
+        with self.connect() as conn:
+            n, oldest = conn.execute("SELECT COUNT(*), MIN(enqueued) FROM pending").fetchone()
+        return n, (time.time() - oldest) if oldest else 0.0
+
+    def flush(self, tables, max_rows=FLUSH_MAX_ROWS):
+        """Scrive la coda: per ogni tabella (ordine di prima comparsa) un append_rows per blocco.
+        tables: {nome: worksheet} o funzione che lo restituisce. Restituisce le righe scritte; solleva al primo errore.
+        Le righe prenotate da un altro processo vengono lasciate a lui."""
+        written, owner = 0, uuid.uuid4().hex
+        while True:
+            now = time.time()
+            with self.connect() as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                free = "(lease_until IS NULL OR lease_until < ?)"
+                first = conn.execute(f"SELECT tbl FROM pending WHERE {free} ORDER BY id LIMIT 1", (now,)).fetchone()
+                if not first: return written
+                ids = conn.execute(f"SELECT id FROM pending WHERE tbl = ? AND {free} ORDER BY id LIMIT ?", (first[0], now, max_rows)).fetchall()
+                conn.executemany("UPDATE pending SET owner = ?, lease_until = ? WHERE id = ?", [(owner, now + FLUSH_LEASE_S, i) for i, in ids])
+                rows = conn.execute("SELECT id, row FROM pending WHERE owner = ? ORDER BY id", (owner,)).fetchall()
+            t0 = time.time()
+            try:
+                # Connessione ai fogli nel try: se fallisce la prenotazione si rilascia subito
+                if callable(tables): tables = tables()
+                tables[first[0]].append_rows([json.loads(r) for _, r in rows], value_input_option='USER_ENTERED')
+            except:
+                with self.connect() as conn:
+                    conn.execute("UPDATE pending SET owner = NULL, lease_until = NULL WHERE owner = ?", (owner,))
+                raise
+            with self.connect() as conn:
+                conn.execute("DELETE FROM pending WHERE owner = ?", (owner,))
+            written += len(rows)
+            self.stats.update(flushed=self.stats["flushed"] + len(rows), last_flush_s=time.time() - t0, last_flush_at=time.time())
+
+
+class Flusher:
+    """Thread che svuota la coda ogni FLUSH_INTERVAL_S (o subito con wake), con backoff sugli errori.
+    on_flush() viene chiamata dopo ogni scrittura riuscita (es. per invalidare lo snapshot)."""
+
+    def __init__(self, queue, tables, on_flush=None, interval_s=FLUSH_INTERVAL_S):
+        self.queue, self.tables, self.on_flush, self.interval_s = queue, tables, on_flush, interval_s
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sheets-flusher", daemon=True)
+        self._thread.start()
+
+    def wake(self):
+        self._wake.set()
+
+    def _run(self):
+        failures = 0
+        while True:
+            delay = self.interval_s
+            try:
+                if self.queue.flush(self.tables) and self.on_flush: self.on_flush()
+                failures = 0
+                self.queue.stats.update(last_error=None, retry_in_s=0.0)
+            except Exception as e:
+                failures += 1
+                delay = min(BACKOFF_BASE_S * 2 ** (failures - 1), BACKOFF_MAX_S) * (1 + random.random() / 2)
+                if not is_quota_error(e): delay = max(delay, self.interval_s)
+                self.queue.stats.update(last_error=f"{type(e).__name__}: {e}"[:200], retry_in_s=delay)
+            self._wake.wait(delay)
+            self._wake.clear()